@@ -8,13 +8,32 @@ Usage examples:
   python dnspyre_wrapper.py --mode doh --concurrency 4
   python dnspyre_wrapper.py --domains google.com youtube.com
   python dnspyre_wrapper.py --repeats 5
+  python dnspyre_wrapper.py --engine native --mode plain dot doh
 """
 import argparse
 import asyncio
+import collections
+import contextlib
+import csv
+import functools
+import hashlib
+import json
+import math
+import random
 import re
 import shlex
+import shutil
+import socket
+import sqlite3
+import ssl
+import statistics
+import struct
 import sys
-from typing import Optional
+import time
+import urllib.request
+from array import array
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
 
 # Default servers (можно добавить свои)
 DOH_SERVERS = [
@@ -105,12 +124,16 @@ DOH3_SERVERS = [
 ]
 
 
-DEFAULT_DOMAINS = [
+# Популярные имена: почти всегда в кеше резолвера (--rank-domains popular)
+POPULAR_DOMAINS = [
     "google.com", "youtube.com", "ya.ru", "yandex.ru", "github.com",
     "wikipedia.org", "amazon.com", "facebook.com", "microsoft.com",
     "twitter.com", "instagram.com", "linkedin.com", "netflix.com",
     "reddit.com", "tiktok.com", "vk.com", "mail.ru", "baidu.com",
     "taobao.com", "qq.com", "cloudflare.com", "akamai.com", "fastly.com",
+]
+
+DEFAULT_DOMAINS = POPULAR_DOMAINS + [
     "example.com", "example.org", "example.net", "ipv6.google.com",
     "a.root-servers.net", "dnssec-failed.org", "nonexistent.invalid"
 ]
@@ -155,24 +178,301 @@ def parse_mean_ms(text: str) -> Optional[float]:
                 continue
     return None
 
-async def run_dnspyre(semaphore: asyncio.Semaphore, dnspyre_path: str, server: str, domains: list,
-                      protocol: str, process_timeout: int, query_timeout: str, repeats: int):
-    async with semaphore:
-        cmd = [dnspyre_path]
 
+class LatencyStats(NamedTuple):
+    """Распределение задержек одного теста сервера (из JSON dnspyre или native-движка)."""
+    total: int
+    ok: int
+    io_errors: int
+    error_responses: int
+    negative_responses: int
+    min_ms: float
+    mean_ms: float
+    std_ms: float
+    p50_ms: float
+    p90_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+    qps: float
+    distribution: tuple = ()  # ((latency_ms, count), ...)
+
+
+class LatencyHistogram:
+    """
+    Компактная HDR-подобная гистограмма задержек: логарифмические корзины с шагом
+    HIST_PRECISION (относительная ошибка ~1%) от HIST_MIN_MS до HIST_MAX_MS.
+    Память фиксирована (один array на ~1.9k счетчиков) и не зависит от числа запросов.
+    """
+    HIST_MIN_MS = 0.001
+    HIST_MAX_MS = 100_000.0
+    HIST_PRECISION = 0.01
+    _LOG_STEP = math.log1p(HIST_PRECISION)
+    BUCKETS = int(math.log(HIST_MAX_MS / HIST_MIN_MS) / _LOG_STEP) + 2
+
+    __slots__ = ("counts", "count", "timeouts", "total_ms", "total_sq", "min_ms", "max_ms")
+
+    def __init__(self):
+        self.counts = array("L", bytes(array("L").itemsize * self.BUCKETS))
+        self.count = 0
+        self.timeouts = 0
+        self.total_ms = 0.0
+        self.total_sq = 0.0
+        self.min_ms = float("inf")
+        self.max_ms = 0.0
+
+    def _index(self, ms: float) -> int:
+        if ms <= self.HIST_MIN_MS:
+            return 0
+        return min(self.BUCKETS - 1, int(math.log(ms / self.HIST_MIN_MS) / self._LOG_STEP) + 1)
+
+    def _value(self, idx: int) -> float:
+        if idx == 0:
+            return self.HIST_MIN_MS
+        # Середина корзины [min*(1+p)^(i-1), min*(1+p)^i)
+        return self.HIST_MIN_MS * math.exp((idx - 0.5) * self._LOG_STEP)
+
+    def record(self, ms: float, n: int = 1):
+        self.counts[self._index(ms)] += n
+        self.count += n
+        self.total_ms += ms * n
+        self.total_sq += ms * ms * n
+        self.min_ms = min(self.min_ms, ms)
+        self.max_ms = max(self.max_ms, ms)
+
+    def record_timeout(self, n: int = 1):
+        self.timeouts += n
+
+    def merge(self, other: "LatencyHistogram"):
+        for i, c in enumerate(other.counts):
+            if c:
+                self.counts[i] += c
+        self.count += other.count
+        self.timeouts += other.timeouts
+        self.total_ms += other.total_ms
+        self.total_sq += other.total_sq
+        self.min_ms = min(self.min_ms, other.min_ms)
+        self.max_ms = max(self.max_ms, other.max_ms)
+
+    @classmethod
+    def from_distribution(cls, distribution, timeouts: int = 0) -> "LatencyHistogram":
+        """Гистограмма из latencyDistribution отчета dnspyre ((latency_ms, count), ...)."""
+        hist = cls()
+        for latency_ms, count in distribution:
+            if count:
+                hist.record(latency_ms, count)
+        hist.timeouts = timeouts
+        return hist
+
+    def to_dict(self) -> dict:
+        """Компактное JSON-представление: только непустые корзины."""
+        return {
+            "buckets": {str(i): c for i, c in enumerate(self.counts) if c},
+            "count": self.count, "timeouts": self.timeouts, "total_ms": self.total_ms,
+            "total_sq": self.total_sq, "min_ms": self.min_ms if self.count else None, "max_ms": self.max_ms,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LatencyHistogram":
+        hist = cls()
+        for i, c in data.get("buckets", {}).items():
+            hist.counts[int(i)] = c
+        hist.count, hist.timeouts = data["count"], data["timeouts"]
+        hist.total_ms, hist.total_sq = data["total_ms"], data["total_sq"]
+        hist.min_ms = data["min_ms"] if data["min_ms"] is not None else float("inf")
+        hist.max_ms = data["max_ms"]
+        return hist
+
+    @property
+    def mean(self) -> float:
+        return self.total_ms / self.count if self.count else float("nan")
+
+    @property
+    def std(self) -> float:
+        """Джиттер: стандартное отклонение задержки."""
+        if not self.count:
+            return float("nan")
+        return math.sqrt(max(0.0, self.total_sq / self.count - self.mean ** 2))
+
+    @property
+    def timeout_rate(self) -> float:
+        attempts = self.count + self.timeouts
+        return self.timeouts / attempts if attempts else 0.0
+
+    def percentile(self, q: float) -> float:
+        if not self.count:
+            return float("nan")
+        if q >= 100:
+            return self.max_ms
+        rank = max(1, math.ceil(q / 100.0 * self.count))
+        seen = 0
+        for idx, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return min(max(self._value(idx), self.min_ms), self.max_ms)
+        return self.max_ms
+
+
+class DomainMatrix:
+    """
+    Строка матрицы сервер x домен для одного сервера: по плоскому array на поле, индекс —
+    номер домена в списке прогона. ~70 байт на ячейку, так что 170 серверов x сотни доменов
+    укладываются в единицы мегабайт (полная гистограмма на ячейку заняла бы сотни).
+    """
+    COUNTERS = ("ok", "timeouts", "errors", "nxdomain", "servfail")
+    TIMINGS = ("sum_ms", "min_ms", "first_ms")
+    # Ответ "похож на кешированный", если не медленнее min задержки сервера * фактор + запас
+    CACHED_FACTOR = 1.5
+    CACHED_SLACK_MS = 2.0
+
+    __slots__ = COUNTERS + TIMINGS
+
+    def __init__(self, size: int):
+        for name in self.COUNTERS:
+            setattr(self, name, array("L", bytes(array("L").itemsize * size)))
+        for name in self.TIMINGS:
+            setattr(self, name, array("d", [math.nan]) * size)
+
+    def __len__(self):
+        return len(self.ok)
+
+    def record(self, idx: int, ms: float, rcode: int):
+        if self.ok[idx] == 0:
+            self.first_ms[idx] = self.min_ms[idx] = ms
+            self.sum_ms[idx] = 0.0
+        self.ok[idx] += 1
+        self.sum_ms[idx] += ms
+        self.min_ms[idx] = min(self.min_ms[idx], ms)
+        if rcode == 3:
+            self.nxdomain[idx] += 1
+        elif rcode == 2:
+            self.servfail[idx] += 1
+
+    def record_failure(self, idx: int, timeout: bool):
+        if timeout:
+            self.timeouts[idx] += 1
+        else:
+            self.errors[idx] += 1
+
+    def mean(self, idx: int) -> float:
+        return self.sum_ms[idx] / self.ok[idx] if self.ok[idx] else math.nan
+
+    def baseline_ms(self) -> float:
+        """Минимальная задержка сервера по всем доменам — оценка RTT до резолвера."""
+        return min((v for v in self.min_ms if not math.isnan(v)), default=math.nan)
+
+    def cache_state(self, idx: int, baseline_ms: float) -> Optional[str]:
+        """
+        Эвристика по задержкам: 'hit' — уже первый ответ быстрый; 'miss' — первый медленный
+        (резолвер рекурсировал), повторные быстрые; 'uncached' — медленные все. None — нет ответов.
+        """
+        if not self.ok[idx]:
+            return None
+        threshold = baseline_ms * self.CACHED_FACTOR + self.CACHED_SLACK_MS
+        if self.min_ms[idx] > threshold:
+            return "uncached"
+        return "miss" if self.first_ms[idx] > threshold else "hit"
+
+    def to_dict(self) -> dict:
+        return {name: [None if isinstance(v, float) and math.isnan(v) else v for v in getattr(self, name)]
+                for name in self.COUNTERS + self.TIMINGS}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DomainMatrix":
+        matrix = cls(len(data["ok"]))
+        for name in cls.COUNTERS:
+            setattr(matrix, name, array("L", data[name]))
+        for name in cls.TIMINGS:
+            setattr(matrix, name, array("d", (math.nan if v is None else v for v in data[name])))
+        return matrix
+
+
+def parse_dnspyre_json(text: str) -> Optional[LatencyStats]:
+    """
+    Разбирает отчет `dnspyre --json`. Перед JSON может быть мусор (прогресс-бар, ANSI),
+    поэтому декодируем один объект начиная с первой '{'.
+    """
+    if not text:
+        return None
+    start = text.find("{")
+    if start < 0:
+        return None
+    try:
+        data, _ = json.JSONDecoder().raw_decode(text, start)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or "latencyStats" not in data:
+        return None
+    lat = data.get("latencyStats") or {}
+    total = int(data.get("totalRequests", 0))
+    io_errors = int(data.get("totalIOErrors", 0)) + int(data.get("totalIDmismatch", 0))
+    error_responses = int(data.get("totalErrorResponses", 0))
+    dist = tuple((float(d.get("latencyMs", 0)), int(d.get("count", 0)))
+                 for d in data.get("latencyDistribution") or ())
+    return LatencyStats(
+        total=total,
+        ok=int(data.get("totalSuccessResponses", 0)) + int(data.get("totalNegativeResponses", 0)),
+        io_errors=io_errors, error_responses=error_responses,
+        negative_responses=int(data.get("totalNegativeResponses", 0)),
+        min_ms=float(lat.get("minMs", 0)), mean_ms=float(lat.get("meanMs", 0)),
+        std_ms=float(lat.get("stdMs", 0)), p50_ms=float(lat.get("p50Ms", 0)),
+        p90_ms=float(lat.get("p90Ms", 0)), p95_ms=float(lat.get("p95Ms", 0)),
+        p99_ms=float(lat.get("p99Ms", 0)), max_ms=float(lat.get("maxMs", 0)),
+        qps=float(data.get("queriesPerSecond", 0.0)), distribution=dist,
+    )
+
+
+def stats_from_histogram(hist: "LatencyHistogram", total: int, io_errors: int, error_responses: int,
+                         negative_responses: int, duration_s: float) -> Optional[LatencyStats]:
+    """Строит LatencyStats из гистограммы задержек native-движка."""
+    if not hist.count:
+        return None
+    return LatencyStats(
+        total=total, ok=hist.count, io_errors=io_errors, error_responses=error_responses,
+        negative_responses=negative_responses, min_ms=hist.min_ms, mean_ms=hist.mean, std_ms=hist.std,
+        p50_ms=hist.percentile(50), p90_ms=hist.percentile(90), p95_ms=hist.percentile(95),
+        p99_ms=hist.percentile(99), max_ms=hist.max_ms,
+        qps=total / duration_s if duration_s > 0 else 0.0,
+    )
 
+async def _dnspyre_warmup(cmd: list, process_timeout: int):
+    """Отдельный прогон dnspyre, результат которого выбрасывается (прогрев кеша резолвера)."""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    except OSError:
+        return
+    try:
+        await asyncio.wait_for(proc.wait(), timeout=process_timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+
+
+async def run_dnspyre(semaphore: asyncio.Semaphore, dnspyre_path: str, server: str, domains: list,
+                      protocol: str, process_timeout: int, query_timeout: str, repeats: int,
+                      warmup: int = 0):
+    async with semaphore:
+        base = [dnspyre_path]
         if protocol == "DoT":
-            cmd.append("--dot")
+            base.append("--dot")
         elif protocol == "DoH3":
-            cmd.extend(["--doh-protocol", "3"])
+            base.extend(["--doh-protocol", "3"])
 
         if query_timeout:
-            cmd.extend(["--request", query_timeout])
+            base.extend(["--request", query_timeout])
+
+        target = pinned_server(server, protocol)
+        if warmup > 0:
+            # У dnspyre нет исключения первых запросов из статистики, поэтому прогрев —
+            # отдельный запуск; холодное рукопожатие нового процесса он не убирает
+            await _dnspyre_warmup(base + ["-n", str(warmup), "--server", target] + list(domains), process_timeout)
 
+        cmd = base + ["--json"]
         if repeats > 1:
             cmd.extend(["-n", str(repeats)])
 
-        cmd.extend(["--server", server])
+        cmd.extend(["--server", target])
         cmd.extend(domains)
 
         start = asyncio.get_event_loop().time()
@@ -187,12 +487,14 @@ async def run_dnspyre(semaphore: asyncio.Semaphore, dnspyre_path: str, server: s
                 "server": server, "protocol": protocol, "success": False, "mean_ms": None,
                 "wall_ms": None, "stderr": f"dnspyre not found ({dnspyre_path})",
                 "cmd": " ".join(shlex.quote(p) for p in cmd), "returncode": None,
+                "stats": None, "hist": None,
             }
         except Exception as e:
              return {
                 "server": server, "protocol": protocol, "success": False, "mean_ms": None,
                 "wall_ms": None, "stderr": f"Execution error: {e}",
                 "cmd": " ".join(shlex.quote(p) for p in cmd), "returncode": None,
+                "stats": None, "hist": None,
             }
 
         try:
@@ -205,21 +507,1706 @@ async def run_dnspyre(semaphore: asyncio.Semaphore, dnspyre_path: str, server: s
                 "server": server, "protocol": protocol, "success": False, "mean_ms": None,
                 "wall_ms": wall, "stderr": f"Timeout after {process_timeout}s (Process killed)",
                 "cmd": " ".join(shlex.quote(p) for p in cmd), "returncode": None,
+                "stats": None, "hist": None,
             }
         wall = (asyncio.get_event_loop().time() - start) * 1000.0
         stdout = stdout_b.decode("utf-8", errors="replace")
         stderr = stderr_b.decode("utf-8", errors="replace")
-        mean_ms = parse_mean_ms(stdout)
-        success = (proc.returncode == 0)
+        stats = parse_dnspyre_json(stdout)
+        # Старые версии dnspyre без --json: последний шанс — эвристика по тексту
+        mean_ms = stats.mean_ms if stats is not None else parse_mean_ms(stdout)
+        success = (proc.returncode == 0) and (stats is None or stats.ok > 0)
+        hist = None
+        if stats is not None and stats.distribution:
+            hist = LatencyHistogram.from_distribution(stats.distribution, timeouts=stats.io_errors)
         return {
             "server": server, "protocol": protocol, "success": success, "mean_ms": mean_ms,
             "wall_ms": wall, "stderr": stderr.strip(),
             "cmd": " ".join(shlex.quote(p) for p in cmd), "returncode": proc.returncode,
+            "stats": stats, "hist": hist,
         }
 
-async def run_all(args):
+# --- Native engine: DNS-запросы прямо в процессе, без запуска dnspyre ---
+NATIVE_PROTOCOLS = ("Plain", "DoT", "DoH")
+
+DURATION_RE = re.compile(r"^\s*([\d.]+)\s*(ms|us|µs|s|m|h|d)?\s*$", re.IGNORECASE)
+DURATION_UNITS = {"us": 1e-6, "µs": 1e-6, "ms": 1e-3, "s": 1.0, "m": 60.0, "h": 3600.0, "d": 86400.0}
+
+RCODE_NAMES = {0: "NOERROR", 1: "FORMERR", 2: "SERVFAIL", 3: "NXDOMAIN", 4: "NOTIMP", 5: "REFUSED"}
+
+
+class DnsError(Exception):
+    """Ошибка транспорта или некорректный ответ DNS-сервера."""
+
+
+def parse_duration(value, default: float = 1.0) -> float:
+    """Go-style duration ('500ms', '1s', '1.5s', '1h') -> seconds."""
+    if value is None or value == "":
+        return default
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = DURATION_RE.match(str(value))
+    if not m:
+        return default
+    unit = (m.group(2) or "s").lower()
+    return float(m.group(1)) * DURATION_UNITS[unit]
+
+
+def build_dns_query(domain: str, qid: int, qtype: int = 1) -> bytes:
+    """Собирает DNS-запрос (RD=1, один вопрос IN <qtype>) в wire-формате."""
+    header = struct.pack("!HHHHHH", qid, 0x0100, 1, 0, 0, 0)
+    qname = b""
+    for label in domain.strip(".").split("."):
+        raw = label.encode("idna")
+        qname += bytes([len(raw)]) + raw
+    return header + qname + b"\x00" + struct.pack("!HH", qtype, 1)
+
+
+def parse_dns_header(data: bytes):
+    """Возвращает (id, rcode, truncated, ancount) из заголовка DNS-ответа."""
+    if len(data) < 12:
+        raise DnsError(f"short DNS response ({len(data)} bytes)")
+    qid, flags, _qd, ancount = struct.unpack("!HHHH", data[:8])
+    if not flags & 0x8000:
+        raise DnsError("response without QR bit")
+    return qid, flags & 0x000F, bool(flags & 0x0200), ancount
+
+
+def split_server_address(server: str, protocol: str):
+    """
+    Разбирает адрес сервера из списков серверов в (host, port, path).
+    Plain: '8.8.8.8' / '127.0.0.1:5353', DoT: 'host:853', DoH/DoH3: 'https://host[:port]/path',
+    DoQ: 'quic://host[:port]'.
+    """
+    if "://" in server:
+        u = urlsplit(server)
+        if not u.hostname:
+            raise DnsError(f"invalid server URL: {server}")
+        path = (u.path or "/") + (f"?{u.query}" if u.query else "")
+        return u.hostname, u.port or (853 if u.scheme == "quic" else 443), path
+    default_port = 853 if protocol == "DoT" else 53
+    if server.startswith("["):  # [ipv6]:port
+        host, _, rest = server[1:].partition("]")
+        return host, int(rest.lstrip(":") or default_port), None
+    if server.count(":") == 1:
+        host, port = server.rsplit(":", 1)
+        return host, int(port), None
+    return server, default_port, None
+
+
+# --- Каталоги серверов из файлов, дедупликация и общий кеш bootstrap-резолва ---
+CATALOG_PROTOCOLS = {"doh": "DoH", "dot": "DoT", "plain": "Plain", "doq": "DoQ", "doh3": "DoH3"}
+
+# host -> [(family, sockaddr), ...]: имена серверов резолвятся один раз до замеров
+_RESOLVED = {}
+
+
+def _is_ip(host: str) -> bool:
+    try:
+        socket.inet_pton(socket.AF_INET6 if ":" in host else socket.AF_INET, host)
+        return True
+    except OSError:
+        return False
+
+
+async def resolve_cached(host: str, port: int, timeout: float) -> list:
+    """[(family, sockaddr), ...] для host:port; имя резолвится один раз на процесс."""
+    if _is_ip(host):
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        return [(family, (host, port))]
+    if host not in _RESOLVED:
+        infos = await asyncio.wait_for(
+            asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM), timeout)
+        addrs = []
+        for family, _type, _proto, _name, sockaddr in infos:
+            if (family, sockaddr[0]) not in ((f, a[0]) for f, a in addrs):
+                addrs.append((family, sockaddr))
+        _RESOLVED[host] = addrs
+    return [(family, (sockaddr[0], port) + tuple(sockaddr[2:])) for family, sockaddr in _RESOLVED[host]]
+
+
+async def bootstrap_resolve(jobs: list, timeout: float, concurrency: int) -> dict:
+    """
+    Резолвит имена всех серверов заранее (вне замеров) и заполняет общий кеш.
+    Возвращает {(protocol, server): [ip, ...]}; для нерезолвящихся серверов — пустой список.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _one(job):
+        async with semaphore:
+            try:
+                host, port, _path = split_server_address(job[1], job[0])
+                return [sockaddr[0] for _f, sockaddr in await resolve_cached(host, port, timeout)]
+            except (OSError, asyncio.TimeoutError, DnsError, ValueError, UnicodeError):
+                return []
+
+    addresses = await asyncio.gather(*(_one(j) for j in jobs))
+    return dict(zip(jobs, addresses))
+
+
+def pinned_server(server: str, protocol: str) -> str:
+    """
+    Адрес для dnspyre: у Plain-сервера с уже резолвленным именем — 'ip:port', чтобы процесс
+    не резолвил его сам. TLS-протоколам имя нужно для SNI и проверки сертификата.
+    """
+    if protocol != "Plain":
+        return server
+    try:
+        host, port, _path = split_server_address(server, protocol)
+    except (DnsError, ValueError):
+        return server
+    if _is_ip(host) or not _RESOLVED.get(host):
+        return server
+    ip = _RESOLVED[host][0][1][0]
+    return f"[{ip}]:{port}" if ":" in ip else f"{ip}:{port}"
+
+
+def dedup_jobs(jobs: list, addresses: dict):
+    """
+    Убирает повторы одного и того же endpoint: тот же протокол, порт и путь и пересекающиеся
+    адреса (dns.google:853 и 8.8.8.8:853). У TLS-протоколов разные имена на общих IP — разные
+    сервисы (SNI/Host: фильтрующие профили, DoH за CDN), поэтому совпадать должно и имя,
+    если только одна из сторон не задана IP-адресом. Остается первый по списку; возвращает
+    (jobs, [(protocol, server, дубликат_чего)]).
+    """
+    kept, dropped = [], []
+    by_addr, by_name = {}, {}  # (protocol, port, path, ip) [+ имя или None для IP] -> первый job
+    for job in jobs:
+        protocol, server = job
+        host, port, path = split_server_address(server, protocol)
+        name = None if protocol == "Plain" or _is_ip(host) else host.lower().rstrip(".")
+        bases = [(protocol, port, path, ip) for ip in addresses.get(job) or ()]
+        if name is None:
+            candidates = [by_addr.get(b) for b in bases]
+        else:
+            candidates = [by_name.get(b + (n,)) for b in bases for n in (name, None)]
+        owner = next((c for c in candidates if c is not None), None)
+        if owner is not None:
+            dropped.append((protocol, server, owner[1]))
+            continue
+        kept.append(job)
+        for b in bases:
+            by_addr.setdefault(b, job)
+            by_name.setdefault(b + (name,), job)
+    return kept, dropped
+
+
+def load_server_catalogs(paths: list) -> dict:
+    """
+    Читает каталоги серверов (JSON или YAML, YAML требует PyYAML):
+        {"doh": ["https://...", {"address": "https://...", "tags": {"region": "eu"}}], "dot": [...], ...}
+    Ключи — имена протоколов из --mode. Возвращает {proto_name: [(server, tags), ...]},
+    повторы одного адреса в нескольких файлах склеиваются (теги объединяются).
+    """
+    catalog = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as fh:
+            text = fh.read()
+        if path.lower().endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f"{path}: YAML catalogs need PyYAML (pip install pyyaml), or use JSON")
+            data = yaml.safe_load(text)
+        else:
+            data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError(f"{path}: expected a mapping of protocol -> server list")
+        for key, entries in data.items():
+            proto_name = CATALOG_PROTOCOLS.get(str(key).lower())
+            if proto_name is None:
+                raise ValueError(f"{path}: unknown protocol '{key}' (expected {', '.join(CATALOG_PROTOCOLS)})")
+            servers = catalog.setdefault(proto_name, {})
+            for entry in entries or ():
+                if isinstance(entry, str):
+                    address, tags = entry, {}
+                elif isinstance(entry, dict) and "address" in entry:
+                    address, tags = entry["address"], entry.get("tags") or {}
+                else:
+                    raise ValueError(f"{path}: bad {key} entry {entry!r}")
+                servers.setdefault(str(address), {}).update({str(k): str(v).lower() for k, v in tags.items()})
+    return {proto: list(servers.items()) for proto, servers in catalog.items()}
+
+
+def match_tags(tags: dict, wanted: list) -> bool:
+    """--tag key=value: все условия должны совпасть (значения без учета регистра)."""
+    for condition in wanted:
+        key, _, value = condition.partition("=")
+        if tags.get(key) != value.lower():
+            return False
+    return True
+
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.waiters = {}
+
+    def datagram_received(self, data, addr):
+        if len(data) >= 2:
+            fut = self.waiters.pop(struct.unpack("!H", data[:2])[0], None)
+            if fut is not None and not fut.done():
+                fut.set_result(data)
+
+    def error_received(self, exc):
+        for fut in self.waiters.values():
+            if not fut.done():
+                fut.set_exception(exc)
+        self.waiters.clear()
+
+
+class UdpDnsClient:
+    """Plain DNS поверх UDP с повтором через TCP при TC=1."""
+
+    def __init__(self, host: str, port: int, timeout: float):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.transport = self.protocol = None
+        self.timings = {}
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        family, addr = (await resolve_cached(self.host, self.port, self.timeout))[0]
+        self.transport, self.protocol = await loop.create_datagram_endpoint(
+            _UdpProtocol, remote_addr=addr, family=family)
+
+    async def query(self, wire: bytes) -> bytes:
+        fut = asyncio.get_running_loop().create_future()
+        self.protocol.waiters[struct.unpack("!H", wire[:2])[0]] = fut
+        self.transport.sendto(wire)
+        try:
+            data = await asyncio.wait_for(fut, self.timeout)
+        finally:
+            self.protocol.waiters.pop(struct.unpack("!H", wire[:2])[0], None)
+        if parse_dns_header(data)[2]:
+            tcp = TcpDnsClient(self.host, self.port, self.timeout)
+            try:
+                await tcp.connect()
+                return await tcp.query(wire)
+            finally:
+                tcp.close()
+        return data
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class TcpDnsClient:
+    """DNS поверх TCP (RFC 7766) или TLS (DoT, RFC 7858) с переиспользованием соединения."""
+
+    def __init__(self, host: str, port: int, timeout: float, ssl_context=None):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.ssl_context = ssl_context
+        self.reader = self.writer = None
+        self.addr = None
+        self.timings = {}
+
+    async def connect(self):
+        """
+        Соединение по шагам, чтобы разделить их стоимость в self.timings:
+        резолв имени (из общего кеша, если он уже заполнен), TCP connect и
+        TLS-рукопожатие (tls_ms = None для голого TCP).
+        """
+        loop = asyncio.get_running_loop()
+        t0 = time.perf_counter()
+        addrs = await resolve_cached(self.host, self.port, self.timeout)
+        t1 = time.perf_counter()
+        sock, last_error = None, None
+        for family, addr in addrs:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                await asyncio.wait_for(loop.sock_connect(sock, addr), self.timeout)
+                self.addr = addr
+                break
+            except (OSError, asyncio.TimeoutError) as e:
+                sock.close()
+                sock, last_error = None, e
+        if sock is None:
+            raise last_error or DnsError(f"no addresses for {self.host}")
+        t2 = time.perf_counter()
+        kwargs = {}
+        if self.ssl_context is not None:
+            kwargs = {"ssl": self.ssl_context, "server_hostname": self.host}
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(sock=sock, **kwargs), self.timeout)
+        except BaseException:
+            sock.close()
+            raise
+        t3 = time.perf_counter()
+        self.timings = {
+            "resolve_ms": (t1 - t0) * 1000.0, "tcp_ms": (t2 - t1) * 1000.0,
+            "tls_ms": (t3 - t2) * 1000.0 if self.ssl_context is not None else None,
+        }
+
+    @property
+    def ssl_object(self):
+        return self.writer.get_extra_info("ssl_object") if self.writer is not None else None
+
+    async def query(self, wire: bytes) -> bytes:
+        if self.writer is None or self.writer.is_closing():
+            await self.connect()
+        self.writer.write(struct.pack("!H", len(wire)) + wire)
+
+        async def _read():
+            length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+            return await self.reader.readexactly(length)
+
+        try:
+            return await asyncio.wait_for(_read(), self.timeout)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            self.close()
+            raise DnsError(f"connection closed: {e}")
+        except BaseException:
+            # Таймаут или отмена: опоздавший ответ иначе прочитается как ответ на следующий запрос
+            self.close()
+            raise
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class DohClient(TcpDnsClient):
+    """
+    DoH (RFC 8484, POST application/dns-message) поверх одного keep-alive TLS-соединения.
+    HTTP/2 в стандартной библиотеке нет, поэтому используется HTTP/1.1.
+    """
+
+    def __init__(self, host: str, port: int, path: str, timeout: float, ssl_context):
+        super().__init__(host, port, timeout, ssl_context)
+        self.path = path
+        # Нестандартный порт входит в Host (RFC 9110 7.2), IPv6-литерал — в скобках
+        authority = f"[{host}]" if ":" in host else host
+        self.host_header = authority if port == 443 else f"{authority}:{port}"
+
+    async def query(self, wire: bytes) -> bytes:
+        if self.writer is None or self.writer.is_closing():
+            await self.connect()
+        request = (
+            f"POST {self.path} HTTP/1.1\r\nHost: {self.host_header}\r\n"
+            "Content-Type: application/dns-message\r\nAccept: application/dns-message\r\n"
+            f"Content-Length: {len(wire)}\r\nConnection: keep-alive\r\n\r\n"
+        ).encode("ascii") + wire
+        self.writer.write(request)
+        try:
+            status, keep_alive, body = await asyncio.wait_for(self._read_response(), self.timeout)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            self.close()
+            raise DnsError(f"HTTP error: {e}")
+        except BaseException:
+            self.close()
+            raise
+        if not keep_alive:
+            self.close()
+        if status != 200:
+            raise DnsError(f"HTTP {status}")
+        return body
+
+    async def _read_response(self):
+        """(status, keep_alive, body); без Content-Length и chunked тело читается до закрытия соединения."""
+        status_line = await self.reader.readuntil(b"\r\n")
+        status = int(status_line.split(b" ", 2)[1])
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = headers.get("connection", "").lower() != "close"
+        if 100 <= status < 200 or status in (204, 304):
+            body = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                body += chunk[:-2]
+        elif "content-length" in headers:
+            body = await self.reader.readexactly(int(headers["content-length"]))
+        else:
+            body, keep_alive = await self.reader.read(), False
+        return status, keep_alive, body
+
+
+def make_native_client(server: str, protocol: str, timeout: float):
+    host, port, path = split_server_address(server, protocol)
+    if protocol == "Plain":
+        return UdpDnsClient(host, port, timeout)
+    ctx = ssl.create_default_context()
+    if protocol == "DoT":
+        ctx.set_alpn_protocols(["dot"])
+        return TcpDnsClient(host, port, timeout, ctx)
+    if protocol == "DoH":
+        ctx.set_alpn_protocols(["http/1.1"])
+        return DohClient(host, port, path, timeout, ctx)
+    raise DnsError(f"protocol {protocol} is not supported by the native engine")
+
+
+def _tls_resume_probe(addr, host: str, ctx: ssl.SSLContext, session, timeout: float):
+    """
+    Блокирующее повторное TLS-подключение с сессией первого соединения (для executor):
+    asyncio не умеет передавать session. Возвращает (resumed, handshake_ms).
+    0-RTT (early data) модуль ssl не поддерживает, поэтому проверяется только возобновление.
+    """
+    with socket.create_connection(addr[:2], timeout) as raw:
+        t0 = time.perf_counter()
+        with ctx.wrap_socket(raw, server_hostname=host, session=session) as tls:
+            return tls.session_reused, (time.perf_counter() - t0) * 1000.0
+
+
+async def measure_connection(client, domain: str) -> dict:
+    """
+    Стоимость холодного старта на свежем соединении: шаги connect() из client.timings,
+    первый запрос (в статистику не попадает) и cold_ms = TCP + TLS + первый запрос
+    (резолв имени сервера не входит). Для TLS дополнительно проверяется возобновление сессии.
+    """
+    conn = dict(client.timings, first_query_ms=None, cold_ms=None, resumed=None, resume_tls_ms=None)
+    t0 = time.perf_counter()
+    try:
+        parse_dns_header(await client.query(build_dns_query(domain, random.getrandbits(16))))
+    except (OSError, asyncio.TimeoutError, DnsError, UnicodeError):
+        return conn
+    conn["first_query_ms"] = (time.perf_counter() - t0) * 1000.0
+    conn["cold_ms"] = (conn.get("tcp_ms") or 0.0) + (conn.get("tls_ms") or 0.0) + conn["first_query_ms"]
+    ssl_obj = getattr(client, "ssl_object", None)
+    if ssl_obj is not None:
+        conn["tls_version"] = ssl_obj.version()
+        # В TLS 1.3 тикет приходит после рукопожатия — к этому моменту он уже прочитан
+        session = ssl_obj.session
+        if session is not None and (session.has_ticket or ssl_obj.version() != "TLSv1.3"):
+            try:
+                conn["resumed"], conn["resume_tls_ms"] = await asyncio.wait_for(
+                    asyncio.get_running_loop().run_in_executor(
+                        None, _tls_resume_probe, client.addr, client.host, client.ssl_context,
+                        session, client.timeout),
+                    client.timeout * 2)
+            except (OSError, asyncio.TimeoutError, ValueError):
+                pass
+        else:
+            conn["resumed"] = False
+    return conn
+
+
+def random_subdomain(zone: str) -> str:
+    """Уникальное имя под зоной: его нет ни в одном кеше, резолверу придется рекурсировать."""
+    return f"cb-{random.getrandbits(64):016x}.{zone.strip('.')}"
+
+
+async def _bust_queries(client, zone: str, count: int, hist: LatencyHistogram, rcodes: dict):
+    for _ in range(count):
+        qid = random.getrandbits(16)
+        t0 = time.perf_counter()
+        try:
+            rid, rcode, _tc, _an = parse_dns_header(await client.query(build_dns_query(random_subdomain(zone), qid)))
+            if rid != qid:
+                raise DnsError("ID mismatch")
+        except asyncio.TimeoutError:
+            hist.record_timeout()
+            continue
+        except (OSError, DnsError, UnicodeError):
+            rcodes["error"] = rcodes.get("error", 0) + 1
+            continue
+        hist.record((time.perf_counter() - t0) * 1000.0)
+        name = RCODE_NAMES.get(rcode, str(rcode))
+        rcodes[name] = rcodes.get(name, 0) + 1
+
+
+async def run_native(semaphore: asyncio.Semaphore, server: str, domains: list, protocol: str,
+                     query_timeout: str, repeats: int, warmup: int = 0, conn_split: bool = False,
+                     per_domain: bool = False, rank_domains: Optional[list] = None,
+                     cache_bust: Optional[str] = None, bust_queries: int = 0):
+    """
+    Аналог run_dnspyre без внешнего процесса: открывает одно соединение к серверу,
+    последовательно отправляет repeats * len(domains) запросов и замеряет каждый отдельно.
+    Первые warmup проходов по доменам идут по тому же соединению и в статистику не попадают.
+    conn_split: первый запрос соединения замеряется отдельно (measure_connection), и
+    гистограмма содержит только теплые запросы по переиспользованному соединению.
+    per_domain: каждый ответ дополнительно попадает в ячейку DomainMatrix своего домена.
+    rank_domains: в статистику ранжирования (гистограмма, ошибки) идут только эти домены,
+    остальные — только в матрицу.
+    cache_bust: после каждого прохода по доменам отправляется доля из bust_queries запросов
+    к уникальным случайным поддоменам зоны cache_bust — резолвер обязан рекурсировать,
+    их задержки идут в отдельную гистограмму bust_hist.
+    """
+    async with semaphore:
+        timeout = parse_duration(query_timeout)
+        cmd = f"native {protocol} {server}"
+        start = time.perf_counter()
+        hist, errors, rcodes = LatencyHistogram(), {}, {}
+        conn = None
+        matrix = DomainMatrix(len(domains)) if per_domain else None
+        bust_hist, bust_rcodes = (LatencyHistogram(), {}) if cache_bust else (None, {})
+        ranked = [not rank_domains or d in rank_domains for d in domains]
+        try:
+            client = make_native_client(server, protocol, timeout)
+            await client.connect()
+        except (OSError, asyncio.TimeoutError, DnsError, ValueError, UnicodeError) as e:
+            return {
+                "server": server, "protocol": protocol, "success": False, "mean_ms": None,
+                "wall_ms": (time.perf_counter() - start) * 1000.0,
+                "stderr": f"Connect error: {str(e) or type(e).__name__}",
+                "cmd": cmd, "returncode": None, "rcodes": {},
+                "stats": None, "hist": None,
+            }
+        try:
+            if conn_split:
+                conn = await measure_connection(client, domains[0])
+            for _ in range(warmup):
+                for domain in domains:
+                    try:
+                        await client.query(build_dns_query(domain, random.getrandbits(16)))
+                    except (OSError, asyncio.TimeoutError, DnsError, UnicodeError):
+                        pass
+            for pass_no in range(repeats):
+                for idx, domain in enumerate(domains):
+                    qid = random.getrandbits(16)
+                    t0 = time.perf_counter()
+                    try:
+                        data = await client.query(build_dns_query(domain, qid))
+                        rid, rcode, _tc, _an = parse_dns_header(data)
+                        if rid != qid:
+                            raise DnsError("ID mismatch")
+                    except (OSError, asyncio.TimeoutError, DnsError, UnicodeError) as e:
+                        timed_out = isinstance(e, asyncio.TimeoutError)
+                        if matrix is not None:
+                            matrix.record_failure(idx, timed_out)
+                        if not ranked[idx]:
+                            continue
+                        if timed_out:
+                            kind = "timeout"
+                            hist.record_timeout()
+                        else:
+                            kind = str(e) or type(e).__name__
+                        errors[kind] = errors.get(kind, 0) + 1
+                        continue
+                    elapsed_ms = (time.perf_counter() - t0) * 1000.0
+                    if matrix is not None:
+                        matrix.record(idx, elapsed_ms, rcode)
+                    if not ranked[idx]:
+                        continue
+                    hist.record(elapsed_ms)
+                    name = RCODE_NAMES.get(rcode, str(rcode))
+                    rcodes[name] = rcodes.get(name, 0) + 1
+                if cache_bust:
+                    share = bust_queries // repeats + (1 if pass_no < bust_queries % repeats else 0)
+                    await _bust_queries(client, cache_bust, share, bust_hist, bust_rcodes)
+        finally:
+            client.close()
+
+        wall = (time.perf_counter() - start) * 1000.0
+        total = repeats * sum(ranked)
+        stderr = ""
+        if errors:
+            failed = sum(errors.values())
+            stderr = f"{failed}/{total} queries failed: " + ", ".join(f"{k} x{v}" for k, v in errors.items())
+        error_responses = sum(v for k, v in rcodes.items() if k not in ("NOERROR", "NXDOMAIN"))
+        stats = stats_from_histogram(hist, total, sum(errors.values()), error_responses,
+                                   rcodes.get("NXDOMAIN", 0), wall / 1000.0)
+        return {
+            "server": server, "protocol": protocol, "success": hist.count > 0,
+            "mean_ms": stats.mean_ms if stats else None,
+            "wall_ms": wall, "stderr": stderr, "cmd": cmd, "returncode": None,
+            "rcodes": rcodes, "stats": stats, "hist": hist, "conn": conn, "matrix": matrix,
+            "bust_hist": bust_hist, "bust_rcodes": bust_rcodes,
+        }
+
+PROBE_DOMAIN = "example.com"
+
+
+async def probe_server(server: str, protocol: str, timeout: float, dnspyre_path: str = "dnspyre") -> Optional[str]:
+    """
+    Быстрая проверка доступности перед полным тестом. Возвращает None, если сервер жив,
+    иначе причину. Plain — один UDP-запрос; DoT/DoH — TCP connect; DoH3 — TCP connect
+    на тот же порт (h3-серверы отдают и h2); DoQ — один запрос через dnspyre (QUIC в stdlib нет).
+    """
+    try:
+        host, port, _path = split_server_address(server, protocol)
+        if protocol == "DoQ":
+            # Резолва имени мало: имя может резолвиться, а слушателя на порту нет
+            r = await run_dnspyre(asyncio.Semaphore(1), dnspyre_path, server, [PROBE_DOMAIN], protocol,
+                                  timeout + 2.0, f"{timeout * 1000:.0f}ms", 1)
+            if r["success"]:
+                return None
+            lines = r["stderr"].splitlines()
+            return lines[-1] if lines else f"no answer within {timeout:g}s"
+        if protocol == "Plain":
+            client = UdpDnsClient(host, port, timeout)
+            try:
+                await client.connect()
+                parse_dns_header(await client.query(build_dns_query(PROBE_DOMAIN, random.getrandbits(16))))
+            finally:
+                client.close()
+        else:
+            _family, addr = (await resolve_cached(host, port, timeout))[0]
+            _reader, writer = await asyncio.wait_for(asyncio.open_connection(addr[0], port), timeout)
+            writer.close()
+    except asyncio.TimeoutError:
+        return f"no answer within {timeout:g}s"
+    except (OSError, DnsError, ValueError, UnicodeError) as e:
+        return str(e) or type(e).__name__
+    return None
+
+
+async def preprobe(jobs: list, timeout: float, concurrency: int, dnspyre_path: str = "dnspyre"):
+    """Параллельно проверяет [(protocol, server), ...]; возвращает (живые, [(protocol, server, причина)])."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _one(job):
+        async with semaphore:
+            return await probe_server(job[1], job[0], timeout, dnspyre_path)
+
+    reasons = await asyncio.gather(*(_one(j) for j in jobs))
+    alive = [j for j, why in zip(jobs, reasons) if why is None]
+    pruned = [(j[0], j[1], why) for j, why in zip(jobs, reasons) if why is not None]
+    return alive, pruned
+
+
+class AdaptiveLimiter:
+    """
+    Бюджет параллелизма одного протокола (AIMD). Сигнал перегрузки — задержка "канарейки":
+    первый успешно измеренный сервер протокола раз в "окно" (limit завершенных тестов)
+    перемеряется под текущей нагрузкой, и его P50 сравнивается с его же лучшим значением.
+    Разные серверы между собой не сравниваются: расстояние и промахи кеша — не перегрузка.
+    Пока P50 канарейки в пределах baseline * tolerance, лимит растет примерно на 1 за окно;
+    выше — лимит умножается на backoff, а результаты, пришедшие до следующей спокойной
+    проверки, перемеряются.
+    """
+
+    def __init__(self, name: str, initial: int, max_limit: int, min_limit: int = 1,
+                 tolerance: float = 1.3, backoff: float = 0.7):
+        self.name = name
+        self.window = float(max(min_limit, min(initial, max_limit)))
+        self.min_limit, self.max_limit = min_limit, max_limit
+        self.tolerance, self.backoff = tolerance, backoff
+        self.in_flight = 0
+        self.peak = self.limit
+        self.canary = None     # make_coro сервера-канарейки
+        self.baseline = None   # лучший P50 канарейки (мс)
+        self.overloaded = False
+        self.since_check = 0
+        self.checking = False
+        self.decreases = 0
+        self.remeasured = 0
+        self._cond = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self.window)
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    @staticmethod
+    def p50(result: dict) -> Optional[float]:
+        st = result.get("stats")
+        return st.p50_ms if st is not None and st.ok else None
+
+    def is_contaminated(self, result: dict) -> bool:
+        """Результат пришел, пока канарейка показывала перегрузку, — его стоит перемерить."""
+        return self.overloaded and self.p50(result) is not None
+
+    async def observe(self, result: dict, make_coro=None) -> bool:
+        """
+        Учитывает завершенный тест; лимит растет, пока перегрузки нет.
+        True — пора перемерить канарейку (раз в окно, не больше одной проверки одновременно).
+        """
+        async with self._cond:
+            if self.canary is None and make_coro is not None and self.p50(result) is not None:
+                self.canary = make_coro
+            if not self.overloaded and self.window < self.max_limit:
+                self.window = min(float(self.max_limit), self.window + 1.0 / self.limit)
+                self.peak = max(self.peak, self.limit)
+            self.since_check += 1
+            due = self.canary is not None and not self.checking and self.since_check >= self.limit
+            if due:
+                self.checking, self.since_check = True, 0
+            self._cond.notify_all()
+        return due
+
+    async def check_canary(self):
+        """Перемеряет канарейку под текущей нагрузкой и сдвигает лимит по ее P50."""
+        try:
+            p50 = self.p50(await self.canary())
+        finally:
+            self.checking = False
+        if p50 is None:
+            return  # канарейка не ответила: о перегрузке это ничего не говорит
+        async with self._cond:
+            if self.baseline is None or p50 < self.baseline:
+                # База только опускается: иначе медленная деградация "переучила" бы ее
+                self.baseline = p50
+            if p50 > self.baseline * self.tolerance:
+                self.window = max(float(self.min_limit), self.window * self.backoff)
+                self.decreases += 1
+                self.overloaded = True
+            else:
+                self.overloaded = False
+            self._cond.notify_all()
+
+
+async def _run_limited(limiter: AdaptiveLimiter, make_coro):
+    """Запускает тест под адаптивным лимитом; результат, снятый при перегрузке, перемеряется один раз."""
+    result = await make_coro()
+    if await limiter.observe(result, make_coro):
+        await limiter.check_canary()
+    if limiter.is_contaminated(result):
+        limiter.remeasured += 1
+        result = await make_coro()
+        if await limiter.observe(result):
+            await limiter.check_canary()
+    return result
+
+
+SORT_METRICS = {
+    "mean": ("MEAN", None), "p50": ("P50", 50), "p90": ("P90", 90),
+    "p99": ("P99", 99), "p999": ("P99.9", 99.9),
+}
+
+
+def metric_value(r: dict, metric: str) -> Optional[float]:
+    """Значение метрики ранжирования: из гистограммы, иначе из LatencyStats/mean_ms."""
+    q = SORT_METRICS[metric][1]
+    if q is None:
+        return r["mean_ms"]
+    hist, st = r.get("hist"), r.get("stats")
+    if hist is not None and hist.count:
+        return hist.percentile(q)
+    if st is not None:
+        # Без гистограммы есть только перцентили из отчета dnspyre; остальные не измерены
+        return {50: st.p50_ms, 90: st.p90_ms, 99: st.p99_ms}.get(q)
+    return None
+
+
+def rank_key(r: dict, sort_by: str):
+    """
+    Ключ сортировки: измеренная метрика; затем серверы без нее (по среднему — в одном
+    порядке с измеренными метрики не смешиваются); затем fallback на wall-clock; затем провалы.
+    """
+    value = metric_value(r, sort_by)
+    if value is not None:
+        return (0, value)
+    if r["mean_ms"] is not None:
+        return (1, r["mean_ms"])
+    if r["wall_ms"] is not None:
+        return (2, r["wall_ms"])
+    return (3, float("inf"))
+
+
+def top_by_protocol(results_sorted: list, sort_by: str, n: int = 5) -> dict:
+    """Первые n успешных результатов каждого протокола из уже отсортированного списка."""
+    top = {}
+    # Используем только успешные результаты с реальной измеренной задержкой
+    for r in results_sorted:
+        if r["success"] and metric_value(r, sort_by) is not None:
+            bucket = top.setdefault(r["protocol"], [])
+            if len(bucket) < n:
+                bucket.append(r)
+    return top
+
+
+class LiveBoard:
+    """
+    Живая таблица лидеров во время прогона. В терминале перерисовывается на месте
+    (не чаще LIVE_REFRESH_S): прогресс, ETA, общий топ и топ-5 по протоколам.
+    Если stdout не TTY — просто строка на каждый готовый результат.
+    """
+    LIVE_REFRESH_S = 0.2
+    LIVE_TOP = 10
+
+    def __init__(self, total: int, sort_by: str, protocols: list, stream=None):
+        self.total, self.sort_by, self.protocols = total, sort_by, protocols
+        self.stream = stream or sys.stdout
+        self.tty = self.stream.isatty()
+        self.results = []
+        self.start = time.perf_counter()
+        self._lines = 0
+        self._last_render = 0.0
+
+    def update(self, r: dict):
+        self.results.append(r)
+        if not self.tty:
+            value = metric_value(r, self.sort_by)
+            lat = f"{value:.2f} ms" if value is not None else "FAIL"
+            print(f"[{len(self.results)}/{self.total}] {r['protocol']:5} {r['server']} {lat}",
+                  file=self.stream, flush=True)
+            return
+        now = time.perf_counter()
+        if now - self._last_render >= self.LIVE_REFRESH_S or len(self.results) == self.total:
+            self._last_render = now
+            self._render()
+
+    def _progress_line(self) -> str:
+        done = len(self.results)
+        elapsed = time.perf_counter() - self.start
+        eta = elapsed / done * (self.total - done) if done else float("nan")
+        width = 30
+        filled = int(width * done / self.total) if self.total else width
+        eta_str = f"{eta:.0f}s" if done else "?"
+        return (f"[{'#' * filled}{'.' * (width - filled)}] {done}/{self.total}"
+                f"  elapsed {elapsed:.0f}s  ETA {eta_str}")
+
+    def _render(self):
+        label = SORT_METRICS[self.sort_by][0]
+        ranked = sorted(self.results, key=lambda r: rank_key(r, self.sort_by))
+        lines = [self._progress_line(), f"{'#':>3}  {'PROTO':5}  {'SERVER':45}  {label + '(ms)':>10}"]
+        for idx, r in enumerate([r for r in ranked if metric_value(r, self.sort_by) is not None][:self.LIVE_TOP], 1):
+            lines.append(f"{idx:>3}  {r['protocol']:5}  {r['server']:45.45}  {metric_value(r, self.sort_by):>10.2f}")
+        top = top_by_protocol(ranked, self.sort_by)
+        for proto in self.protocols:
+            leaders = ", ".join(f"{r['server']} {metric_value(r, self.sort_by):.1f}" for r in top.get(proto, []))
+            lines.append(f"{proto:5}  {leaders or '-'}")
+        cols, rows = shutil.get_terminal_size()
+        lines = [l[:cols - 1] for l in lines[:max(1, rows - 2)]]
+        self.clear()
+        self.stream.write("\n".join(lines) + "\n")
+        self.stream.flush()
+        self._lines = len(lines)
+
+    def clear(self):
+        """Стирает нарисованную таблицу (перед перерисовкой или итоговым отчетом)."""
+        if self.tty and self._lines:
+            self.stream.write(f"\x1b[{self._lines}F\x1b[J")
+            self.stream.flush()
+            self._lines = 0
+
+
+def bootstrap_ci(hist: LatencyHistogram, metric: str, iterations: int, confidence: float,
+                 rng: random.Random):
+    """
+    Бутстреп-интервал метрики по гистограмме: выборки того же размера с возвращением
+    из корзин (веса — счетчики). Возвращает (low, high) или None, если данных мало.
+    """
+    if hist is None or hist.count < 2 or iterations <= 0:
+        return None
+    values, cum, acc = [], [], 0
+    for idx, c in enumerate(hist.counts):
+        if c:
+            acc += c
+            values.append(min(max(hist._value(idx), hist.min_ms), hist.max_ms))
+            cum.append(acc)
+    n, q = hist.count, SORT_METRICS[metric][1]
+    estimates = []
+    for _ in range(iterations):
+        sample = rng.choices(values, cum_weights=cum, k=n)
+        if q is None:
+            estimates.append(sum(sample) / n)
+        else:
+            sample.sort()
+            estimates.append(sample[min(n, max(1, math.ceil(q / 100.0 * n))) - 1])
+    estimates.sort()
+    alpha = (1.0 - confidence) / 2.0
+    lo = estimates[int(alpha * (iterations - 1))]
+    hi = estimates[int(math.ceil((1.0 - alpha) * (iterations - 1)))]
+    return lo, hi
+
+
+def assign_tiers(results_sorted: list, sort_by: str, iterations: int, confidence: float):
+    """
+    Проставляет r["ci"] и r["tier"]: серверы, чей интервал пересекается с интервалом
+    лидера текущего уровня, статистически неотличимы от него и получают тот же уровень.
+    """
+    rng = random.Random(0)  # воспроизводимые интервалы между запусками
+    tier, leader_hi = 0, None
+    for r in results_sorted:
+        r["ci"] = bootstrap_ci(r.get("hist"), sort_by, iterations, confidence, rng) if r["success"] else None
+        r["tier"] = None
+        if r["ci"] is None:
+            continue
+        if leader_hi is None or r["ci"][0] > leader_hi:
+            tier += 1
+            leader_hi = r["ci"][1]
+        r["tier"] = tier
+
+
+def result_metrics(r: dict) -> dict:
+    """Плоский набор метрик результата (None, если метрика не измерена): для таблицы, БД и экспорта."""
+    st, hist = r.get("stats"), r.get("hist")
+    m = dict.fromkeys(("p50_ms", "p90_ms", "p99_ms", "p999_ms", "jitter_ms", "timeout_rate", "errors"))
+    m["mean_ms"] = r["mean_ms"]
+    if hist is not None and hist.count:
+        m["p50_ms"], m["p90_ms"], m["p99_ms"], m["p999_ms"] = (hist.percentile(q) for q in (50, 90, 99, 99.9))
+        m["jitter_ms"], m["timeout_rate"] = hist.std, hist.timeout_rate
+    elif st is not None:
+        m["p50_ms"], m["p90_ms"], m["p99_ms"], m["jitter_ms"] = st.p50_ms, st.p90_ms, st.p99_ms, st.std_ms
+        m["timeout_rate"] = st.io_errors / st.total if st.total else None
+    if st is not None:
+        m["errors"] = st.io_errors + st.error_responses
+    return m
+
+
+def result_to_json(r: dict) -> dict:
+    """Результат теста -> JSON-совместимый dict (для чекпоинтов и передачи между процессами)."""
+    out = dict(r)
+    if r.get("stats") is not None:
+        out["stats"] = r["stats"]._asdict()
+    if r.get("hist") is not None:
+        out["hist"] = r["hist"].to_dict()
+    if r.get("matrix") is not None:
+        out["matrix"] = r["matrix"].to_dict()
+    if r.get("bust_hist") is not None:
+        out["bust_hist"] = r["bust_hist"].to_dict()
+    return out
+
+
+def result_from_json(data: dict) -> dict:
+    r = dict(data)
+    if data.get("stats") is not None:
+        st = dict(data["stats"])
+        st["distribution"] = tuple(tuple(x) for x in st.get("distribution") or ())
+        r["stats"] = LatencyStats(**st)
+    if data.get("hist") is not None:
+        r["hist"] = LatencyHistogram.from_dict(data["hist"])
+    if data.get("matrix") is not None:
+        r["matrix"] = DomainMatrix.from_dict(data["matrix"])
+    if data.get("bust_hist") is not None:
+        r["bust_hist"] = LatencyHistogram.from_dict(data["bust_hist"])
+    return r
+
+
+# --- Чекпоинты прогона: каждый результат дописывается в JSONL сразу по готовности ---
+DEFAULT_CHECKPOINT_PATH = ".dnspyre_checkpoint.jsonl"
+CHECKPOINT_KEEP_S = 7 * 86400  # более старые записи выбрасываются при открытии файла
+
+
+def sweep_config_key(args, domains: list) -> str:
+    """Результаты переиспользуются только при тех же условиях замера."""
+    parts = [args.engine, domain_set_key(domains), str(args.repeats), str(args.query_timeout), str(args.warmup),
+             str(args.conn_split), str(args.per_domain), " ".join(args.rank_domains or ()),
+             str(args.cache_bust), str(args.cache_bust_queries)]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:12]
+
+
+class Checkpoint:
+    """
+    Журнал прогона в JSONL: строки {"type": "result", ...} по мере готовности и
+    {"type": "done", ...} в конце прогона. Незавершенный последний прогон можно
+    продолжить (--resume), свежие результаты любых прогонов — переиспользовать (--max-age).
+    """
+
+    def __init__(self, path: str, config: str):
+        self.path, self.config = path, config
+        self.entries = []
+        self.sweep_id = None
+        self._fh = None
+
+    def load(self):
+        now = time.time()
+        kept = []
+        try:
+            with open(self.path, encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # оборванная при прерывании строка
+                    if now - entry.get("ts", 0) <= CHECKPOINT_KEEP_S:
+                        kept.append(entry)
+        except FileNotFoundError:
+            return
+        self.entries = kept
+        # Компактизация: переписываем файл без устаревших/битых строк
+        with open(self.path, "w", encoding="utf-8") as fh:
+            for entry in kept:
+                fh.write(json.dumps(entry) + "\n")
+
+    def cached(self, resume: bool, max_age_s: Optional[float]) -> dict:
+        """
+        {(protocol, server): result} из незавершенного прогона и/или не старше max_age_s.
+        Берутся только успешные результаты: упавшие серверы тестируются заново.
+        """
+        mine = [e for e in self.entries if e.get("config") == self.config]
+        ok = [e for e in mine if e["type"] == "result" and e["result"].get("success")]
+        found = {}
+        if max_age_s is not None:
+            now = time.time()
+            for e in ok:
+                if now - e["ts"] <= max_age_s:
+                    found[(e["result"]["protocol"], e["result"]["server"])] = e["result"]
+        if resume:
+            sweeps = [e["sweep"] for e in mine]
+            done = {e["sweep"] for e in mine if e["type"] == "done"}
+            if sweeps and sweeps[-1] not in done:
+                self.sweep_id = sweeps[-1]
+                for e in ok:
+                    if e["sweep"] == self.sweep_id:
+                        found[(e["result"]["protocol"], e["result"]["server"])] = e["result"]
+        return {k: dict(result_from_json(v), cached=True) for k, v in found.items()}
+
+    def _write(self, entry: dict):
+        if self._fh is None:
+            self._fh = open(self.path, "a", encoding="utf-8")
+        self._fh.write(json.dumps(entry) + "\n")
+        self._fh.flush()
+
+    def add(self, result: dict):
+        if self.sweep_id is None:
+            self.sweep_id = f"{time.time():.6f}"
+        self._write({"type": "result", "ts": time.time(), "config": self.config,
+                     "sweep": self.sweep_id, "result": result_to_json(result)})
+
+    def done(self):
+        if self.sweep_id is not None:
+            self._write({"type": "done", "ts": time.time(), "config": self.config, "sweep": self.sweep_id})
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+# --- Хранилище результатов (SQLite) для истории и трендов ---
+DEFAULT_DB_PATH = "dnspyre_history.sqlite3"
+HISTORY_METRICS = ("mean_ms", "p50_ms", "p90_ms", "p99_ms", "p999_ms", "jitter_ms", "timeout_rate", "errors")
+
+DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY, ts REAL NOT NULL, domain_set TEXT NOT NULL,
+    domains TEXT NOT NULL, engine TEXT, repeats INTEGER
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id), ts REAL NOT NULL,
+    server TEXT NOT NULL, protocol TEXT NOT NULL, domain_set TEXT NOT NULL,
+    success INTEGER NOT NULL, wall_ms REAL,
+    mean_ms REAL, p50_ms REAL, p90_ms REAL, p99_ms REAL, p999_ms REAL,
+    jitter_ms REAL, timeout_rate REAL, errors INTEGER
+);
+CREATE INDEX IF NOT EXISTS results_by_server ON results(server, protocol, domain_set, ts);
+"""
+
+
+def domain_set_key(domains: list) -> str:
+    """Стабильный короткий ключ набора доменов (порядок не важен)."""
+    return hashlib.sha1("\n".join(sorted(set(domains))).encode("utf-8")).hexdigest()[:12]
+
+
+def open_store(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.executescript(DB_SCHEMA)
+    return conn
+
+
+def store_results(path: str, results: list, domains: list, engine: str, repeats: int) -> int:
+    """Сохраняет результаты одного прогона одной транзакцией (после замеров, вне тайминга)."""
+    ts = time.time()
+    dset = domain_set_key(domains)
+    conn = open_store(path)
+    try:
+        with conn:
+            run_id = conn.execute(
+                "INSERT INTO runs (ts, domain_set, domains, engine, repeats) VALUES (?, ?, ?, ?, ?)",
+                (ts, dset, " ".join(domains), engine, repeats)).lastrowid
+            rows = []
+            for r in results:
+                m = result_metrics(r)
+                rows.append((run_id, ts, r["server"], r["protocol"], dset, int(bool(r["success"])), r["wall_ms"],
+                             *(m[k] for k in HISTORY_METRICS)))
+            conn.executemany(
+                f"INSERT INTO results (run_id, ts, server, protocol, domain_set, success, wall_ms, "
+                f"{', '.join(HISTORY_METRICS)}) VALUES ({', '.join('?' * (7 + len(HISTORY_METRICS)))})", rows)
+    finally:
+        conn.close()
+    return run_id
+
+
+def show_history(args) -> int:
+    """
+    --history: для каждого сервера — последнее значение метрики сортировки, скользящая медиана
+    предыдущих --history-window прогонов и флаг регрессии (рост больше --regression-pct).
+    """
+    domains = args.domains if args.domains else DEFAULT_DOMAINS
+    metric = {"mean": "mean_ms", "p50": "p50_ms", "p90": "p90_ms", "p99": "p99_ms", "p999": "p999_ms"}[args.sort_by]
+    since = time.time() - args.history_days * 86400
+    try:
+        conn = open_store(args.db)
+    except sqlite3.Error as e:
+        print(f"Cannot open history DB {args.db}: {e}")
+        return 1
+    try:
+        rows = conn.execute(
+            f"SELECT server, protocol, ts, {metric} FROM results "
+            "WHERE domain_set = ? AND ts >= ? AND success = 1 AND " + metric + " IS NOT NULL "
+            "ORDER BY server, protocol, ts", (domain_set_key(domains), since)).fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        print(f"No history for this domain set in {args.db} (last {args.history_days:g} days).")
+        return 1
+
+    series = {}
+    for server, proto, ts, value in rows:
+        series.setdefault((proto, server), []).append((ts, value))
+
+    report = []
+    for (proto, server), points in series.items():
+        last_ts, last = points[-1]
+        previous = [v for _ts, v in points[-1 - args.history_window:-1]]
+        median = statistics.median(previous) if previous else None
+        change = (last - median) / median * 100.0 if median else None
+        report.append((proto, server, len(points), last_ts, last, median, change))
+    # Регрессии сверху, затем по последнему значению
+    report.sort(key=lambda x: (not (x[6] is not None and x[6] > args.regression_pct), x[4]))
+
+    label = SORT_METRICS[args.sort_by][0]
+    header = (f"{'PROTO':5}  {'SERVER':45}  {'RUNS':>4}  {'LAST RUN':16}  {'LAST ' + label:>10}"
+              f"  {'MEDIAN':>8}  {'CHANGE':>8}")
+    print(f"--- History: {args.db}, domain set {domain_set_key(domains)}, last {args.history_days:g} days, "
+          f"rolling median of {args.history_window} previous runs ---")
+    print(header)
+    print("-" * (len(header) + 12))
+    for proto, server, runs, last_ts, last, median, change in report:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(last_ts))
+        med = "-" if median is None else f"{median:.2f}"
+        chg = "-" if change is None else f"{change:+.1f}%"
+        flag = "  REGRESSION" if change is not None and change > args.regression_pct else ""
+        print(f"{proto:5}  {server:45.45}  {runs:>4}  {when:16}  {last:>10.2f}  {med:>8}  {chg:>8}{flag}")
+    return 0
+
+
+# --- Машиночитаемый экспорт (JSON/CSV/NDJSON) и Prometheus-экспортер ---
+OUTPUT_FORMATS = ("table", "json", "csv", "ndjson")
+EXPORT_FIELDS = ("protocol", "server", "vantage", "success", "cached", "wall_ms") + HISTORY_METRICS + (
+    "tier", "ci_low", "ci_high", "resolve_ms", "tcp_ms", "tls_ms", "first_query_ms", "cold_ms",
+    "resumed", "resume_tls_ms", "recursion_p50_ms", "recursion_p90_ms", "recursion_mean_ms",
+    "recursion_timeout_rate", "recursion_cost_ms", "stderr")
+CONN_FIELDS = ("resolve_ms", "tcp_ms", "tls_ms", "first_query_ms", "cold_ms", "resumed", "resume_tls_ms")
+
+
+def _finite(value):
+    """NaN/inf -> None: в JSON их нет, а Prometheus они только запутают."""
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+
+def export_row(r: dict) -> dict:
+    """Плоская запись результата для экспорта: полные имя сервера и stderr, без обрезки."""
+    row = {"protocol": r["protocol"], "server": r["server"], "vantage": r.get("vantage"),
+           "success": bool(r["success"]), "cached": bool(r.get("cached")), "wall_ms": r["wall_ms"]}
+    row.update(result_metrics(r))
+    ci = r.get("ci")
+    row["tier"], row["ci_low"], row["ci_high"] = r.get("tier"), ci[0] if ci else None, ci[1] if ci else None
+    conn = r.get("conn") or {}
+    row.update((k, conn.get(k)) for k in CONN_FIELDS)
+    row.update(recursion_metrics(r))
+    row["stderr"] = r.get("stderr") or ""
+    return {k: _finite(row[k]) for k in EXPORT_FIELDS}
+
+
+def matrix_export(r: dict, domains: list) -> dict:
+    """Ячейки DomainMatrix результата по именам доменов (для json/ndjson)."""
+    matrix = r["matrix"]
+    baseline = matrix.baseline_ms()
+    cells = {}
+    for idx, domain in enumerate(domains[:len(matrix)]):
+        cells[domain] = {
+            "ok": matrix.ok[idx], "timeouts": matrix.timeouts[idx], "errors": matrix.errors[idx],
+            "nxdomain": matrix.nxdomain[idx], "servfail": matrix.servfail[idx],
+            "mean_ms": _finite(matrix.mean(idx)), "min_ms": _finite(matrix.min_ms[idx]),
+            "first_ms": _finite(matrix.first_ms[idx]), "cache": matrix.cache_state(idx, baseline),
+        }
+    return cells
+
+
+def write_export(fmt: str, results_sorted: list, stream, meta: dict):
+    rows = [export_row(r) for r in results_sorted]
+    if fmt in ("json", "ndjson"):
+        # Матрица по доменам есть только в JSON-форматах: в CSV она не ложится в одну строку
+        for row, r in zip(rows, results_sorted):
+            if r.get("matrix") is not None:
+                row["per_domain"] = matrix_export(r, meta["domains"])
+    if fmt == "json":
+        json.dump(dict(meta, results=rows), stream, ensure_ascii=False, indent=2)
+        stream.write("\n")
+    elif fmt == "ndjson":
+        for row in rows:
+            stream.write(json.dumps(row, ensure_ascii=False) + "\n")
+    elif fmt == "csv":
+        writer = csv.DictWriter(stream, fieldnames=EXPORT_FIELDS, lineterminator="\n")
+        writer.writeheader()
+        writer.writerows(rows)
+    stream.flush()
+
+
+def export_results(args, results_sorted: list, domains: list, sweep_s: float):
+    """--output и --serve-metrics: отдает результаты прогона наружу (таблица идет в stderr)."""
+    if args.output != "table":
+        meta = {"generated": time.time(), "sort_by": args.sort_by, "engine": args.engine,
+                "domains": domains, "repeats": args.repeats, "sweep_s": sweep_s}
+        write_export(args.output, results_sorted, sys.__stdout__, meta)
+    exporter = getattr(args, "exporter", None)
+    if exporter is not None:
+        exporter.update(results_sorted, sweep_s)
+
+
+def _prom_labels(**labels) -> str:
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items() if v is not None) + "}"
+
+
+class PrometheusExporter:
+    """
+    Метрики последнего прогона в текстовом формате Prometheus. Задержки — gauge в секундах
+    (квантили и среднее), ошибки и запросы — счетчики, накопленные за все прогоны процесса.
+    """
+    QUANTILES = (("0.5", "p50_ms"), ("0.9", "p90_ms"), ("0.99", "p99_ms"), ("0.999", "p999_ms"))
+
+    def __init__(self):
+        self.latest = []
+        self.errors_total = {}   # (protocol, server, vantage) -> число ошибок
+        self.queries_total = {}
+        self.sweeps = 0
+        self.sweep_s = None
+        self.last_ts = None
+
+    def update(self, results_sorted: list, sweep_s: float):
+        self.latest = [export_row(r) for r in results_sorted if not r.get("cached")]
+        for r in results_sorted:
+            if r.get("cached"):
+                continue
+            key = (r["protocol"], r["server"], r.get("vantage"))
+            st = r.get("stats")
+            failed = (st.io_errors + st.error_responses) if st is not None else int(not r["success"])
+            self.errors_total[key] = self.errors_total.get(key, 0) + failed
+            self.queries_total[key] = self.queries_total.get(key, 0) + (st.total if st is not None else 0)
+        self.sweeps += 1
+        self.sweep_s, self.last_ts = sweep_s, time.time()
+
+    def render(self) -> str:
+        out = []
+
+        def family(name: str, kind: str, help_text: str, samples):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(f"{name}{labels} {float(value)!r}" for labels, value in samples)
+
+        def series(field: str, scale: float = 1.0, **extra):
+            for row in self.latest:
+                if row.get(field) is not None:
+                    yield (_prom_labels(protocol=row["protocol"], server=row["server"],
+                                        vantage=row["vantage"], **extra), row[field] * scale)
+
+        family("dns_resolver_up", "gauge", "1 if the last sweep got answers from the server.",
+               ((_prom_labels(protocol=r["protocol"], server=r["server"], vantage=r["vantage"]),
+                 1.0 if r["success"] else 0.0) for r in self.latest))
+        quantiles = []
+        for q, field in self.QUANTILES:
+            quantiles.extend(series(field, 0.001, quantile=q))
+        family("dns_resolver_latency_seconds", "gauge", "Query latency quantiles of the last sweep.", quantiles)
+        family("dns_resolver_latency_mean_seconds", "gauge", "Mean query latency of the last sweep.",
+               series("mean_ms", 0.001))
+        family("dns_resolver_jitter_seconds", "gauge", "Standard deviation of query latency.",
+               series("jitter_ms", 0.001))
+        family("dns_resolver_timeout_ratio", "gauge", "Share of queries that timed out in the last sweep.",
+               series("timeout_rate"))
+        family("dns_resolver_cold_start_seconds", "gauge", "TCP + TLS + first query of a fresh connection.",
+               series("cold_ms", 0.001))
+        recursion = []
+        for q, field in (("0.5", "recursion_p50_ms"), ("0.9", "recursion_p90_ms")):
+            recursion.extend(series(field, 0.001, quantile=q))
+        family("dns_resolver_recursion_latency_seconds", "gauge",
+               "Latency of unique random subdomains (--cache-bust), i.e. a forced recursion.", recursion)
+        family("dns_resolver_errors_total", "counter", "Failed queries (I/O errors and error responses).",
+               ((_prom_labels(protocol=p, server=s, vantage=v), float(n))
+                for (p, s, v), n in self.errors_total.items()))
+        family("dns_resolver_queries_total", "counter", "Queries sent.",
+               ((_prom_labels(protocol=p, server=s, vantage=v), float(n))
+                for (p, s, v), n in self.queries_total.items()))
+        family("dns_benchmark_sweeps_total", "counter", "Finished sweeps.", [("", float(self.sweeps))])
+        if self.last_ts is not None:
+            family("dns_benchmark_sweep_duration_seconds", "gauge", "Wall time of the last sweep.",
+                   [("", self.sweep_s)])
+            family("dns_benchmark_last_sweep_timestamp_seconds", "gauge", "Unix time the last sweep finished.",
+                   [("", self.last_ts)])
+        return "\n".join(out) + "\n"
+
+
+async def serve_metrics(args) -> int:
+    """--serve-metrics: HTTP /metrics для Prometheus, прогон повторяется каждые --metrics-interval секунд."""
+    host, port = parse_host_port(args.serve_metrics, default_host="0.0.0.0")
+    exporter = args.exporter = PrometheusExporter()
+    # Как в --watch: без чекпоинта, иначе файл растет с каждым прогоном, пока процесс жив
+    args.live, args.checkpoint = False, ""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            while (await asyncio.wait_for(reader.readline(), 10)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", exporter.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"try /metrics\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body)
+            await writer.drain()
+        except (OSError, asyncio.TimeoutError, UnicodeError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    print(f"--- Serving Prometheus metrics on http://{host}:{port}/metrics, "
+          f"sweep every {args.metrics_interval:g}s (Ctrl+C to stop) ---")
+    async with server:
+        while True:
+            started = time.monotonic()
+            try:
+                await run_all(args)
+            except Exception as e:
+                print(f"--- Sweep failed: {e} ---")
+            await asyncio.sleep(max(0.0, args.metrics_interval - (time.monotonic() - started)))
+
+
+# --- Режим наблюдения (--watch): периодические замеры закрепленных серверов и алерты ---
+WATCH_ALERT_EXIT = 3
+RESOLVE_REFRESH_S = 3600.0  # в долгом режиме адреса серверов перерезолвятся раз в час
+
+
+class WatchMonitor:
+    """
+    Скользящее окно последних --watch-window раундов на сервер: deque фиксированной длины,
+    в которой от раунда хранятся только непустые корзины гистограммы (десятки пар вместо
+    ~1.9k счетчиков), поэтому память мала и не растет со временем работы. После каждого
+    раунда P95 и доля ошибок по окну сравниваются с порогами; событие выдается только при
+    смене состояния (alert / recovered), а не на каждом раунде.
+    """
+
+    def __init__(self, args, stream):
+        self.args, self.stream = args, stream
+        self.windows = {}   # (protocol, server) -> deque[(buckets, count, min_ms, max_ms, p95, attempts, failures)]
+        self.alerting = set()
+        self.pending = []   # события для webhook, отправляются после раунда
+        self.alerted = False
+        self.rounds = 0
+
+    def planned_queries(self) -> int:
+        """Сколько запросов шлет раунд (repeats x ранжируемые домены)."""
+        domains = self.args.rank_domains or self.args.domains or DEFAULT_DOMAINS
+        return max(1, self.args.repeats * len(domains))
+
+    def round_sample(self, r: dict) -> tuple:
+        hist, st = r.get("hist"), r.get("stats")
+        if st is not None and st.total:
+            attempts, failures = st.total, st.total - st.ok
+        else:
+            # Раунд без статистики (ошибка соединения, таймаут процесса) весит как полный раунд:
+            # иначе полный отказ сервера тонет в окне из успешных раундов
+            attempts = self.planned_queries()
+            failures = 0 if r["success"] else attempts
+        p95 = st.p95_ms if st is not None and st.ok else None
+        if hist is None or not hist.count:
+            return (), 0, 0.0, 0.0, p95, attempts, failures
+        buckets = tuple((i, c) for i, c in enumerate(hist.counts) if c)
+        return buckets, hist.count, hist.min_ms, hist.max_ms, p95, attempts, failures
+
+    @staticmethod
+    def window_stats(window) -> tuple:
+        merged = LatencyHistogram()
+        for buckets, count, min_ms, max_ms, _p95, _a, _f in window:
+            if count:
+                for i, c in buckets:
+                    merged.counts[i] += c
+                merged.count += count
+                merged.min_ms, merged.max_ms = min(merged.min_ms, min_ms), max(merged.max_ms, max_ms)
+        if merged.count:
+            p95 = merged.percentile(95)
+        else:
+            # dnspyre без latencyDistribution: медиана P95 раундов
+            values = [sample[4] for sample in window if sample[4] is not None]
+            p95 = statistics.median(values) if values else None
+        attempts = sum(sample[5] for sample in window)
+        fail_rate = sum(sample[6] for sample in window) / attempts if attempts else 0.0
+        return p95, fail_rate
+
+    def update(self, results_sorted: list, sweep_s: float):
+        self.rounds += 1
+        for r in results_sorted:
+            key = (r["protocol"], r["server"])
+            window = self.windows.setdefault(key, collections.deque(maxlen=self.args.watch_window))
+            window.append(self.round_sample(r))
+            p95, fail_rate = self.window_stats(window)
+            reasons = []
+            if self.args.alert_p95 is not None and p95 is not None and p95 > self.args.alert_p95:
+                reasons.append(f"p95 {p95:.1f} ms > {self.args.alert_p95:g} ms")
+            if self.args.alert_fail_rate is not None and fail_rate > self.args.alert_fail_rate:
+                reasons.append(f"failure rate {fail_rate:.1%} > {self.args.alert_fail_rate:.1%}")
+            if reasons and key not in self.alerting:
+                self.alerting.add(key)
+                self.alerted = True
+                self.emit("alert", key, p95, fail_rate, len(window), "; ".join(reasons))
+            elif not reasons and key in self.alerting:
+                self.alerting.discard(key)
+                self.emit("recovered", key, p95, fail_rate, len(window), "back under thresholds")
+        print(f"--- Watch round {self.rounds}: {len(results_sorted)} servers in {sweep_s:.1f}s, "
+              f"{len(self.alerting)} alerting ---")
+
+    def emit(self, kind: str, key: tuple, p95, fail_rate: float, rounds: int, reason: str):
+        event = {
+            "ts": time.time(), "event": kind, "protocol": key[0], "server": key[1],
+            "p95_ms": _finite(p95), "fail_rate": fail_rate, "window_rounds": rounds, "reason": reason,
+            "thresholds": {"p95_ms": self.args.alert_p95, "fail_rate": self.args.alert_fail_rate},
+        }
+        self.stream.write(json.dumps(event, ensure_ascii=False) + "\n")
+        self.stream.flush()
+        if self.args.alert_webhook:
+            self.pending.append(event)
+
+    async def flush(self):
+        """POST накопленных событий на --alert-webhook (ошибки доставки не прерывают наблюдение)."""
+        events, self.pending = self.pending, []
+        loop = asyncio.get_running_loop()
+        for event in events:
+            try:
+                await loop.run_in_executor(None, _post_json, self.args.alert_webhook, event)
+            except (OSError, ValueError) as e:
+                print(f"--- Webhook {self.args.alert_webhook} failed: {e} ---")
+
+
+def _post_json(url: str, payload: dict, timeout: float = 5.0):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"), method="POST",
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+
+
+async def watch(args) -> int:
+    """
+    --watch: раунд run_all каждые --watch-interval секунд. В stdout — только JSON-строки
+    событий (main перенаправляет служебный вывод в stderr). Чекпоинт и живая таблица выключены,
+    чтобы за дни работы ничего не росло.
+    """
+    monitor = args.exporter = WatchMonitor(args, sys.__stdout__)
+    args.live, args.checkpoint = False, ""
+    resolved_at = time.monotonic()
+    print(f"--- Watching every {args.watch_interval:g}s, window {args.watch_window} rounds "
+          f"(p95 > {args.alert_p95}, failure rate > {args.alert_fail_rate}) ---")
+    while True:
+        started = time.monotonic()
+        if started - resolved_at >= RESOLVE_REFRESH_S:
+            _RESOLVED.clear()
+            resolved_at = started
+        try:
+            await run_all(args)
+        except Exception as e:
+            print(f"--- Watch round failed: {e} ---")
+        await monitor.flush()
+        if args.alert_exit and monitor.alerted:
+            return WATCH_ALERT_EXIT
+        await asyncio.sleep(max(0.0, args.watch_interval - (time.monotonic() - started)))
+
+
+# --- Распределенный режим: координатор раздает серверы воркерам на разных машинах ---
+# Протокол: JSON-строки поверх TCP. Координатор -> воркер: одна строка-задание
+# {"jobs": [[protocol, server], ...], "domains": [...], "args": {...}}; воркер -> координатор:
+# {"type": "result", "vantage": ..., "result": {...}} по мере готовности и {"type": "done", ...}.
+# Аутентификации нет: слушать только в доверенной сети.
+WORKER_ARG_KEYS = ("engine", "repeats", "query_timeout", "process_timeout", "concurrency",
+                   "adaptive", "max_concurrency", "warmup", "conn_split", "per_domain", "rank_domains",
+                   "cache_bust", "cache_bust_queries")
+STREAM_LIMIT = 16 * 1024 * 1024
+
+
+def parse_host_port(value: str, default_host: str = "127.0.0.1"):
+    """'9300' / 'host:9300' / '[::1]:9300' -> (host, port)."""
+    if value.startswith("["):
+        host, _, port = value[1:].partition("]")
+        return host, int(port.lstrip(":"))
+    if ":" in value:
+        host, port = value.rsplit(":", 1)
+        return host or default_host, int(port)
+    return default_host, int(value)
+
+
+async def _send_line(writer, message: dict):
+    writer.write((json.dumps(message) + "\n").encode("utf-8"))
+    await writer.drain()
+
+
+async def serve_worker(args) -> int:
+    """--worker: принимает задания координатора и стримит результаты обратно."""
+    host, port = parse_host_port(args.worker)
+    vantage = args.vantage or f"{socket.gethostname()}:{port}"
+
+    async def handle(reader, writer):
+        peer = writer.get_extra_info("peername")
+        try:
+            request = json.loads(await reader.readline())
+            job_args = argparse.Namespace(**vars(args))
+            for key in WORKER_ARG_KEYS:
+                if key in request.get("args", {}):
+                    setattr(job_args, key, request["args"][key])
+            jobs = [tuple(j) for j in request["jobs"]]
+            print(f"--- Job from {peer}: {len(jobs)} servers ---")
+            await bootstrap_resolve(jobs, job_args.probe_timeout, job_args.probe_concurrency)
+            tasks, _ = build_tasks(job_args, jobs, request["domains"])
+            async for r in _iter_completed(tasks):
+                await _send_line(writer, {"type": "result", "vantage": vantage, "result": result_to_json(r)})
+            await _send_line(writer, {"type": "done", "vantage": vantage})
+            print(f"--- Job from {peer} finished ---")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"--- Job from {peer} aborted: {e} ---")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port, limit=STREAM_LIMIT)
+    print(f"--- Worker '{vantage}' listening on {host}:{port} (Ctrl+C to stop) ---")
+    async with server:
+        await server.serve_forever()
+    return 0
+
+
+async def _iter_workers(args, jobs: list, domains: list):
+    """
+    Раздает задания воркерам и отдает результаты по мере прихода (с полем "vantage").
+    shard: серверы делятся между воркерами; задания упавшего воркера переходят к живым.
+    replicate: каждый воркер тестирует все серверы (сравнение точек измерения).
+    """
+    replicate = args.distribute == "replicate"
+    queue = asyncio.Queue()
+    request_args = {k: getattr(args, k) for k in WORKER_ARG_KEYS}
+
+    async def feed(addr: str, shard: list):
+        pending = set(shard)
+        writer = None
+        try:
+            host, port = parse_host_port(addr)
+            reader, writer = await asyncio.open_connection(host, port, limit=STREAM_LIMIT)
+            await _send_line(writer, {"jobs": [list(j) for j in shard], "domains": domains, "args": request_args})
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionError("connection closed before the job finished")
+                message = json.loads(line)
+                if message["type"] == "done":
+                    return addr, True, []
+                r = result_from_json(message["result"])
+                r["vantage"] = message["vantage"]
+                pending.discard((r["protocol"], r["server"]))
+                await queue.put(r)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"--- Worker {addr} failed: {e} ({len(pending)} servers unfinished) ---")
+            return addr, False, sorted(pending)
+        finally:
+            if writer is not None:
+                writer.close()
+            await queue.put(None)
+
+    if replicate:
+        assignments = {addr: list(jobs) for addr in args.workers}
+    else:
+        assignments = {addr: jobs[i::len(args.workers)] for i, addr in enumerate(args.workers)}
+    while assignments:
+        feeders = [asyncio.ensure_future(feed(addr, shard))
+                   for addr, shard in assignments.items() if shard]
+        remaining = len(feeders)
+        while remaining:
+            item = await queue.get()
+            if item is None:
+                remaining -= 1
+                continue
+            yield item
+        outcomes = [f.result() for f in feeders]
+        healthy = [addr for addr, ok, _ in outcomes if ok]
+        leftovers = [tuple(j) for _, ok, pending in outcomes if not ok for j in pending]
+        if replicate or not leftovers:
+            break
+        if not healthy:
+            print(f"--- No healthy workers left, {len(leftovers)} servers were not tested ---")
+            break
+        print(f"--- Reassigning {len(leftovers)} servers to {len(healthy)} healthy workers ---")
+        assignments = {addr: leftovers[i::len(healthy)] for i, addr in enumerate(healthy)}
+
+
+async def run_coordinator(args, jobs: list, domains: list, tested_protocols: list,
+                          cached: dict, checkpoint, pruned: list) -> int:
+    replicate = args.distribute == "replicate"
+    total = len(jobs) * (len(args.workers) if replicate else 1)
+    print(f"\n--- Distributing {len(jobs)} servers to {len(args.workers)} workers ({args.distribute}) ---")
+    results, sweep_s = await collect_results(
+        args, _iter_workers(args, jobs, domains), total, tested_protocols, checkpoint)
+    if not replicate:
+        return print_report(args, results, cached, pruned, {}, tested_protocols, domains, sweep_s)
+    print_vantage_comparison(args, results, sweep_s)
+    export_results(args, sorted(results, key=lambda r: rank_key(r, args.sort_by)), domains, sweep_s)
+    return 0
+
+
+def print_vantage_comparison(args, results: list, sweep_s: float):
+    """Сводная таблица replicate-режима: сервер x точка измерения по метрике --sort-by."""
+    sort_by = getattr(args, "sort_by", "mean")
+    label = SORT_METRICS[sort_by][0]
+    vantages = sorted({r["vantage"] for r in results})
+    matrix = {}
+    for r in results:
+        matrix.setdefault((r["protocol"], r["server"]), {})[r["vantage"]] = metric_value(r, sort_by)
+
+    def best(values: dict) -> float:
+        measured = [v for v in values.values() if v is not None]
+        return min(measured) if measured else float("inf")
+
+    rows = sorted(matrix.items(), key=lambda kv: best(kv[1]))
+    if not args.full and len(rows) > 50:
+        print(f"--- Top 50 servers (use --full to see all {len(rows)}) ---")
+        rows = rows[:50]
+    header = f"{'PROTO':5}  {'SERVER':45}" + "".join(f"  {v[:14]:>14}" for v in vantages) + f"  {'BEST AT':14}"
+    sep = "-" * len(header)
+    print(f"--- Per-vantage comparison by {label} (ms) ---")
+    print(sep)
+    print(header)
+    print(sep)
+    for (proto, server), values in rows:
+        cells = "".join(
+            f"  {'-' if values.get(v) is None else format(values[v], '.2f'):>14}" for v in vantages)
+        measured = {v: x for v, x in values.items() if x is not None}
+        best_at = min(measured, key=measured.get)[:14] if measured else "-"
+        print(f"{proto:5}  {server:45.45}{cells}  {best_at:14}")
+    print(sep)
+    for v in vantages:
+        mine = [r for r in results if r["vantage"] == v]
+        print(f"{v}: {sum(1 for r in mine if r['success'])}/{len(mine)} successful")
+    print(f"Wall time: {sweep_s:.1f}s")
+
+
+def build_tasks(args, jobs: list, domains: list):
+    """Корутины тестов для [(protocol, server), ...] и адаптивные лимитеры (если --adaptive)."""
     semaphore = asyncio.Semaphore(args.concurrency)
+    limiters = {}
     tasks = []
+    for proto_name, s in jobs:
+        gate = semaphore
+        if args.adaptive:
+            # Отдельный бюджет на протокол: DoT-рукопожатия не должны душить Plain UDP
+            if proto_name not in limiters:
+                limiters[proto_name] = AdaptiveLimiter(proto_name, args.concurrency, args.max_concurrency)
+            gate = limiters[proto_name]
+        if args.engine == "native" and proto_name in NATIVE_PROTOCOLS:
+            make_coro = functools.partial(
+                run_native, gate, s, domains, proto_name, args.query_timeout, args.repeats, args.warmup,
+                args.conn_split, args.per_domain, args.rank_domains, args.cache_bust, args.cache_bust_queries)
+        else:
+            make_coro = functools.partial(
+                run_dnspyre, gate, args.dnspyre, s, domains, proto_name,
+                args.process_timeout, args.query_timeout, args.repeats, args.warmup)
+        tasks.append(_run_limited(gate, make_coro) if args.adaptive else make_coro())
+    return tasks, limiters
+
+
+async def run_all(args):
     # Если domains не задан через CLI, используем DEFAULT_DOMAINS
     domains = args.domains if args.domains else DEFAULT_DOMAINS
 
@@ -234,35 +2221,134 @@ async def run_all(args):
         "doh3": ("DoH3", args.doh3_list),
     }
     tested_protocols = []
+    jobs = []
 
     # Фильтрация серверов
     for mode, (proto_name, server_list) in protocol_map.items():
         if run_all_protocols or mode in modes:
             tested_protocols.append(proto_name)
-            for s in server_list:
-                tasks.append(run_dnspyre(
-                    semaphore, args.dnspyre, s, domains, proto_name,
-                    args.process_timeout, args.query_timeout, args.repeats
-                ))
-
-    if not tasks:
-        print("No tasks to run. Check --mode.")
+            jobs.extend((proto_name, s) for s in server_list)
+
+    if args.tag:
+        jobs = [j for j in jobs if match_tags(args.server_tags.get(j, {}), args.tag)]
+    if args.pin:
+        jobs = [j for j in jobs if j[1] in args.pin]
+
+    if not jobs:
+        print("No tasks to run. Check --mode" + (", --tag and --pin." if args.tag or args.pin else "."))
         return 1
 
+    # Имена серверов резолвятся один раз до замеров: время резолва не попадает в задержки
+    resolve_start = time.perf_counter()
+    addresses = await bootstrap_resolve(jobs, args.probe_timeout, args.probe_concurrency)
+    unresolved = sum(1 for a in addresses.values() if not a)
+    print(f"--- Bootstrap resolution: {len(jobs)} servers in {time.perf_counter() - resolve_start:.1f}s"
+          + (f", {unresolved} unresolved" if unresolved else "") + " ---")
+    if args.dedup:
+        jobs, duplicates = dedup_jobs(jobs, addresses)
+        if duplicates:
+            print(f"--- Skipping {len(duplicates)} duplicate endpoints (--no-dedup keeps them) ---")
+            for proto, server, original in duplicates:
+                print(f"{proto:5}  {server:45.45}  same as {original}")
+
+    if args.rank_domains:
+        # 'popular' — популярные имена из текущего набора доменов
+        wanted = set(args.rank_domains)
+        if "popular" in wanted:
+            wanted.update(POPULAR_DOMAINS)
+        args.rank_domains = [d for d in domains if d in wanted]
+        if not args.rank_domains:
+            print("None of --rank-domains are in the tested domain list.")
+            return 1
+
+    if (args.conn_split or args.per_domain or args.rank_domains or args.cache_bust) and args.engine != "native":
+        # dnspyre дает один отчет на сервер: ни рукопожатие, ни отдельные домены из него не выделить
+        print("--- --conn-split/--per-domain/--rank-domains/--cache-bust measure queries in-process: "
+              "switching to --engine native ---")
+        args.engine = "native"
+
+    if args.engine == "native":
+        fallback = [p for p in tested_protocols if p not in NATIVE_PROTOCOLS]
+        if fallback:
+            print(f"--- Native engine supports {', '.join(NATIVE_PROTOCOLS)}; {', '.join(fallback)} will use dnspyre ---")
+
+    checkpoint = None
+    cached = {}
+    # В replicate-режиме у каждого сервера несколько результатов (по точкам), чекпоинт к ним не применим
+    if args.checkpoint and not (args.workers and args.distribute == "replicate"):
+        checkpoint = Checkpoint(args.checkpoint, sweep_config_key(args, domains))
+        checkpoint.load()
+        max_age_s = parse_duration(args.max_age, None) if args.max_age else None
+        cached = checkpoint.cached(args.resume, max_age_s)
+        if cached:
+            jobs = [j for j in jobs if j not in cached]
+            print(f"--- Reusing {len(cached)} cached results, {len(jobs)} servers left to test ---")
+
+    pruned = []
+    if args.probe and jobs:
+        probe_start = time.perf_counter()
+        jobs, pruned = await preprobe(jobs, args.probe_timeout, args.probe_concurrency, args.dnspyre)
+        print(f"--- Pre-probe: {len(jobs)} alive, {len(pruned)} pruned "
+              f"({time.perf_counter() - probe_start:.1f}s) ---")
+
+    if args.workers:
+        return await run_coordinator(args, jobs, domains, tested_protocols, cached, checkpoint, pruned)
+
+    tasks, limiters = build_tasks(args, jobs, domains)
+
     total_unique_servers = len(tasks)
     total_servers = len(tasks) // args.repeats // len(domains) if args.repeats * len(domains) > 0 else 0
     print(f"\n--- Starting {len(tasks)} server tests (Servers: {total_unique_servers}, Domains per test: {len(domains)}, Repeats: {args.repeats}) ---")
 
+    results, sweep_s = await collect_results(args, _iter_completed(tasks), len(tasks), tested_protocols, checkpoint)
+    return print_report(args, results, cached, pruned, limiters, tested_protocols, domains, sweep_s)
+
+
+async def _iter_completed(tasks):
+    # as_completed вместо gather: каждый результат сразу попадает в чекпоинт и живую таблицу
+    for next_result in asyncio.as_completed(tasks):
+        yield await next_result
+
+
+async def collect_results(args, source, total: int, tested_protocols: list, checkpoint):
+    """Собирает результаты из асинхронного источника по мере готовности: чекпоинт + живая таблица."""
+    sort_by = getattr(args, "sort_by", "mean")
+    board = LiveBoard(total, sort_by, tested_protocols) if args.live and total else None
+    sweep_start = time.perf_counter()
+    results = []
+    try:
+        async for r in source:
+            results.append(r)
+            if checkpoint is not None:
+                checkpoint.add(r)
+            if board is not None:
+                board.update(r)
+        if checkpoint is not None:
+            checkpoint.done()
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+        if board is not None:
+            board.clear()
+    return results, time.perf_counter() - sweep_start
 
-    results = await asyncio.gather(*tasks)
 
-    def key_fn(r):
-        if r["mean_ms"] is not None:
-            return (0, r["mean_ms"])
-        if r["wall_ms"] is not None:
-            return (1, r["wall_ms"])
-        return (2, float("inf"))
-    results_sorted = sorted(results, key=key_fn)
+def print_report(args, results: list, cached: dict, pruned: list, limiters: dict,
+                 tested_protocols: list, domains: list, sweep_s: float) -> int:
+    """Итоговая таблица, сводка и топ-5 по протоколам."""
+    sort_by = getattr(args, "sort_by", "mean")
+    sort_label = SORT_METRICS[sort_by][0]
+    fresh_results = results
+    results = results + list(cached.values())
+
+    results_sorted = sorted(results, key=lambda r: rank_key(r, sort_by))
+    if getattr(args, "watch", False):
+        # --watch: вместо таблицы — только события монитора (export_results -> WatchMonitor)
+        export_results(args, results_sorted, domains, sweep_s)
+        return 0
+    tiers = args.bootstrap > 0
+    if tiers:
+        assign_tiers(results_sorted, sort_by, args.bootstrap, args.confidence)
 
     results_to_print = results_sorted
     if not args.full and len(results_sorted) > 50:
@@ -270,11 +2356,15 @@ async def run_all(args):
         results_to_print = results_sorted[:50]
 
     err_header = "ERROR" if args.verbose_errors else "ERR (truncated)"
-    header = f"{'#':>3}  {'PROTO':5}  {'SERVER':45}  {'MEAN(ms)':>10}  {'RESULT':6}"
-    sep = "-" * (len(header) if args.verbose_errors else 118)
+    header = (f"{'#':>3}  {'PROTO':5}  {'SERVER':45}  {'MEAN(ms)':>10}  {'P50':>8}  {'P90':>8}  {'P99':>8}"
+              f"  {'P99.9':>8}  {'JITTER':>8}  {'TMO%':>6}  {'ERR':>5}")
+    if tiers:
+        header += f"  {'TIER':>4}  {'CI' + format(args.confidence * 100, 'g') + '% ' + sort_label:>19}"
+    sep = "-" * (len(header) if args.verbose_errors or tiers else 136)
     print(sep)
     print(header)
     print(sep)
+    unranked = 0
     for idx, r in enumerate(results_to_print, start=1):
         proto, server = r["protocol"], r["server"]
         lat = "N/A"
@@ -285,34 +2375,204 @@ async def run_all(args):
         if not args.verbose_errors and len(serr) > 40:
             serr = serr[:37] + "..."
 
-        print(f"{idx:>3}  {proto:5}  {server:45.45}  {lat:>10}")
+        m = result_metrics(r)
+        cells = {k: "-" if m[k] is None else f"{m[k]:.2f}" for k in ("p50_ms", "p90_ms", "p99_ms", "p999_ms", "jitter_ms")}
+        if sort_by != "mean" and r["mean_ms"] is not None and metric_value(r, sort_by) is None:
+            # Метрика ранжирования не измерена (отчет dnspyre без распределения)
+            cells[f"{sort_by}_ms"] = "n/a"
+            unranked += 1
+        p50, p90, p99, p999, jitter = (cells[k] for k in ("p50_ms", "p90_ms", "p99_ms", "p999_ms", "jitter_ms"))
+        tmo = "-" if m["timeout_rate"] is None else f"{m['timeout_rate'] * 100:.1f}"
+        err = "-" if m["errors"] is None else str(m["errors"])
+
+        row = (f"{idx:>3}  {proto:5}  {server:45.45}  {lat:>10}  {p50:>8}  {p90:>8}  {p99:>8}"
+               f"  {p999:>8}  {jitter:>8}  {tmo:>6}  {err:>5}")
+        if tiers:
+            ci = "-" if r["ci"] is None else f"{r['ci'][0]:.2f}..{r['ci'][1]:.2f}"
+            row += f"  {r['tier'] or '-':>4}  {ci:>19}"
+        print(row)
     print(sep)
     total, succ = len(results), sum(1 for r in results if r["success"])
-    print(f"Total: {total}, Success: {succ}, Fail: {total - succ}")
+    print(f"Total: {total}, Success: {succ}, Fail: {total - succ}, Wall time: {sweep_s:.1f}s"
+          + (f", reused from cache: {len(cached)}" if cached else ""))
+    if args.store:
+        try:
+            run_id = store_results(args.db, fresh_results, domains, args.engine, args.repeats)
+            print(f"Saved run #{run_id} to {args.db}")
+        except sqlite3.Error as e:
+            print(f"Failed to save results to {args.db}: {e}")
+    if limiters:
+        print("Adaptive concurrency: " + ", ".join(
+            f"{name} final {lim.limit} (peak {lim.peak}, backoffs {lim.decreases}, re-measured {lim.remeasured})" for name, lim in limiters.items()))
+    else:
+        print(f"Concurrency: {args.concurrency} (fixed)")
     print("Звездочка '*' означает fallback на wall-clock время процесса.")
+    if unranked:
+        print(f"n/a: {sort_label} не измерена (отчет dnspyre без распределения задержек); "
+              f"такие серверы идут после измеренных, по среднему.")
+    if tiers:
+        print(f"TIER: серверы одного уровня статистически неотличимы по {sort_label} "
+              f"(bootstrap {args.bootstrap}x, доверие {args.confidence:.0%}).")
 
-    print("\n" + "--- Top 5 results per protocol ---")
-    top_5_by_protocol = {}
-    # Используем только успешные результаты с реальной измеренной задержкой
-    successful_results = [r for r in results_sorted if r["success"] and r["mean_ms"] is not None]
-    for r in successful_results:
-        proto = r["protocol"]
-        if proto not in top_5_by_protocol: top_5_by_protocol[proto] = []
-        if len(top_5_by_protocol[proto]) < 5: top_5_by_protocol[proto].append(r)
+    if pruned:
+        print(f"\n--- Pruned by pre-probe ({len(pruned)}) ---")
+        for proto, server, why in pruned:
+            why = why.replace("\n", " ")
+            if not args.verbose_errors and len(why) > 60:
+                why = why[:57] + "..."
+            print(f"{proto:5}  {server:45.45}  {why}")
+
+    if any(r.get("conn") for r in results):
+        print_connection_costs(args, results)
+    if any(r.get("matrix") is not None for r in results):
+        print_domain_matrix(args, results_sorted, domains)
+    if any(r.get("bust_hist") is not None for r in results):
+        print_recursion_costs(args, results)
+
+    print("\n" + f"--- Top 5 results per protocol (by {sort_label}) ---")
+    top_5_by_protocol = top_by_protocol(results_sorted, sort_by)
 
-    summary_header = f"{'PROTO':5}  {'MEAN(ms)':>10}  {'SERVER'}"
+    summary_header = f"{'PROTO':5}  {sort_label + '(ms)':>10}  " + (f"{'TIER':>4}  " if tiers else "") + "SERVER"
     summary_sep = "-" * 45
     print(summary_header)
     for proto in tested_protocols:
         print(summary_sep)
         if proto in top_5_by_protocol and top_5_by_protocol[proto]:
             for r in top_5_by_protocol[proto]:
-                print(f"{proto:5}  {r['mean_ms']:>10.2f}  {r['server']}")
+                tier = f"{r.get('tier') or '-':>4}  " if tiers else ""
+                print(f"{proto:5}  {metric_value(r, sort_by):>10.2f}  {tier}{r['server']}")
+        elif any(r["success"] and r["protocol"] == proto for r in results_sorted):
+            print(f"{proto:5}  {'n/a':>10}  (No {sort_label} measured)")
         else:
             print(f"{proto:5}  {'N/A':>10}  (No successful tests)")
     print(summary_sep)
+    export_results(args, results_sorted, domains, sweep_s)
     return 0
 
+def print_connection_costs(args, results: list):
+    """--conn-split: холодный старт (новое соединение) против теплых запросов, по возрастанию cold."""
+    rows = [r for r in results if r.get("conn") and r["conn"].get("cold_ms") is not None]
+    rows.sort(key=lambda r: r["conn"]["cold_ms"])
+    print(f"\n--- Connection cost: cold start vs warm queries ({len(rows)} servers, by COLD) ---")
+    if not args.full and len(rows) > 50:
+        rows = rows[:50]
+
+    def fmt(value) -> str:
+        return "-" if value is None else f"{value:.2f}"
+
+    header = (f"{'PROTO':5}  {'SERVER':45}  {'RESOLVE':>8}  {'TCP':>8}  {'TLS':>8}  {'FIRST Q':>8}"
+              f"  {'COLD':>8}  {'WARM P50':>8}  {'TLS VER':8}  {'RESUMED':>7}  {'RES TLS':>8}")
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        m, conn = result_metrics(r), r["conn"]
+        resumed = {True: "yes", False: "no"}.get(conn.get("resumed"), "-")
+        print(f"{r['protocol']:5}  {r['server']:45.45}  {fmt(conn.get('resolve_ms')):>8}  {fmt(conn.get('tcp_ms')):>8}"
+              f"  {fmt(conn.get('tls_ms')):>8}  {fmt(conn['first_query_ms']):>8}  {fmt(conn['cold_ms']):>8}"
+              f"  {fmt(m['p50_ms']):>8}  {conn.get('tls_version') or '-':8}  {resumed:>7}"
+              f"  {fmt(conn.get('resume_tls_ms')):>8}")
+    print("COLD = TCP + TLS + первый запрос (резолв имени сервера не входит); WARM — запросы по "
+          "переиспользованному соединению. 0-RTT модуль ssl не поддерживает и не проверяется.")
+
+
+def recursion_metrics(r: dict) -> dict:
+    """Метрики --cache-bust: задержка рекурсии (случайные поддомены) против попаданий в кеш."""
+    bust, m = r.get("bust_hist"), result_metrics(r)
+    out = dict.fromkeys(("recursion_p50_ms", "recursion_p90_ms", "recursion_mean_ms", "recursion_timeout_rate",
+                         "recursion_cost_ms"))
+    if bust is None:
+        return out
+    out["recursion_timeout_rate"] = bust.timeout_rate if bust.count + bust.timeouts else None
+    if bust.count:
+        out["recursion_p50_ms"], out["recursion_p90_ms"] = bust.percentile(50), bust.percentile(90)
+        out["recursion_mean_ms"] = bust.mean
+        if m["p50_ms"] is not None:
+            out["recursion_cost_ms"] = out["recursion_p50_ms"] - m["p50_ms"]
+    return out
+
+
+def print_recursion_costs(args, results: list):
+    """--cache-bust: попадание в кеш (обычные домены) и рекурсия (случайные поддомены) рядом."""
+    rows = [(r, recursion_metrics(r)) for r in results if r.get("bust_hist") is not None]
+    rows.sort(key=lambda x: (x[1]["recursion_p50_ms"] is None, x[1]["recursion_p50_ms"] or 0.0))
+    print(f"\n--- Cache hit vs recursion (random subdomains of {args.cache_bust}, by RECURSE P50) ---")
+    if not args.full and len(rows) > 50:
+        rows = rows[:50]
+
+    def fmt(value) -> str:
+        return "-" if value is None else f"{value:.2f}"
+
+    header = (f"{'PROTO':5}  {'SERVER':45}  {'HIT P50':>8}  {'REC P50':>8}  {'REC P90':>8}  {'REC MEAN':>8}"
+              f"  {'COST':>8}  {'REC TMO%':>8}  {'NXDOMAIN':>8}")
+    print(header)
+    print("-" * len(header))
+    for r, rec in rows:
+        bust, rcodes = r["bust_hist"], r.get("bust_rcodes") or {}
+        tmo = "-" if rec["recursion_timeout_rate"] is None else f"{rec['recursion_timeout_rate'] * 100:.1f}"
+        nx = f"{rcodes.get('NXDOMAIN', 0)}/{bust.count}"
+        print(f"{r['protocol']:5}  {r['server']:45.45}  {fmt(result_metrics(r)['p50_ms']):>8}"
+              f"  {fmt(rec['recursion_p50_ms']):>8}  {fmt(rec['recursion_p90_ms']):>8}  {fmt(rec['recursion_mean_ms']):>8}"
+              f"  {fmt(rec['recursion_cost_ms']):>8}  {tmo:>8}  {nx:>8}")
+    print("COST = REC P50 - HIT P50: цена рекурсии, которую платят редкие (long-tail) имена. Если зона "
+          "подписана DNSSEC и не wildcard, резолвер может синтезировать NXDOMAIN из кеша (RFC 8198), "
+          "и рекурсии не будет — берите зону с wildcard-записью.")
+
+
+MATRIX_SERVERS = 8
+
+
+def _matrix_cell(matrix: DomainMatrix, idx: int, baseline_ms: float) -> str:
+    if not matrix.ok[idx]:
+        return "TMO" if matrix.timeouts[idx] else ("ERR" if matrix.errors[idx] else "-")
+    flag = {"hit": "", "miss": "~", "uncached": "^"}[matrix.cache_state(idx, baseline_ms)]
+    if matrix.servfail[idx]:
+        flag += "S"
+    elif matrix.nxdomain[idx]:
+        flag += "N"
+    return f"{matrix.mean(idx):.1f}{flag}"
+
+
+def print_domain_matrix(args, results_sorted: list, domains: list):
+    """
+    --per-domain: сводка по каждому домену среди всех серверов и средние задержки
+    (ms) по доменам для MATRIX_SERVERS лучших серверов в порядке основной таблицы.
+    """
+    rows = [r for r in results_sorted if r.get("matrix") is not None and r["success"]]
+    if not rows:
+        return
+    baselines = [r["matrix"].baseline_ms() for r in rows]
+    top = rows[:MATRIX_SERVERS]
+    ranked = set(args.rank_domains or domains)
+    print(f"\n--- Per-domain latency ({len(rows)} servers; columns: top {len(top)} servers, mean ms) ---")
+    header = (f"{'DOMAIN':30}  {'ANSWERED':>8}  {'MEDIAN':>7}  {'HIT/MISS/UNC':>12}  {'NX':>3}  {'SF':>3}"
+              + "".join(f"  {'#' + str(i):>8}" for i in range(1, len(top) + 1)))
+    print(header)
+    print("-" * len(header))
+    for idx, domain in enumerate(domains):
+        means, states = [], {"hit": 0, "miss": 0, "uncached": 0}
+        nx = sf = 0
+        for r, baseline in zip(rows, baselines):
+            m = r["matrix"]
+            if m.ok[idx]:
+                means.append(m.mean(idx))
+                states[m.cache_state(idx, baseline)] += 1
+            nx += bool(m.nxdomain[idx])
+            sf += bool(m.servfail[idx])
+        median = f"{statistics.median(means):.1f}" if means else "-"
+        mix = f"{states['hit']}/{states['miss']}/{states['uncached']}"
+        name = domain if domain in ranked else domain + " (unranked)"
+        cells = "".join(f"  {_matrix_cell(r['matrix'], idx, b):>8}" for r, b in zip(top, baselines))
+        print(f"{name:30.30}  {f'{len(means)}/{len(rows)}':>8}  {median:>7}  {mix:>12}  {nx:>3}  {sf:>3}{cells}")
+    print("-" * len(header))
+    for i, r in enumerate(top, 1):
+        print(f"#{i}: {r['protocol']} {r['server']}")
+    print("Ячейка: средняя задержка; '~' — первый ответ медленный, повторы быстрые (промах кеша), "
+          "'^' — все ответы медленные (похоже на рекурсию каждый раз); N — NXDOMAIN, S — SERVFAIL "
+          "(для dnssec-failed.org означает валидацию DNSSEC). HIT/MISS/UNC и NX/SF — число серверов. "
+          f"\"Быстрый\" = не медленнее min задержки сервера x{DomainMatrix.CACHED_FACTOR:g} "
+          f"+ {DomainMatrix.CACHED_SLACK_MS:g} ms.")
+
+
 def get_input_or_default(prompt: str, default_value, type_cast=str, validator=None, custom_modes=None):
     """
     Получает ввод от пользователя. Если ввод пуст или некорректен,
@@ -425,13 +2685,108 @@ def main():
                         help="DNS protocol(s) to test. 'all' tests every protocol.")
     parser.add_argument("--domains", nargs="+", help="Домены для тестирования (по умолчанию набор популярных).")
     parser.add_argument("--concurrency", type=int, default=4, help="Number of concurrent tests.")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Adapt concurrency per protocol: start at --concurrency, ramp up while latencies "
+                             "stay stable, back off when they inflate.")
+    parser.add_argument("--max-concurrency", type=int, default=32,
+                        help="Upper bound for --adaptive concurrency per protocol.")
     parser.add_argument("--dnspyre", default="dnspyre", help="Path to dnspyre executable.")
+    parser.add_argument("--engine", choices=["dnspyre", "native"], default="dnspyre",
+                        help="'native' sends Plain/DoT/DoH queries in-process (asyncio) instead of "
+                             "spawning dnspyre per server; DoQ/DoH3 still use dnspyre.")
     parser.add_argument("--process-timeout", type=int, default=60,
                         help="Timeout for the whole dnspyre process for one server.")
     parser.add_argument("--query-timeout", default="1000ms",
                         help="Timeout for each individual DNS query (e.g., '1s', '500ms'). Passed to dnspyre's --request flag.")
+    parser.add_argument("--servers", nargs="+", metavar="FILE",
+                        help="Load server catalogs from JSON/YAML files instead of the built-in lists "
+                             "({\"doh\": [\"https://...\", {\"address\": ..., \"tags\": {...}}], \"dot\": [...], ...}).")
+    parser.add_argument("--tag", action="append", metavar="KEY=VALUE",
+                        help="Only test catalog servers with this tag (repeatable, all must match).")
+    parser.add_argument("--no-dedup", dest="dedup", action="store_false",
+                        help="Keep servers that resolve to the same endpoint as an earlier one.")
+    parser.add_argument("--probe", action="store_true",
+                        help="Pre-flight reachability check with a short deadline; only live servers are benchmarked.")
+    parser.add_argument("--probe-timeout", type=float, default=2.0,
+                        help="Deadline in seconds for one --probe check.")
+    parser.add_argument("--probe-concurrency", type=int, default=64,
+                        help="Number of simultaneous --probe checks.")
     parser.add_argument("--repeats", type=int, default=1,
                         help="Number of test repetitions per server (dnspyre's -n flag).")
+    parser.add_argument("--sort-by", choices=list(SORT_METRICS), default="mean",
+                        help="Latency metric used to rank servers (table and per-protocol top 5).")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_PATH,
+                        help="JSONL file where every finished server result is appended immediately "
+                             "('' disables checkpointing).")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue the last interrupted sweep with the same settings: only untested or failed servers run.")
+    parser.add_argument("--max-age", default=None,
+                        help="Reuse successful checkpointed results with the same settings not older than this (e.g. 30m, 1h).")
+    parser.add_argument("--worker", metavar="[HOST:]PORT",
+                        help="Run as a distributed worker listening on HOST:PORT (default host 127.0.0.1).")
+    parser.add_argument("--vantage", help="Name of this worker's vantage point (default hostname:port).")
+    parser.add_argument("--workers", nargs="+", metavar="HOST:PORT",
+                        help="Coordinator mode: send the sweep to these workers instead of testing locally.")
+    parser.add_argument("--distribute", choices=["replicate", "shard"], default="replicate",
+                        help="replicate: every worker tests every server (per-vantage comparison); "
+                             "shard: servers are split between workers (faster sweep).")
+    parser.add_argument("--output", choices=OUTPUT_FORMATS, default="table",
+                        help="Write results to stdout as json/csv/ndjson (full server names and errors); "
+                             "the human-readable table and progress then go to stderr.")
+    parser.add_argument("--serve-metrics", metavar="[HOST]:PORT",
+                        help="Prometheus exporter: rerun the sweep every --metrics-interval seconds and serve "
+                             "per-server gauges and counters on http://HOST:PORT/metrics (default host 0.0.0.0).")
+    parser.add_argument("--metrics-interval", type=float, default=300.0,
+                        help="Seconds between sweeps in --serve-metrics mode.")
+    parser.add_argument("--watch", action="store_true",
+                        help="Monitoring mode: re-measure the selected servers every --watch-interval seconds and "
+                             "print a JSON event to stdout when p95 or the failure rate over the window crosses a threshold.")
+    parser.add_argument("--pin", nargs="+", metavar="SERVER",
+                        help="Only test these server addresses (as written in the server lists/catalogs).")
+    parser.add_argument("--watch-interval", type=float, default=60.0, help="Seconds between --watch rounds.")
+    parser.add_argument("--watch-window", type=int, default=30,
+                        help="Number of recent rounds per server in the sliding window.")
+    parser.add_argument("--alert-p95", type=float, default=None, help="Alert when the window p95 exceeds this (ms).")
+    parser.add_argument("--alert-fail-rate", type=float, default=None,
+                        help="Alert when the share of failed queries in the window exceeds this (0..1).")
+    parser.add_argument("--alert-webhook", metavar="URL",
+                        help="Also POST every --watch event as JSON to this URL (e.g. a local alert relay).")
+    parser.add_argument("--alert-exit", action="store_true",
+                        help=f"Stop --watch with exit code {WATCH_ALERT_EXIT} on the first alert (for cron/systemd).")
+    parser.add_argument("--store", action="store_true",
+                        help="Append this sweep's results to the SQLite history DB (--db).")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Path to the SQLite results DB.")
+    parser.add_argument("--history", action="store_true",
+                        help="Show stored trends (rolling median, regressions) for the current domain set and exit.")
+    parser.add_argument("--history-days", type=float, default=7, help="How many days of history to consider.")
+    parser.add_argument("--history-window", type=int, default=5,
+                        help="Number of previous runs in the rolling median.")
+    parser.add_argument("--regression-pct", type=float, default=20.0,
+                        help="Flag a regression when the last value exceeds the rolling median by this many percent.")
+    parser.add_argument("--no-live", dest="live", action="store_false",
+                        help="Do not show the live leaderboard/progress while the sweep runs.")
+    parser.add_argument("--warmup", type=int, default=0,
+                        help="Warm-up passes over the domain list excluded from stats (native: same connection; "
+                             "dnspyre: a separate discarded run that warms the resolver cache).")
+    parser.add_argument("--conn-split", action="store_true",
+                        help="Measure connection setup (TCP, TLS), the first query and TLS session resumption "
+                             "separately; latency stats then cover only warm queries on the reused connection. "
+                             "Implies --engine native.")
+    parser.add_argument("--per-domain", action="store_true",
+                        help="Break results down per server x domain (cache hit/miss, NXDOMAIN, SERVFAIL). "
+                             "Implies --engine native.")
+    parser.add_argument("--rank-domains", nargs="+", metavar="DOMAIN",
+                        help="Rank servers only on these domains ('popular' = well-known names from the "
+                             "domain list); other domains go only to the --per-domain matrix. Implies --engine native.")
+    parser.add_argument("--cache-bust", metavar="ZONE",
+                        help="Also query unique random subdomains of ZONE so every resolver has to recurse; "
+                             "recursion latency is reported next to the cache-hit latency. Implies --engine native.")
+    parser.add_argument("--cache-bust-queries", type=int, default=20,
+                        help="Number of random-subdomain queries per server for --cache-bust.")
+    parser.add_argument("--bootstrap", type=int, default=0,
+                        help="Bootstrap resamples for confidence intervals of the --sort-by metric; "
+                             "servers with overlapping intervals are grouped into tiers (0 = off).")
+    parser.add_argument("--confidence", type=float, default=0.95, help="Confidence level for --bootstrap.")
     parser.add_argument("--full", action="store_true", help="Display full list of servers instead of top 50.")
     parser.add_argument("--verbose-errors", action="store_true", help="Show full error messages instead of truncating them.")
 
@@ -443,26 +2798,65 @@ def main():
     args.doh_list, args.dot_list = DOH_SERVERS, DOT_SERVERS
     args.plain_list, args.doq_list = PLAIN_DNS_SERVERS, DOQ_SERVERS
     args.doh3_list = DOH3_SERVERS
+    args.server_tags = {}
+    if args.servers:
+        try:
+            catalog = load_server_catalogs(args.servers)
+        except (OSError, ValueError) as e:
+            print(f"Cannot load server catalog: {e}")
+            raise SystemExit(1)
+        for mode, proto_name in CATALOG_PROTOCOLS.items():
+            entries = catalog.get(proto_name, [])
+            setattr(args, f"{mode}_list", [server for server, _tags in entries])
+            args.server_tags.update(((proto_name, server), tags) for server, tags in entries)
+
+    if args.watch and args.serve_metrics:
+        parser.error("--watch and --serve-metrics cannot be combined")
+    if args.watch and args.alert_p95 is None and args.alert_fail_rate is None:
+        parser.error("--watch needs --alert-p95 and/or --alert-fail-rate")
+
+    if args.history:
+        raise SystemExit(show_history(args))
+    if args.worker:
+        try:
+            asyncio.run(serve_worker(args))
+        except KeyboardInterrupt:
+            print("\nWorker stopped.")
+        raise SystemExit(0)
 
     # Проверяем, нужно ли запускать интерактивный режим
     # Интерактивный режим пропускается, если есть флаг --skip-interactive ИЛИ если задан любой из ключевых параметров через CLI
-    is_cli_configured = any(arg in sys.argv for arg in ["--mode", "--domains", "--concurrency", "--process-timeout", "--query-timeout", "--repeats"])
+    is_cli_configured = any(arg in sys.argv for arg in ["--mode", "--domains", "--concurrency", "--process-timeout", "--query-timeout", "--repeats", "--engine", "--sort-by", "--adaptive", "--probe", "--resume", "--max-age", "--workers",
+                                                  "--warmup", "--bootstrap", "--conn-split", "--per-domain", "--rank-domains", "--cache-bust",
+                                                  "--servers", "--tag", "--watch", "--pin",
+                                                  "--output", "--serve-metrics"])
+
+    # Машиночитаемый вывод (--output, события --watch) занимает stdout целиком, все остальное уходит в stderr
+    machine_stdout = args.output != "table" or args.watch
+    human_out = contextlib.redirect_stdout(sys.stderr) if machine_stdout else contextlib.nullcontext()
 
     if not args.skip_interactive and not is_cli_configured:
         args = interactive_mode(args)
     elif is_cli_configured:
-         print("--- Обнаружены параметры CLI. Интерактивный режим пропущен. ---")
+        with human_out:
+            print("--- Обнаружены параметры CLI. Интерактивный режим пропущен. ---")
 
 
     try:
-        rc = asyncio.run(run_all(args))
+        with human_out:
+            if args.watch:
+                rc = asyncio.run(watch(args))
+            elif args.serve_metrics:
+                rc = asyncio.run(serve_metrics(args))
+            else:
+                rc = asyncio.run(run_all(args))
         raise SystemExit(rc)
     except KeyboardInterrupt:
-        print("\nInterrupted by user (Ctrl+C).")
+        print("\nInterrupted by user (Ctrl+C). Finished results are checkpointed; rerun with --resume to continue.")
         raise SystemExit(1)
     except SystemExit:
-        # Это для SystemExit из run_all
-        pass
+        # Код возврата run_all/watch (например, WATCH_ALERT_EXIT) должен дойти до shell
+        raise
     except Exception as e:
         print(f"\nAn unexpected error occurred: {e}")
         raise SystemExit(1)
@@ -0,0 +1,88 @@
+"""Минимальный DNS-резолвер на 127.0.0.1 (UDP + TCP) для тестов нативного движка и воркеров."""
+import asyncio
+import struct
+import threading
+
+# Ответы на эти имена задерживаются: клиент успевает упасть по таймауту
+SLOW_SUFFIX = "slow.test"
+
+
+def _qname(wire: bytes) -> str:
+    labels, pos = [], 12
+    while wire[pos]:
+        length = wire[pos]
+        labels.append(wire[pos + 1:pos + 1 + length].decode("ascii"))
+        pos += 1 + length
+    return ".".join(labels)
+
+
+def make_response(wire: bytes) -> bytes:
+    """NOERROR без ответов: тот же ID и вопрос, QR=1 RD=1 RA=1."""
+    qid = struct.unpack("!H", wire[:2])[0]
+    return struct.pack("!HHHHHH", qid, 0x8180, 1, 0, 0, 0) + wire[12:]
+
+
+class StubResolver:
+    """Запускается в отдельном потоке со своим циклом событий; порты — в self.udp_port/self.tcp_port."""
+
+    def __init__(self, slow_delay: float = 1.0):
+        self.slow_delay = slow_delay
+        self.queries = []
+        self.tcp_connections = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def _delay(self, wire: bytes) -> float:
+        name = _qname(wire)
+        self.queries.append(name)
+        return self.slow_delay if name.endswith(SLOW_SUFFIX) else 0.0
+
+    async def _start(self):
+        resolver = self
+
+        class Udp(asyncio.DatagramProtocol):
+            def connection_made(self, transport):
+                self.transport = transport
+
+            def datagram_received(self, data, addr):
+                resolver.loop.call_later(resolver._delay(data), self.transport.sendto, make_response(data), addr)
+
+        async def handle_tcp(reader, writer):
+            self.tcp_connections += 1
+            try:
+                while True:
+                    length = struct.unpack("!H", await reader.readexactly(2))[0]
+                    wire = await reader.readexactly(length)
+                    await asyncio.sleep(self._delay(wire))
+                    response = make_response(wire)
+                    writer.write(struct.pack("!H", len(response)) + response)
+                    await writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        self.tcp_server = await asyncio.start_server(handle_tcp, "127.0.0.1", 0)
+        self.tcp_port = self.tcp_server.sockets[0].getsockname()[1]
+        # UDP на том же номере порта, что и TCP: один адрес "127.0.0.1:PORT" для обоих транспортов
+        self.udp_transport, _ = await self.loop.create_datagram_endpoint(
+            Udp, local_addr=("127.0.0.1", self.tcp_port))
+        self.udp_port = self.tcp_port
+
+    def start(self) -> "StubResolver":
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result(5)
+        return self
+
+    def stop(self):
+        async def _stop():
+            self.udp_transport.close()
+            self.tcp_server.close()
+
+        asyncio.run_coroutine_threadsafe(_stop(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(5)
+
+    @property
+    def address(self) -> str:
+        return f"127.0.0.1:{self.tcp_port}"
@@ -0,0 +1,44 @@
+"""--adaptive: перегрузку определяет канарейка, а не разброс задержек между серверами."""
+import asyncio
+import os
+import random
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dnspyre_wrapper as dw  # noqa: E402
+
+
+def _sweep(servers: int, knee: int = None):
+    """Серверы с разной задержкой; при knee задержка растет с числом тестов в полете сверх knee."""
+    rnd = random.Random(1)
+    limiter = dw.AdaptiveLimiter("Plain", 4, 32)
+    base = [rnd.uniform(5, 200) for _ in range(servers)]
+
+    def make(i):
+        async def coro():
+            async with limiter:
+                factor = 1 + max(0, limiter.in_flight - knee) * 0.25 if knee else 1.0
+                p50 = base[i] * factor * rnd.uniform(0.9, 1.1)
+                await asyncio.sleep(p50 / 1000)
+                return {"success": True, "stats": types.SimpleNamespace(ok=10, p50_ms=p50)}
+        return coro
+
+    async def scenario():
+        await asyncio.gather(*(dw._run_limited(limiter, make(i)) for i in range(servers)))
+
+    asyncio.run(scenario())
+    return limiter
+
+
+def test_load_independent_latency_does_not_back_off():
+    limiter = _sweep(120)
+    assert limiter.decreases == 0
+    assert limiter.remeasured == 0
+    assert limiter.limit > 4
+
+
+def test_queueing_backs_off():
+    limiter = _sweep(120, knee=8)
+    assert limiter.decreases > 0
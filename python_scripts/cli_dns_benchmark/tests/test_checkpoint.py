@@ -0,0 +1,28 @@
+"""Переиспользование результатов из чекпоинта (--resume / --max-age)."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dnspyre_wrapper as dw  # noqa: E402
+
+
+def _result(server: str, success: bool) -> dict:
+    return {"server": server, "protocol": "Plain", "success": success,
+            "mean_ms": 10.0 if success else None, "stderr": "" if success else "timeout"}
+
+
+def test_cached_skips_failed_results(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    sweep = dw.Checkpoint(path, "cfg")
+    sweep.add(_result("1.1.1.1", True))
+    sweep.add(_result("8.8.8.8", False))
+    sweep.close()  # прерванный прогон: без записи "done"
+
+    resumed = dw.Checkpoint(path, "cfg")
+    resumed.load()
+    assert set(resumed.cached(resume=True, max_age_s=None)) == {("Plain", "1.1.1.1")}
+
+    fresh = dw.Checkpoint(path, "cfg")
+    fresh.load()
+    assert set(fresh.cached(resume=False, max_age_s=3600)) == {("Plain", "1.1.1.1")}
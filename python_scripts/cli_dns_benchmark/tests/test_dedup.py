@@ -0,0 +1,35 @@
+"""Склейка дубликатов endpoint (--no-dedup выключает)."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dnspyre_wrapper as dw  # noqa: E402
+
+
+def _dedup(jobs: list, ips: dict):
+    kept, dropped = dw.dedup_jobs(jobs, {job: ips[job[1]] for job in jobs})
+    return kept, [(server, owner) for _proto, server, owner in dropped]
+
+
+def test_ip_literal_matches_hostname():
+    ips = {"dns.google:853": ["8.8.8.8"], "8.8.8.8:853": ["8.8.8.8"]}
+    kept, dropped = _dedup([("DoT", "dns.google:853"), ("DoT", "8.8.8.8:853")], ips)
+    assert kept == [("DoT", "dns.google:853")]
+    assert dropped == [("8.8.8.8:853", "dns.google:853")]
+
+
+def test_tls_names_on_shared_ips_are_kept():
+    ips = {"https://family.example/dns-query": ["104.16.0.1"],
+           "https://security.example/dns-query": ["104.16.0.1"],
+           "https://FAMILY.example/dns-query": ["104.16.0.1"]}
+    jobs = [("DoH", server) for server in ips]
+    kept, dropped = _dedup(jobs, ips)
+    assert kept == jobs[:2]
+    assert dropped == [("https://FAMILY.example/dns-query", "https://family.example/dns-query")]
+
+
+def test_plain_ignores_names():
+    ips = {"one.example": ["1.1.1.1"], "1.1.1.1": ["1.1.1.1"]}
+    kept, _dropped = _dedup([("Plain", "one.example"), ("Plain", "1.1.1.1")], ips)
+    assert kept == [("Plain", "one.example")]
@@ -0,0 +1,93 @@
+"""Координатор и воркеры (--worker/--workers) на 127.0.0.1 против заглушек-резолверов."""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(os.path.dirname(HERE), "dnspyre_wrapper.py")
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import dnspyre_wrapper as dw  # noqa: E402
+from stub_resolver import StubResolver  # noqa: E402
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def resolvers():
+    stubs = [StubResolver(slow_delay=1.0).start() for _ in range(4)]
+    yield stubs
+    for stub in stubs:
+        stub.stop()
+
+
+@pytest.fixture
+def workers():
+    procs = {}
+    for name in ("w1", "w2", "w3"):
+        addr = f"127.0.0.1:{_free_port()}"
+        proc = subprocess.Popen([sys.executable, "-u", SCRIPT, "--worker", addr, "--vantage", name],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        # Ждем, пока воркер начнет слушать порт
+        for line in proc.stdout:
+            if "listening" in line:
+                break
+        procs[name] = (addr, proc)
+    yield procs
+    for _addr, proc in procs.values():
+        proc.kill()
+        proc.wait()
+
+
+def _coordinator_args(distribute: str, addrs: list) -> argparse.Namespace:
+    return argparse.Namespace(
+        workers=addrs, distribute=distribute, engine="native", repeats=1, query_timeout="3s",
+        process_timeout=60, concurrency=4, adaptive=False, max_concurrency=32, warmup=0,
+        conn_split=False, per_domain=False, rank_domains=None, cache_bust=None, cache_bust_queries=20)
+
+
+def _sweep(args, jobs: list, domains: list, kill=None) -> list:
+    async def scenario():
+        if kill is not None:
+            # Воркер получает задание и умирает, не успев ответить (ответы заглушки задержаны)
+            asyncio.get_running_loop().call_later(0.3, kill.kill)
+        return [r async for r in dw._iter_workers(args, jobs, domains)]
+
+    return asyncio.run(scenario())
+
+
+def test_replicate_every_worker_tests_every_server(resolvers, workers):
+    jobs = [("Plain", stub.address) for stub in resolvers]
+    addrs = [workers["w1"][0], workers["w2"][0]]
+    results = _sweep(_coordinator_args("replicate", addrs), jobs, ["example.com"])
+    assert sorted((r["vantage"], r["protocol"], r["server"]) for r in results) == sorted(
+        (v, p, s) for v in ("w1", "w2") for p, s in jobs)
+    assert all(r["success"] for r in results)
+
+
+def test_shard_splits_servers(resolvers, workers):
+    jobs = [("Plain", stub.address) for stub in resolvers]
+    addrs = [addr for addr, _proc in workers.values()]
+    results = _sweep(_coordinator_args("shard", addrs), jobs, ["example.com"])
+    assert sorted((r["protocol"], r["server"]) for r in results) == sorted(jobs)
+    assert {r["vantage"] for r in results} == {"w1", "w2", "w3"}
+    assert all(r["success"] for r in results)
+
+
+def test_shard_reassigns_killed_worker(resolvers, workers):
+    jobs = [("Plain", stub.address) for stub in resolvers]
+    addrs = [addr for addr, _proc in workers.values()]
+    results = _sweep(_coordinator_args("shard", addrs), jobs, ["a.slow.test"], kill=workers["w3"][1])
+    assert sorted((r["protocol"], r["server"]) for r in results) == sorted(jobs)
+    assert {r["vantage"] for r in results} == {"w1", "w2"}
+    assert all(r["success"] for r in results)
@@ -0,0 +1,130 @@
+"""Нативный движок против заглушки-резолвера на 127.0.0.1."""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import dnspyre_wrapper as dw  # noqa: E402
+from stub_resolver import StubResolver  # noqa: E402
+
+
+@pytest.fixture
+def stub():
+    resolver = StubResolver(slow_delay=0.5).start()
+    yield resolver
+    resolver.stop()
+
+
+def test_udp_query(stub):
+    async def scenario():
+        client = dw.UdpDnsClient("127.0.0.1", stub.udp_port, 1.0)
+        await client.connect()
+        try:
+            return dw.parse_dns_header(await client.query(dw.build_dns_query("example.com", 0x1234)))
+        finally:
+            client.close()
+
+    assert asyncio.run(scenario()) == (0x1234, 0, False, 0)
+
+
+def test_tcp_queries_reuse_connection(stub):
+    async def scenario():
+        client = dw.TcpDnsClient("127.0.0.1", stub.tcp_port, 1.0)
+        try:
+            return [dw.parse_dns_header(await client.query(dw.build_dns_query(name, qid)))[0]
+                    for qid, name in ((1, "example.com"), (2, "example.org"))]
+        finally:
+            client.close()
+
+    assert asyncio.run(scenario()) == [1, 2]
+    assert stub.tcp_connections == 1
+
+
+def test_tcp_timeout_drops_connection(stub):
+    async def scenario():
+        client = dw.TcpDnsClient("127.0.0.1", stub.tcp_port, 0.2)
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await client.query(dw.build_dns_query("a.slow.test", 1))
+            assert client.writer is None
+            # Опоздавший ответ на запрос 1 не должен выдать себя за ответ на запрос 2
+            await asyncio.sleep(0.5)
+            return dw.parse_dns_header(await client.query(dw.build_dns_query("example.com", 2)))[0]
+        finally:
+            client.close()
+
+    assert asyncio.run(scenario()) == 2
+    assert stub.tcp_connections == 2
+
+
+def test_run_native_plain(stub):
+    async def scenario():
+        return await dw.run_native(asyncio.Semaphore(1), stub.address, ["example.com", "example.org"],
+                                   "Plain", "1s", 2)
+
+    result = asyncio.run(scenario())
+    assert result["success"], result
+    assert result["rcodes"] == {"NOERROR": 4}
+
+
+def test_run_native_connect_timeout_names_exception(stub):
+    async def scenario():
+        # Заглушка не говорит TLS: рукопожатие DoT обрывается по таймауту с пустым str(e)
+        return await dw.run_native(asyncio.Semaphore(1), stub.address, ["example.com"], "DoT", "200ms", 1)
+
+    result = asyncio.run(scenario())
+    assert not result["success"]
+    assert result["stderr"] == "Connect error: TimeoutError"
+
+
+async def _doh_stub(framing: str, seen_hosts: list):
+    """HTTP/1.1 DoH без TLS: ответ с Content-Length или без длины (тело до закрытия соединения)."""
+    from stub_resolver import make_response
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                headers = dict(line.split(": ", 1) for line in head.decode("latin-1").split("\r\n")[1:] if line)
+                seen_hosts.append(headers["Host"])
+                response = make_response(await reader.readexactly(int(headers["Content-Length"])))
+                if framing == "length":
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/dns-message\r\n"
+                                 b"Content-Length: %d\r\n\r\n" % len(response) + response)
+                    await writer.drain()
+                else:
+                    writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/dns-message\r\n\r\n" + response)
+                    await writer.drain()
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def test_doh_host_header_and_body_to_eof():
+    async def scenario(framing: str):
+        seen_hosts = []
+        server = await _doh_stub(framing, seen_hosts)
+        port = server.sockets[0].getsockname()[1]
+        client = dw.DohClient("127.0.0.1", port, "/dns-query", 1.0, None)
+        try:
+            ids = [dw.parse_dns_header(await client.query(dw.build_dns_query("example.com", qid)))[0]
+                   for qid in (7, 8)]
+        finally:
+            client.close()
+            server.close()
+        return ids, seen_hosts, port
+
+    for framing in ("length", "eof"):
+        ids, seen_hosts, port = asyncio.run(scenario(framing))
+        assert ids == [7, 8]
+        assert seen_hosts == [f"127.0.0.1:{port}"] * 2
+    assert dw.DohClient("dns.example", 443, "/dns-query", 1.0, None).host_header == "dns.example"
+    assert dw.DohClient("2001:db8::1", 8443, "/dns-query", 1.0, None).host_header == "[2001:db8::1]:8443"
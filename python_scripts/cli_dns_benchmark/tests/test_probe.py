@@ -0,0 +1,29 @@
+"""--probe: DoQ проверяется одним запросом через dnspyre (заглушка вместо dnspyre)."""
+import asyncio
+import os
+import stat
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dnspyre_wrapper as dw  # noqa: E402
+
+ALIVE = '{"totalRequests": 1, "totalSuccessResponses": 1, "latencyStats": {"minMs": 5, "meanMs": 5, "p50Ms": 5}}'
+DEAD = '{"totalRequests": 1, "totalIOErrors": 1, "latencyStats": {}}'
+
+
+def _fake_dnspyre(tmp_path, report: str) -> str:
+    path = tmp_path / "dnspyre"
+    path.write_text(f"#!/bin/sh\necho '{report}'\n")
+    path.chmod(path.stat().st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_doq_probe_sends_a_query(tmp_path):
+    alive = asyncio.run(dw.probe_server("quic://127.0.0.1:853", "DoQ", 0.5, _fake_dnspyre(tmp_path, ALIVE)))
+    assert alive is None
+
+
+def test_doq_probe_prunes_silent_listener(tmp_path):
+    reason = asyncio.run(dw.probe_server("quic://127.0.0.1:853", "DoQ", 0.5, _fake_dnspyre(tmp_path, DEAD)))
+    assert reason == "no answer within 0.5s"
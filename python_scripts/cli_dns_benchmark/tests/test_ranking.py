@@ -0,0 +1,33 @@
+"""--sort-by: результаты без выбранной метрики не смешиваются с измеренными."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dnspyre_wrapper as dw  # noqa: E402
+
+
+def _stats_only(server: str, mean_ms: float) -> dict:
+    # Отчет dnspyre без latencyDistribution: гистограммы нет, только P50/P90/P99
+    stats = dw.parse_dnspyre_json(
+        '{"totalRequests": 10, "totalSuccessResponses": 10, '
+        f'"latencyStats": {{"meanMs": {mean_ms}, "p50Ms": {mean_ms}, "p90Ms": {mean_ms}, "p99Ms": {mean_ms}}}}}')
+    return {"server": server, "protocol": "DoQ", "success": True, "mean_ms": mean_ms, "wall_ms": 100.0,
+            "stats": stats, "hist": None}
+
+
+def _histogram(server: str, ms: float) -> dict:
+    hist = dw.LatencyHistogram()
+    hist.record(ms, 10)
+    return {"server": server, "protocol": "DoH", "success": True, "mean_ms": ms, "wall_ms": 100.0,
+            "stats": None, "hist": hist}
+
+
+def test_missing_percentile_ranks_after_measured():
+    fast_unmeasured = _stats_only("doq-fast", 1.0)
+    slow_measured = _histogram("doh-slow", 50.0)
+    assert dw.metric_value(fast_unmeasured, "p999") is None
+    assert dw.metric_value(fast_unmeasured, "p99") == 1.0
+    ranked = sorted([fast_unmeasured, slow_measured], key=lambda r: dw.rank_key(r, "p999"))
+    assert [r["server"] for r in ranked] == ["doh-slow", "doq-fast"]
+    assert dw.top_by_protocol(ranked, "p999") == {"DoH": [slow_measured]}
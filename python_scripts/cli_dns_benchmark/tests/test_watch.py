@@ -0,0 +1,39 @@
+"""Окно --watch: полный отказ сервера должен поднимать тревогу сразу."""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import dnspyre_wrapper as dw  # noqa: E402
+from stub_resolver import StubResolver  # noqa: E402
+
+
+def test_dead_round_weighs_as_full_round():
+    stub = StubResolver().start()
+    try:
+        domains = ["example.com", "example.org", "example.net"]
+        good = asyncio.run(dw.run_native(asyncio.Semaphore(1), stub.address, domains, "Plain", "1s", 10))
+    finally:
+        stub.stop()
+    assert good["stats"].total == 30
+    dead = {"server": stub.address, "protocol": "Plain", "success": False,
+            "stats": None, "hist": None, "stderr": "Connect error: TimeoutError"}
+
+    args = argparse.Namespace(rank_domains=None, domains=domains, repeats=10, watch_window=30,
+                              alert_p95=None, alert_fail_rate=0.05, alert_webhook=None)
+    out = io.StringIO()
+    monitor = dw.WatchMonitor(args, out)
+    for _ in range(30):
+        monitor.update([good], 0.0)
+    assert not monitor.alerting
+    monitor.update([dead], 0.0)
+    monitor.update([dead], 0.0)
+    # 2 мертвых раунда из 30 — доля ошибок 6.7% > 5%
+    event = json.loads(out.getvalue().splitlines()[0])
+    assert event["event"] == "alert"
+    assert event["fail_rate"] > 0.05
@@ -0,0 +1,381 @@
+import os
+import sys
+import time
+import random
+import shutil
+import struct
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from mutagen.id3 import ID3, TPE1, TPE2, TALB, TCMP, APIC
+from mutagen.flac import FLAC, Picture
+from mutagen.oggvorbis import OggVorbis
+from mutagen.oggopus import OggOpus
+from mutagen.mp4 import MP4, MP4Cover
+from mutagen.apev2 import APEv2
+from mutagen.ogg import OggPage
+
+import folder_to_playlists as ftp
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+FORMATS = ('mp3', 'flac', 'ogg', 'opus', 'm4a', 'ape')
+
+# ---------------------------------------------------------------------------
+# Tiny valid containers: just enough structure for mutagen to open and tag them
+# ---------------------------------------------------------------------------
+
+def _mp4_atom(kind, payload):
+    return struct.pack('>I', 8 + len(payload)) + kind + payload
+
+def _write_mp4(path):
+    mvhd = _mp4_atom(b'mvhd', b'\0' * 12 + struct.pack('>II', 1000, 0) + b'\0' * 80)
+    mdhd = _mp4_atom(b'mdhd', b'\0' * 12 + struct.pack('>II', 44100, 0) + b'\0' * 4)
+    hdlr = _mp4_atom(b'hdlr', b'\0' * 8 + b'soun' + b'\0' * 13)
+    trak = _mp4_atom(b'trak', _mp4_atom(b'tkhd', b'\0' * 84) + _mp4_atom(b'mdia', mdhd + hdlr))
+    with open(path, 'wb') as f:
+        f.write(_mp4_atom(b'ftyp', b'M4A \0\0\0\0M4A mp42isom'))
+        f.write(_mp4_atom(b'moov', mvhd + trak))
+        f.write(_mp4_atom(b'mdat', b'\0' * 256))
+
+def _write_flac(path):
+    # STREAMINFO: 4096-sample blocks, 44.1 kHz, 2 channels, 16 bit
+    streaminfo = struct.pack('>HH', 4096, 4096) + b'\0' * 6 + bytes([0x0A, 0xC4, 0x42, 0xF0]) + b'\0' * 20
+    with open(path, 'wb') as f:
+        f.write(b'fLaC' + bytes([0x80]) + len(streaminfo).to_bytes(3, 'big') + streaminfo)
+        f.write(b'\xff\xf8' + b'\0' * 254)
+
+def _write_ogg(path, opus):
+    vendor = struct.pack('<I', 5) + b'bench' + struct.pack('<I', 0)
+    if opus:
+        headers = [[b'OpusHead' + bytes([1, 2]) + struct.pack('<HIhB', 312, 48000, 0, 0)],
+                   [b'OpusTags' + vendor]]
+    else:
+        ident = b'\x01vorbis' + struct.pack('<IBIiii', 0, 2, 44100, 0, 128000, 0) + bytes([0xB8, 1])
+        headers = [[ident], [b'\x03vorbis' + vendor + b'\x01', b'\x05vorbis' + b'\0' * 30]]
+    pages = []
+    for sequence, packets in enumerate(headers + [[b'\0' * 256]]):
+        page = OggPage()
+        page.serial = 1
+        page.sequence = sequence
+        page.packets = packets
+        page.first = sequence == 0
+        page.last = sequence == len(headers)
+        page.position = 1000 if page.last else 0
+        pages.append(page)
+    with open(path, 'wb') as f:
+        f.write(b''.join(page.write() for page in pages))
+
+def write_track(path, fmt, artist=None, albumartist=None, album=None, compilation=False, cover=0):
+    """Create a tiny file of the given format with the grouping tags (None = tag not set)."""
+    if fmt == 'mp3':
+        with open(path, 'wb') as f:
+            f.write(b'\xff\xfb\x90\x00' + b'\0' * 412)
+        tags = ID3()
+        if artist:
+            tags.add(TPE1(encoding=3, text=[artist]))
+        if albumartist:
+            tags.add(TPE2(encoding=3, text=[albumartist]))
+        if album:
+            tags.add(TALB(encoding=3, text=[album]))
+        if compilation:
+            tags.add(TCMP(encoding=3, text=['1']))
+        if cover:
+            tags.add(APIC(encoding=0, mime='image/jpeg', type=3, desc='', data=b'\0' * cover))
+        tags.save(path)
+    elif fmt in ('flac', 'ogg', 'opus'):
+        if fmt == 'flac':
+            _write_flac(path)
+            audio = FLAC(path)
+            audio.add_tags()
+            if cover:
+                picture = Picture()
+                picture.mime = 'image/jpeg'
+                picture.data = b'\0' * cover
+                audio.add_picture(picture)
+        else:
+            _write_ogg(path, fmt == 'opus')
+            audio = OggOpus(path) if fmt == 'opus' else OggVorbis(path)
+        for key, value in (('artist', artist), ('albumartist', albumartist), ('album', album)):
+            if value:
+                audio[key] = value
+        if compilation:
+            audio['compilation'] = '1'
+        audio.save()
+    elif fmt == 'm4a':
+        _write_mp4(path)
+        audio = MP4(path)
+        audio.add_tags()
+        for key, value in (('\xa9ART', artist), ('aART', albumartist), ('\xa9alb', album)):
+            if value:
+                audio[key] = value
+        if compilation:
+            audio['cpil'] = True
+        if cover:
+            audio['covr'] = [MP4Cover(b'\0' * cover)]
+        audio.save()
+    elif fmt == 'ape':
+        with open(path, 'wb') as f:
+            f.write(b'MAC \x96\x0f' + b'\0' * 250)
+        tags = APEv2()
+        for key, value in (('Artist', artist), ('Album Artist', albumartist), ('Album', album)):
+            if value:
+                tags[key] = value
+        if compilation:
+            tags['Compilation'] = '1'
+        tags.save(path)
+    else:
+        raise ValueError(f"Unknown format: {fmt}")
+
+def generate_library(root_dir, args):
+    """
+    Build a reproducible library under root_dir. Returns (expected, excluded_dirs, file_count) where
+    expected maps playlist group key -> set of track paths (as the script writes them).
+    """
+    rng = random.Random(args.seed)
+    formats = args.formats
+    expected = defaultdict(set)
+    excluded_dirs = []
+    file_count = 0
+
+    def track_path(album_dir, name, fmt):
+        return os.path.abspath(os.path.join(album_dir, f"{name}.{fmt}")).replace('\\', '/')
+
+    for a in range(args.artists):
+        artist = f"Artist {a:04d}"
+        for b in range(args.albums):
+            album = f"Album {a:04d}-{b:02d}"
+            album_dir = os.path.join(root_dir, artist, f"{album} ({2000 + b})")
+            os.makedirs(album_dir)
+            fmt = rng.choice(formats)
+            tagged = rng.random() >= args.untagged
+            with_albumartist = rng.random() < args.albumartist
+            for t in range(args.tracks):
+                if tagged:
+                    path = track_path(album_dir, f"{t + 1:02d} - Track {t + 1}", fmt)
+                    write_track(path, fmt, artist=artist, albumartist=artist if with_albumartist else None,
+                                album=album, cover=args.cover)
+                else:
+                    # No tags: the group comes from the "Artist - Title" file name
+                    path = track_path(album_dir, f"{t + 1:02d} - {artist} - Track {t + 1}", fmt)
+                    write_track(path, fmt)
+                expected[artist].add(path)
+                file_count += 1
+
+    for c in range(args.compilations):
+        album = f"Compilation {c:03d}"
+        album_dir = os.path.join(root_dir, 'Various', album)
+        os.makedirs(album_dir)
+        fmt = rng.choice(formats)
+        # Half of the compilations are detected by the flag, the rest by several artists in one folder
+        flagged = c % 2 == 0
+        for t in range(args.tracks):
+            path = track_path(album_dir, f"{t + 1:02d} - Song {t + 1}", fmt)
+            artist = f"Guest {c:03d}" if flagged else f"Guest {c:03d}-{t}"
+            write_track(path, fmt, artist=artist, album=album, compilation=flagged, cover=args.cover)
+            expected[f"Various Artists - {album.lower().title()}"].add(path)
+            file_count += 1
+
+    for e in range(args.excluded):
+        excluded_dir = os.path.join(root_dir, f"!!excluded {e}")
+        excluded_dirs.append(excluded_dir)
+        album_dir = os.path.join(excluded_dir, 'Artist 0000', 'Leftovers')
+        os.makedirs(album_dir)
+        for t in range(args.tracks):
+            write_track(track_path(album_dir, f"{t + 1:02d} - Leftover", 'mp3'), 'mp3', artist='Artist 0000')
+            file_count += 1
+
+    return expected, excluded_dirs, file_count
+
+# ---------------------------------------------------------------------------
+# Stages
+# ---------------------------------------------------------------------------
+
+class Stage:
+    """Times a block; with --trace-memory also records the Python allocation peak inside it."""
+
+    def __init__(self, name, results, trace_memory):
+        self.name = name
+        self.results = results
+        self.trace_memory = trace_memory
+
+    def __enter__(self):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        peak = tracemalloc.get_traced_memory()[1] if self.trace_memory else None
+        self.results.append((self.name, elapsed, peak))
+        return False
+
+def init_worker(fast_tags):
+    # Spawned workers (Windows, macOS) re-import the module and would not see --mutagen otherwise
+    ftp.FAST_TAGS = fast_tags
+
+def read_all_tags(files, jobs, cache=None):
+    if jobs > 1 and cache is None:
+        batches = [files[i:i + ftp.PARSE_BATCH_SIZE] for i in range(0, len(files), ftp.PARSE_BATCH_SIZE)]
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(ftp.FAST_TAGS,)) as pool:
+            return {path: tags for batch, result in zip(batches, pool.map(ftp.read_tags_batch, batches))
+                    for path, tags in zip(batch, result)}
+    return {path: ftp.get_tags(path, cache) for path in files}
+
+def verify(playlists_dir, expected):
+    """Compare the written playlists (track order included) with the expected grouping. Returns a list of problems."""
+    problems = []
+    found = {}
+    for name in os.listdir(playlists_dir):
+        if name.endswith('.m3u8'):
+            with open(os.path.join(playlists_dir, name), encoding='utf-8') as pl_file:
+                found[name[:-len('.m3u8')]] = [line.strip() for line in pl_file if line.strip() and line[0] != '#']
+    for group_key, tracks in expected.items():
+        if group_key not in found:
+            problems.append(f"missing playlist: {group_key}")
+            continue
+        got = set(found[group_key])
+        if got != tracks:
+            problems.append(f"{group_key}: {len(got - tracks)} unexpected, {len(tracks - got)} missing tracks")
+        elif found[group_key] != sorted(tracks, key=lambda x: (os.path.basename(x), x)):
+            problems.append(f"{group_key}: tracks out of order")
+    for group_key in found.keys() - expected.keys():
+        problems.append(f"unexpected playlist: {group_key}")
+    return problems
+
+def run_benchmark(root_dir, playlists_dir, args, expected):
+    results = []
+    if args.trace_memory:
+        tracemalloc.start()
+
+    with Stage('walk', results, args.trace_memory):
+        walk_stats = {'dirs': 0, 'excluded': 0}
+        batches = list(ftp.walk_audio_dirs(root_dir, walk_stats))
+    files = [path for _, audio_files in batches for path in sorted(audio_files)]
+
+    with Stage('tags', results, args.trace_memory):
+        file_tags = read_all_tags(files, args.jobs)
+
+    if args.cache:
+        cache_path = os.path.join(os.path.dirname(playlists_dir), 'tag_cache.sqlite3')
+        cache = ftp.TagCache(cache_path)
+        with Stage('tags (cold cache)', results, args.trace_memory):
+            read_all_tags(files, 1, cache)
+            cache.commit()
+        cache.close()
+        cache = ftp.TagCache(cache_path)
+        with Stage('tags (warm cache)', results, args.trace_memory):
+            read_all_tags(files, 1, cache)
+        cache.close()
+
+    with Stage('grouping', results, args.trace_memory):
+        group_to_tracks = defaultdict(set)
+        for dirpath, audio_files in batches:
+            groups = defaultdict(set)
+            ftp.group_directory(os.path.basename(dirpath), audio_files, file_tags, groups)
+            ftp.merge_groups(group_to_tracks, groups)
+
+    # Per-playlist "Created playlist" lines go to devnull: same cost, readable report
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        with Stage('playlists', results, args.trace_memory):
+            for group_key, tracks in group_to_tracks.items():
+                ftp.create_playlist(group_key, tracks, playlists_dir)
+
+        with Stage('playlists (unchanged)', results, args.trace_memory):
+            for group_key, tracks in group_to_tracks.items():
+                ftp.create_playlist(group_key, tracks, playlists_dir)
+
+    if args.trace_memory:
+        tracemalloc.stop()
+
+    print(f"\n{len(files)} audio files in {walk_stats['dirs']} dirs ({walk_stats['excluded']} excluded), "
+          f"{len(group_to_tracks)} groups")
+    print(f"{'stage':<24}{'seconds':>10}{'files/s':>12}{'peak MiB':>10}")
+    for name, elapsed, peak in results:
+        rate = f"{len(files) / elapsed:,.0f}" if elapsed > 0 else '-'
+        peak_text = f"{peak / 2 ** 20:.1f}" if peak is not None else '-'
+        print(f"{name:<24}{elapsed:>10.3f}{rate:>12}{peak_text:>10}")
+    if resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in KiB on Linux and in bytes on macOS
+        maxrss_mib = maxrss / 2 ** 20 if sys.platform == 'darwin' else maxrss / 2 ** 10
+        print(f"Process peak RSS: {maxrss_mib:.1f} MiB")
+
+    problems = verify(playlists_dir, expected)
+    if problems:
+        print(f"\nVERIFY FAILED ({len(problems)} problems):")
+        for problem in problems[:20]:
+            print(f"  {problem}")
+        return False
+    print(f"\nVerify OK: {len(expected)} playlists match the generated library")
+    return True
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark folder_to_playlists.py stages on a generated synthetic music library.")
+    parser.add_argument('--artists', type=int, default=50, help="Number of artists (default: 50)")
+    parser.add_argument('--albums', type=int, default=4, help="Albums per artist (default: 4)")
+    parser.add_argument('--tracks', type=int, default=10, help="Tracks per album (default: 10)")
+    parser.add_argument('--compilations', type=int, default=10, help="Compilation folders (default: 10)")
+    parser.add_argument('--excluded', type=int, default=2, help="Excluded folders with tracks (default: 2)")
+    parser.add_argument('--formats', default=','.join(FORMATS),
+                        help=f"Comma-separated formats to mix (default: {','.join(FORMATS)})")
+    parser.add_argument('--untagged', type=float, default=0.1,
+                        help="Share of albums without tags, grouped by file name (default: 0.1)")
+    parser.add_argument('--albumartist', type=float, default=0.5,
+                        help="Share of tagged albums that also have albumartist (default: 0.5)")
+    parser.add_argument('--cover', type=int, default=0, metavar='BYTES',
+                        help="Embedded cover size per tagged track (default: 0)")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed (default: 1)")
+    parser.add_argument('--jobs', '-j', type=int, default=1, help="Worker processes for the tags stage (default: 1)")
+    parser.add_argument('--cache', action='store_true', help="Also time tag reading through a cold and a warm tag cache")
+    parser.add_argument('--mutagen', action='store_true', help="Disable the fast tag readers (mutagen only)")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="Per-stage Python allocation peaks via tracemalloc (slower)")
+    parser.add_argument('--dir', help="Work directory (default: a temporary one)")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated library and playlists")
+    args = parser.parse_args()
+    args.formats = [fmt.strip() for fmt in args.formats.split(',') if fmt.strip()]
+    unknown = [fmt for fmt in args.formats if fmt not in FORMATS]
+    if unknown or not args.formats:
+        parser.error(f"--formats must be a subset of {','.join(FORMATS)}")
+    if args.tracks < ftp.MIN_TRACKS_PER_PLAYLIST:
+        parser.error(f"--tracks must be >= {ftp.MIN_TRACKS_PER_PLAYLIST} so every album gets a playlist")
+    return args
+
+def main():
+    args = parse_args()
+    ftp.DEBUG = False
+    ftp.FAST_TAGS = not args.mutagen
+
+    work_dir = os.path.abspath(args.dir) if args.dir else tempfile.mkdtemp(prefix='ftp_bench_')
+    root_dir = os.path.join(work_dir, 'library')
+    playlists_dir = os.path.join(work_dir, 'playlists')
+    if os.path.exists(root_dir) or os.path.exists(playlists_dir):
+        sys.exit(f"{work_dir} already contains a library/playlists folder, pick an empty --dir")
+    os.makedirs(root_dir)
+    os.makedirs(playlists_dir)
+
+    try:
+        started = time.perf_counter()
+        expected, excluded_dirs, file_count = generate_library(root_dir, args)
+        ftp.set_excluded_dirs(excluded_dirs)
+        print(f"Generated {file_count} files in {time.perf_counter() - started:.1f}s under {root_dir}")
+        ok = run_benchmark(root_dir, playlists_dir, args, expected)
+    finally:
+        if args.keep:
+            print(f"Kept {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    sys.exit(0 if ok else 1)
+
+if __name__ == "__main__":
+    main()
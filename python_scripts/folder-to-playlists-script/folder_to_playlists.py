@@ -1,14 +1,24 @@
 import os
 import sys
 import re
-from collections import defaultdict
+import sqlite3
+import hashlib
+import argparse
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # For mutagen
 import mutagen
 from mutagen.easyid3 import EasyID3  # MP3
 from mutagen.mp4 import MP4  # M4A, AAC, ALAC
 from mutagen.flac import FLAC  # FLAC
-from mutagen.oggvorbis import OggVorbis  # OGG, OPUS
+from mutagen.oggvorbis import OggVorbis  # OGG
+from mutagen.oggopus import OggOpus  # OPUS
 from mutagen.asf import ASF  # WMA
 from mutagen.apev2 import APEv2  # APE
 from mutagen.aiff import AIFF  # AIFF
@@ -26,6 +36,7 @@ AUDIO_EXTS = [
     '.mp3', '.opus', '.ogg', '.m4a', '.flac',
     '.wav', '.aac', '.wma', '.ape', '.alac', '.aiff'
 ]
+AUDIO_EXTS_SET = frozenset(AUDIO_EXTS)
 
 # Excluded directories (case-insensitive, normalized paths)
 EXCLUDED_DIRS_RAW = [
@@ -38,128 +49,505 @@ EXCLUDED_DIRS_RAW = [
     'C:/!!Downloads/Music/!!movies',
     # Add more if needed
 ]
-EXCLUDED_DIRS = set(os.path.normpath(os.path.abspath(d)).lower() for d in EXCLUDED_DIRS_RAW)
+def excluded_prefixes(excluded_dirs):
+    """All ancestors of excluded dirs: subtrees outside these cannot contain an excluded dir."""
+    prefixes = set()
+    for excluded in excluded_dirs:
+        parent = os.path.dirname(excluded)
+        while parent and parent not in prefixes:
+            prefixes.add(parent)
+            if os.path.dirname(parent) == parent:
+                break
+            parent = os.path.dirname(parent)
+    return prefixes
+
+def set_excluded_dirs(raw_dirs):
+    """Replace the excluded directories (e.g. from the benchmark or another script)."""
+    global EXCLUDED_DIRS, EXCLUDED_PREFIXES
+    EXCLUDED_DIRS = set(os.path.normpath(os.path.abspath(d)).lower() for d in raw_dirs)
+    EXCLUDED_PREFIXES = excluded_prefixes(EXCLUDED_DIRS)
+
+EXCLUDED_DIRS = set()
+EXCLUDED_PREFIXES = set()
+set_excluded_dirs(EXCLUDED_DIRS_RAW)
 
 # Threshold for detecting compilations based on unique artists in a folder
 UNIQUE_ARTIST_THRESHOLD = 2  # If >= this number of unique artists in a dir, treat as compilation
 
-def get_metadata(file_path, key):
+# Names of the playlists this tool has written, kept in the playlists dir; --prune only deletes these
+PLAYLIST_MANIFEST = '.folder_to_playlists.manifest'
+
+# Persistent tag cache (SQLite), keyed by path + size + mtime. Set to None to disable
+TAG_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.tag_cache.sqlite3')
+TAG_KEYS = ('albumartist', 'artist', 'album', 'compilation')
+# Bump when tag extraction changes results, so cached entries are re-read
+TAG_CACHE_VERSION = 3
+# New entries are committed in batches, so an interrupted scan keeps most of its work
+TAG_CACHE_COMMIT_EVERY = 500
+
+# Compact per-file tag record (namedtuple has no per-instance __dict__)
+TrackTags = namedtuple('TrackTags', TAG_KEYS)
+EMPTY_TAGS = TrackTags(None, None, None, False)
+
+class TagCache:
     """
-    Generic metadata extractor for artist, albumartist, album, compilation.
-    Returns first item if list, or None/False.
+    SQLite-backed cache of grouping tags. An entry is valid only while file size and mtime match,
+    so repeated runs open just new or modified files.
     """
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        try:
+            if self.conn.execute('PRAGMA user_version').fetchone()[0] != TAG_CACHE_VERSION:
+                self.conn.execute('DROP TABLE IF EXISTS tags')
+                self.conn.execute(f'PRAGMA user_version = {TAG_CACHE_VERSION}')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS tags ('
+                'path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, '
+                'albumartist TEXT, artist TEXT, album TEXT, compilation INTEGER)'
+            )
+        except sqlite3.Error:
+            self.conn.close()
+            raise
+        self.hits = 0
+        self.misses = 0
+        self.uncommitted = 0
+        self.seen = set()
+
+    def get(self, file_path, size, mtime_ns):
+        self.seen.add(file_path)
+        row = self.conn.execute(
+            'SELECT albumartist, artist, album, compilation FROM tags WHERE path = ? AND size = ? AND mtime_ns = ?',
+            (file_path, size, mtime_ns)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return TrackTags(row[0], row[1], row[2], bool(row[3]))
+
+    def put(self, file_path, size, mtime_ns, tags):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (file_path, size, mtime_ns, tags.albumartist, tags.artist, tags.album, int(tags.compilation))
+        )
+        self.uncommitted += 1
+        if self.uncommitted >= TAG_CACHE_COMMIT_EVERY:
+            self.commit()
+
+    def prune(self, root_dir):
+        """Drop entries under root_dir for files that were not seen in this scan (deleted or moved)."""
+        prefix = root_dir.replace('\\', '/').rstrip('/') + '/'
+        stale = [
+            (path,) for (path,) in self.conn.execute('SELECT path FROM tags WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))
+            if path not in self.seen
+        ]
+        self.conn.executemany('DELETE FROM tags WHERE path = ?', stale)
+        return len(stale)
+
+    def commit(self):
+        self.conn.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+
+def open_tag_cache(db_path):
+    """TagCache at db_path; None if caching is disabled or the database cannot be opened."""
+    if not db_path:
+        return None
     try:
-        ext = os.path.splitext(file_path)[1].lower()
-        audio = None
-        if ext == '.mp3':
-            audio = EasyID3(file_path)
-        elif ext in ('.m4a', '.aac', '.alac'):
-            audio = MP4(file_path)
-        elif ext == '.flac':
-            audio = FLAC(file_path)
-        elif ext in ('.ogg', '.opus'):
-            audio = OggVorbis(file_path)
-        elif ext == '.wma':
-            audio = ASF(file_path)
-        elif ext == '.ape':
-            audio = APEv2(file_path)
-        elif ext == '.aiff':
-            audio = AIFF(file_path)
-        elif ext == '.wav':
-            audio = WAVE(file_path)
-
-        if audio is None:
-            return None if key != 'compilation' else False
-
-        value = None
-        if ext == '.mp3':
-            if key == 'albumartist':
-                value = audio.get('albumartist', None)
-            elif key == 'artist':
-                value = audio.get('artist', None)
-            elif key == 'album':
-                value = audio.get('album', None)
-            elif key == 'compilation':
-                return audio.get('compilation', ['0'])[0] == '1'
-        elif ext in ('.m4a', '.aac', '.alac'):
-            if key == 'albumartist':
-                value = audio.get('aART', None)
-            elif key == 'artist':
-                value = audio.get('\xa9ART', None)
-            elif key == 'album':
-                value = audio.get('\xa9alb', None)
-            elif key == 'compilation':
-                return audio.get('cpil', [False])[0]
-        elif ext == '.flac':
-            if key == 'albumartist':
-                value = audio.get('albumartist', None)
-            elif key == 'artist':
-                value = audio.get('artist', None)
-            elif key == 'album':
-                value = audio.get('album', None)
-            elif key == 'compilation':
-                return 'compilation' in audio and audio['compilation'] == ['1']
-        elif ext in ('.ogg', '.opus'):
-            if key == 'albumartist':
-                value = audio.get('albumartist', None)
-            elif key == 'artist':
-                value = audio.get('artist', None)
-            elif key == 'album':
-                value = audio.get('album', None)
-            elif key == 'compilation':
-                return 'compilation' in audio and audio['compilation'] == ['1']
-        elif ext == '.wma':
-            if key == 'albumartist':
-                value = audio.get('WM/AlbumArtist', None)
-            elif key == 'artist':
-                value = audio.get('Author', None)
-            elif key == 'album':
-                value = audio.get('WM/AlbumTitle', None)
-            elif key == 'compilation':
-                return False
-        elif ext == '.ape':
-            if key == 'albumartist':
-                value = audio.get('Album Artist', None)
-            elif key == 'artist':
-                value = audio.get('Artist', None)
-            elif key == 'album':
-                value = audio.get('Album', None)
-            elif key == 'compilation':
-                return 'Compilation' in audio and audio['Compilation'] == ['1']
-        elif ext == '.aiff':
-            if key == 'albumartist':
-                value = audio.get('TPE2', None)
-            elif key == 'artist':
-                value = audio.get('TPE1', None)
-            elif key == 'album':
-                value = audio.get('TALB', None)
-            elif key == 'compilation':
-                return False
-        elif ext == '.wav':
-            if key == 'albumartist':
-                value = audio.get('TPE2', None)
-            elif key == 'artist':
-                value = audio.get('TPE1', None)
-            elif key == 'album':
-                value = audio.get('TALB', None)
-            elif key == 'compilation':
-                return False
-
-        if isinstance(value, list) and value:
-            return value[0]
+        return TagCache(db_path)
+    except sqlite3.Error as e:
+        print(f"Tag cache unavailable ({e}), reading tags without it")
+        return None
+
+# Per-extension reader and tag names: (reader, albumartist, artist, album, compilation or None)
+TAG_READERS = {
+    '.mp3': (EasyID3, 'albumartist', 'artist', 'album', 'compilation'),
+    '.m4a': (MP4, 'aART', '\xa9ART', '\xa9alb', 'cpil'),
+    '.aac': (MP4, 'aART', '\xa9ART', '\xa9alb', 'cpil'),
+    '.alac': (MP4, 'aART', '\xa9ART', '\xa9alb', 'cpil'),
+    '.flac': (FLAC, 'albumartist', 'artist', 'album', 'compilation'),
+    '.ogg': (OggVorbis, 'albumartist', 'artist', 'album', 'compilation'),
+    '.opus': (OggOpus, 'albumartist', 'artist', 'album', 'compilation'),
+    '.wma': (ASF, 'WM/AlbumArtist', 'Author', 'WM/AlbumTitle', None),
+    '.ape': (APEv2, 'Album Artist', 'Artist', 'Album', 'Compilation'),
+    '.aiff': (AIFF, 'TPE2', 'TPE1', 'TALB', None),
+    '.wav': (WAVE, 'TPE2', 'TPE1', 'TALB', None),
+}
+
+def _first_text(value):
+    """First item if list; mutagen value objects (ASF, APE, ID3 frames) become plain strings."""
+    if isinstance(value, list):
+        value = value[0] if value else None
+    return str(value) if value else None
+
+def _is_compilation(value):
+    """Compilation flag: '1' in text tags, True in MP4 'cpil'."""
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, bool):
         return value
+    return value is not None and str(value) == '1'
+
+# Fast tag-only readers: read just the tag region instead of building full mutagen objects.
+# Each returns TrackTags, or None when it cannot decide (then mutagen is used). Set to False to always use mutagen
+FAST_TAGS = True
+
+def _tags_from_dict(values, albumartist_key, artist_key, album_key, compilation_key):
+    """Build TrackTags from {lowercase key: first value} the same way read_tags treats mutagen values."""
+    return TrackTags(
+        _first_text(values.get(albumartist_key)),
+        _first_text(values.get(artist_key)),
+        _first_text(values.get(album_key)),
+        _is_compilation(values.get(compilation_key)),
+    )
+
+def _syncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+def _id3_text(body):
+    """First string of an ID3 text frame body."""
+    if not body:
+        return None
+    encoding, raw = body[0], body[1:]
+    if encoding == 0:
+        text = raw.decode('latin-1')
+    elif encoding == 1:
+        text = raw.decode('utf-16')
+    elif encoding == 2:
+        text = raw.decode('utf-16-be')
+    elif encoding == 3:
+        text = raw.decode('utf-8')
+    else:
+        raise ValueError("bad ID3 text encoding")
+    return text.split('\0')[0]
+
+# ID3 frame ids (v2.3/v2.4 and v2.2) of the grouping keys
+ID3_FRAMES = {
+    b'TPE2': 'albumartist', b'TPE1': 'artist', b'TALB': 'album', b'TCMP': 'compilation',
+    b'TP2': 'albumartist', b'TP1': 'artist', b'TAL': 'album', b'TCP': 'compilation',
+}
+
+def _fast_id3(f):
+    """MP3: walk ID3v2 frames at the start of the file, seeking over pictures and other frames."""
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b'ID3':
+        return None  # No ID3v2 (maybe ID3v1 only): let mutagen decide
+    version, flags = header[3], header[5]
+    if version not in (2, 3, 4) or flags & 0xC0:
+        return None  # Unsynchronisation / extended header: rare, leave to mutagen
+    end = 10 + _syncsafe(header[6:10])
+    id_len, hdr_len = (3, 6) if version == 2 else (4, 10)
+    values = {}
+    pos = 10
+    while pos + hdr_len <= end:
+        f.seek(pos)
+        frame = f.read(hdr_len)
+        frame_id = frame[:id_len]
+        if len(frame) < hdr_len or frame_id[:1] == b'\0':
+            break  # Padding
+        if not frame_id.isalnum():
+            return None  # Broken frame sizes: let mutagen sort it out
+        if version == 2:
+            size = int.from_bytes(frame[3:6], 'big')
+        elif version == 4:
+            size = _syncsafe(frame[4:8])
+        else:
+            size = int.from_bytes(frame[4:8], 'big')
+        key = ID3_FRAMES.get(frame_id)
+        if key is not None and key not in values:
+            if version > 2 and frame[9] & (0x4F if version == 4 else 0xE0):
+                return None  # Compressed / encrypted / unsynchronised frame
+            values[key] = _id3_text(f.read(size))
+        pos += hdr_len + size
+    if 'artist' not in values or 'album' not in values:
+        # mutagen fills frames missing from ID3v2 with the ID3v1 footer's artist/album
+        f.seek(0, os.SEEK_END)
+        if f.tell() >= 128:
+            f.seek(-128, os.SEEK_END)
+            if f.read(3) == b'TAG':
+                return None
+    return _tags_from_dict(values, 'albumartist', 'artist', 'album', 'compilation')
+
+def _vorbis_comments(data):
+    """{lowercase key: first value} from a Vorbis comment block (vendor, count, KEY=value entries)."""
+    vendor_len = int.from_bytes(data[0:4], 'little')
+    pos = 4 + vendor_len
+    count = int.from_bytes(data[pos:pos + 4], 'little')
+    pos += 4
+    values = {}
+    for _ in range(count):
+        length = int.from_bytes(data[pos:pos + 4], 'little')
+        pos += 4
+        entry = data[pos:pos + length]
+        pos += length
+        if len(entry) < length:
+            raise ValueError("truncated Vorbis comment")
+        name, sep, value = entry.partition(b'=')
+        if sep:
+            values.setdefault(name.decode('ascii').lower(), value.decode('utf-8', 'replace'))
+    return values
+
+def _fast_flac(f):
+    """FLAC: walk metadata block headers to the VORBIS_COMMENT block, seeking over the rest."""
+    if f.read(4) != b'fLaC':
+        return None  # e.g. ID3-prefixed FLAC
+    while True:
+        header = f.read(4)
+        if len(header) < 4:
+            return None
+        block_type, size = header[0] & 0x7F, int.from_bytes(header[1:4], 'big')
+        if block_type == 4:
+            values = _vorbis_comments(f.read(size))
+            return _tags_from_dict(values, 'albumartist', 'artist', 'album', 'compilation')
+        if header[0] & 0x80:
+            return EMPTY_TAGS  # Last block, no comments
+        f.seek(size, 1)
+
+def _fast_ogg(f):
+    """Ogg Vorbis / Opus: reassemble the second packet (comment header) from the first pages."""
+    packets = []
+    packet = b''
+    while len(packets) < 2:
+        header = f.read(27)
+        if len(header) < 27 or header[:4] != b'OggS':
+            return None
+        lacing = f.read(header[26])
+        data = f.read(sum(lacing))
+        pos = 0
+        for lace in lacing:
+            packet += data[pos:pos + lace]
+            pos += lace
+            if lace < 255:
+                packets.append(packet)
+                packet = b''
+    comment = packets[1]
+    if comment[:7] == b'\x03vorbis':
+        values = _vorbis_comments(comment[7:])
+    elif comment[:8] == b'OpusTags':
+        values = _vorbis_comments(comment[8:])
+    else:
+        return None
+    return _tags_from_dict(values, 'albumartist', 'artist', 'album', 'compilation')
+
+MP4_ITEMS = {b'aART': 'albumartist', b'\xa9ART': 'artist', b'\xa9alb': 'album', b'cpil': 'compilation'}
+
+def _mp4_atoms(f, start, end):
+    """Yield (type, payload_start, payload_end) of the atoms between start and end, reading headers only."""
+    pos = start
+    while pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, kind = int.from_bytes(header[:4], 'big'), header[4:8]
+        payload = pos + 8
+        if size == 1:
+            size = int.from_bytes(f.read(8), 'big')
+            payload += 8
+        elif size == 0:
+            size = end - pos
+        if size < payload - pos:
+            raise ValueError("bad MP4 atom size")
+        yield kind, payload, pos + size
+        pos += size
+
+def _mp4_child(f, start, end, kind):
+    for child, payload, child_end in _mp4_atoms(f, start, end):
+        if child == kind:
+            return payload, child_end
+    return None
+
+def _fast_mp4(f):
+    """M4A: follow moov/udta/meta/ilst, seeking over mdat and track atoms."""
+    file_end = f.seek(0, 2)
+    f.seek(4)
+    if f.read(4) != b'ftyp':
+        return None  # Not an MP4 container (e.g. raw ADTS .aac)
+    path = _mp4_child(f, 0, file_end, b'moov')
+    for kind in (b'udta', b'meta'):
+        if path is None:
+            return EMPTY_TAGS
+        path = _mp4_child(f, path[0], path[1], kind)
+    if path is None:
+        return EMPTY_TAGS
+    path = _mp4_child(f, path[0] + 4, path[1], b'ilst')  # meta is a full atom: skip version/flags
+    if path is None:
+        return EMPTY_TAGS
+    values = {}
+    for kind, payload, item_end in list(_mp4_atoms(f, path[0], path[1])):
+        key = MP4_ITEMS.get(kind)
+        if key is None:
+            continue
+        data = _mp4_child(f, payload, item_end, b'data')
+        if data is None:
+            continue
+        f.seek(data[0])
+        body = f.read(data[1] - data[0])
+        data_type, value = int.from_bytes(body[1:4], 'big'), body[8:]
+        if key == 'compilation':
+            values[key] = bool(value and value[0])
+        elif data_type == 1:
+            values[key] = value.decode('utf-8')
+        else:
+            return None
+    return _tags_from_dict(values, 'albumartist', 'artist', 'album', 'compilation')
+
+def _fast_ape(f):
+    """APE: read the APEv2 footer at the end of the file (before an optional ID3v1 tag) and its items."""
+    file_end = f.seek(0, 2)
+    footer_pos = file_end - 32
+    if file_end >= 160:
+        f.seek(file_end - 128)
+        if f.read(3) == b'TAG':
+            footer_pos -= 128
+    if footer_pos < 0:
+        return None
+    f.seek(footer_pos)
+    footer = f.read(32)
+    if footer[:8] != b'APETAGEX':
+        return None
+    tag_size, count = int.from_bytes(footer[12:16], 'little'), int.from_bytes(footer[16:20], 'little')
+    items_start = footer_pos + 32 - tag_size
+    if items_start < 0:
+        return None
+    f.seek(items_start)
+    data = f.read(tag_size - 32)
+    values = {}
+    pos = 0
+    for _ in range(count):
+        size, flags = int.from_bytes(data[pos:pos + 4], 'little'), int.from_bytes(data[pos + 4:pos + 8], 'little')
+        key_end = data.index(b'\0', pos + 8)
+        key = data[pos + 8:key_end].decode('ascii').lower()
+        value = data[key_end + 1:key_end + 1 + size]
+        pos = key_end + 1 + size
+        if key in ('album artist', 'artist', 'album', 'compilation'):
+            if (flags >> 1) & 3:
+                return None  # Binary / external value: let mutagen decide
+            values.setdefault(key, value.decode('utf-8'))
+    return _tags_from_dict(values, 'album artist', 'artist', 'album', 'compilation')
+
+FAST_TAG_READERS = {
+    '.mp3': _fast_id3,
+    '.flac': _fast_flac,
+    '.ogg': _fast_ogg,
+    '.opus': _fast_ogg,
+    '.m4a': _fast_mp4,
+    '.aac': _fast_mp4,
+    '.alac': _fast_mp4,
+    '.ape': _fast_ape,
+}
+
+def fast_read_tags(file_path):
+    """Tag-only read of the grouping keys; None if the format has no fast reader or it cannot decide."""
+    reader = FAST_TAG_READERS.get(os.path.splitext(file_path)[1].lower())
+    if reader is None:
+        return None
+    try:
+        with open(file_path, 'rb') as f:
+            return reader(f)
+    except (OSError, ValueError, IndexError):
+        return None
+
+def read_tags(file_path):
+    """
+    Parse the file once and return TrackTags(albumartist, artist, album, compilation).
+    Uses the fast tag-only readers first, then mutagen. Unknown formats and unreadable files give EMPTY_TAGS.
+    """
+    if FAST_TAGS:
+        tags = fast_read_tags(file_path)
+        if tags is not None:
+            return tags
+    reader = TAG_READERS.get(os.path.splitext(file_path)[1].lower())
+    if reader is None:
+        return EMPTY_TAGS
+    cls, albumartist_key, artist_key, album_key, compilation_key = reader
+    try:
+        audio = cls(file_path)
+        return TrackTags(
+            _first_text(audio.get(albumartist_key)),
+            _first_text(audio.get(artist_key)),
+            _first_text(audio.get(album_key)),
+            _is_compilation(audio.get(compilation_key)) if compilation_key else False,
+        )
     except Exception:
-        return None if key != 'compilation' else False
+        return EMPTY_TAGS
+
+def get_metadata(file_path, key):
+    """
+    Generic metadata extractor for artist, albumartist, album, compilation.
+    Returns a string or None (False/True for compilation). Prefer read_tags for several keys.
+    """
+    return getattr(read_tags(file_path), key)
+
+def lookup_cached(file_path, cache):
+    """Return (tags or None, stat or None): tags only if the cache entry matches size and mtime."""
+    if cache is None:
+        return None, None
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None, None
+    return cache.get(file_path, stat.st_size, stat.st_mtime_ns), stat
+
+def get_tags(file_path, cache=None):
+    """
+    Return TrackTags for the file, served from the tag cache when size and mtime are unchanged.
+    """
+    tags, stat = lookup_cached(file_path, cache)
+    if tags is not None:
+        return tags
+
+    tags = read_tags(file_path)
+    if stat is not None:
+        cache.put(file_path, stat.st_size, stat.st_mtime_ns, tags)
+    return tags
+
+# Files per task sent to the worker pool in --jobs mode
+PARSE_BATCH_SIZE = 64
+
+def read_tags_batch(file_paths):
+    """Worker entry point: read_tags for a batch of files."""
+    return [read_tags(file_path) for file_path in file_paths]
 
-def get_group_key(file_path, dir_name):
+def submit_directory(pool, audio_files, cache):
+    """
+    Resolve cache hits right away and send the rest of the directory to the pool in batches.
+    Returns (file_tags, pending) for collect_directory.
+    """
+    file_tags = {}
+    misses = []
+    for full_path in audio_files:
+        tags, stat = lookup_cached(full_path, cache)
+        if tags is not None:
+            file_tags[full_path] = tags
+        else:
+            misses.append((full_path, stat))
+
+    pending = []
+    for i in range(0, len(misses), PARSE_BATCH_SIZE):
+        batch = misses[i:i + PARSE_BATCH_SIZE]
+        pending.append((batch, pool.submit(read_tags_batch, [full_path for full_path, _ in batch])))
+    return file_tags, pending
+
+def collect_directory(file_tags, pending, cache):
+    """Wait for the directory's batches and store the parsed tags (and cache them)."""
+    for batch, future in pending:
+        for (full_path, stat), tags in zip(batch, future.result()):
+            file_tags[full_path] = tags
+            if stat is not None:
+                cache.put(full_path, stat.st_size, stat.st_mtime_ns, tags)
+    return file_tags
+
+def get_group_key(file_path, dir_name, tags):
     """
     Get grouping key: prefer albumartist, fallback to artist, then parse filename/dir_name.
     If 'Various Artists' or compilation, use 'Various Artists - album or dir_name'.
     """
-    albumartist = get_metadata(file_path, 'albumartist')
-    artist = get_metadata(file_path, 'artist')
-    album = get_metadata(file_path, 'album')
-    is_compilation = get_metadata(file_path, 'compilation')
+    albumartist, artist, album, is_compilation = tags
 
     key = albumartist or artist
 
@@ -191,31 +579,587 @@ def get_group_key(file_path, dir_name):
     key = ''.join(c if c.isalnum() or c in ' -_' else '_' for c in str(key))
     return key or 'Unknown'
 
+def is_excluded(dirpath):
+    return os.path.normcase(os.path.normpath(os.path.abspath(dirpath))).lower() in EXCLUDED_DIRS
+
+def walk_audio_dirs(root_dir, stats, yield_empty=False):
+    """
+    Top-down walk (same order as os.walk) built on os.scandir. Yields (dirpath, audio_files) for
+    directories with audio files (all directories if yield_empty); audio_files is a set of absolute paths
+    with forward slashes. Excluded subtrees are pruned before descending; stats['dirs'] / stats['excluded']
+    are updated in place.
+    """
+    root_dir = os.path.normpath(os.path.abspath(root_dir))
+    # (dirpath, check_excluded): exclusion is checked only under an ancestor of some excluded dir
+    stack = [(root_dir, os.path.normcase(root_dir).lower() in EXCLUDED_PREFIXES)]
+    while stack:
+        dirpath, check_excluded = stack.pop()
+        try:
+            with os.scandir(dirpath) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        stats['dirs'] += 1
+
+        slash_dir = dirpath.replace('\\', '/')
+        if not slash_dir.endswith('/'):
+            slash_dir += '/'
+        audio_files = set()
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                # Like os.walk(followlinks=False): symlinked dirs are not descended into
+                if not entry.is_symlink():
+                    subdirs.append(entry)
+            elif os.path.splitext(entry.name)[1].lower() in AUDIO_EXTS_SET:
+                audio_files.add(slash_dir + entry.name)
+
+        if audio_files or yield_empty:
+            yield dirpath, audio_files
+
+        for entry in reversed(subdirs):
+            child_check = False
+            if check_excluded:
+                key = os.path.normcase(entry.path).lower()
+                if key in EXCLUDED_DIRS:
+                    if DEBUG:
+                        print(f"Skipping excluded dir: {entry.path}")
+                    stats['dirs'] += 1
+                    stats['excluded'] += 1
+                    continue
+                child_check = key in EXCLUDED_PREFIXES
+            stack.append((entry.path, child_check))
+
+def group_directory(dir_name, audio_files, file_tags, group_to_tracks):
+    """
+    Add one directory's tracks to group_to_tracks. A folder with several artists or a compilation flag
+    becomes a single 'Various Artists - ...' group, otherwise tracks are grouped one by one.
+    """
+    # Detect if this folder is a compilation based on unique artists or compilation flag
+    unique_artists = set()
+    has_compilation_flag = False
+    for full_path in audio_files:
+        tags = file_tags[full_path]
+        aa = tags.albumartist or tags.artist or 'Unknown'
+        unique_artists.add(str(aa).lower())  # Case-insensitive unique
+        if tags.compilation:
+            has_compilation_flag = True
+
+    is_compilation_folder = len(unique_artists) >= UNIQUE_ARTIST_THRESHOLD or has_compilation_flag
+
+    if is_compilation_folder:
+        # Treat whole folder as one group, use common album if available, else dir_name
+        common_album = None
+        albums = set()
+        for full_path in audio_files:
+            alb = file_tags[full_path].album
+            if alb:
+                albums.add(str(alb).lower())
+        if len(albums) == 1:
+            common_album = next(iter(albums)).title()  # Use title case for niceness
+        group_key = common_album or dir_name
+        group_key = f"Various Artists - {group_key}" if group_key else 'Unknown Compilation'
+        for full_path in audio_files:
+            group_to_tracks[group_key].add(full_path)
+    else:
+        # Normal per-track grouping
+        for full_path in audio_files:
+            group_key = get_group_key(full_path, dir_name, file_tags[full_path])
+            group_to_tracks[group_key].add(full_path)
+
+# Duplicate detection (--dedup): bytes hashed at each end of a file before a full hash is needed
+DEDUP_WINDOW = 64 * 1024
+DEDUP_WORKERS = 4  # Hashing threads (file reads and hashlib release the GIL)
+
+def _partial_digest(path, size):
+    """Hash of the first and last DEDUP_WINDOW bytes (the whole file if it is small)."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(DEDUP_WINDOW))
+        if size > DEDUP_WINDOW:
+            f.seek(max(DEDUP_WINDOW, size - DEDUP_WINDOW))
+            digest.update(f.read(DEDUP_WINDOW))
+    return digest.digest()
+
+def _full_digest(path, size):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.digest()
+
+def _hash_buckets(buckets, hash_func, workers):
+    """Split each bucket of (path, size) by hash_func in a thread pool; returns the buckets that still collide."""
+    items = [item for bucket in buckets for item in bucket]
+
+    def safe_hash(item):
+        try:
+            return hash_func(*item)
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        digests = list(pool.map(safe_hash, items))
+    split = defaultdict(list)
+    for (path, size), digest in zip(items, digests):
+        if digest is not None:
+            split[size, digest].append((path, size))
+    return [bucket for bucket in split.values() if len(bucket) > 1]
+
+def find_duplicates(paths, workers=DEDUP_WORKERS, stats=None):
+    """
+    Find files with identical content: bucket by size, then hash head/tail windows inside the collisions,
+    and hash whole files only when they are larger than both windows. Returns {path: canonical path}
+    (the first path of each duplicate set in sorted order, including itself) for duplicated files only.
+    stats, if given, accumulates 'files', 'duplicates', 'bytes_read' and 'bytes_total'.
+    """
+    by_size = defaultdict(list)
+    bytes_total = 0
+    for path in paths:
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            continue
+        bytes_total += size
+        if size:
+            by_size[size].append((path, size))
+    buckets = [bucket for bucket in by_size.values() if len(bucket) > 1]
+
+    bytes_read = 0
+    if buckets:
+        bytes_read += sum(min(size, 2 * DEDUP_WINDOW) for bucket in buckets for _, size in bucket)
+        buckets = _hash_buckets(buckets, _partial_digest, workers)
+        # Files within both windows were hashed entirely already
+        large = [bucket for bucket in buckets if bucket[0][1] > 2 * DEDUP_WINDOW]
+        small = [bucket for bucket in buckets if bucket[0][1] <= 2 * DEDUP_WINDOW]
+        if large:
+            bytes_read += sum(size for bucket in large for _, size in bucket)
+            buckets = small + _hash_buckets(large, _full_digest, workers)
+
+    canonical = {}
+    for bucket in buckets:
+        bucket_paths = sorted(path for path, _ in bucket)
+        for path in bucket_paths:
+            canonical[path] = bucket_paths[0]
+
+    if stats is not None:
+        stats['files'] = stats.get('files', 0) + len(paths)
+        stats['duplicates'] = stats.get('duplicates', 0) + len(canonical) - len(buckets)
+        stats['bytes_read'] = stats.get('bytes_read', 0) + bytes_read
+        stats['bytes_total'] = stats.get('bytes_total', 0) + bytes_total
+    return canonical
+
+def dedupe_tracks(tracks, canonical):
+    """Keep one track per content (the first by sorted path) within a single playlist."""
+    kept = set()
+    seen = set()
+    for track in sorted(tracks):
+        content = canonical.get(track, track)
+        if content not in seen:
+            seen.add(content)
+            kept.add(track)
+    return kept
+
+def merge_groups(group_to_tracks, groups):
+    for group_key, tracks in groups.items():
+        group_to_tracks[group_key].update(tracks)
+
+def content_digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def playlist_digest(playlist_path):
+    """Digest of the playlist currently on disk, or None if it is missing/unreadable."""
+    try:
+        with open(playlist_path, 'r', encoding='utf-8') as pl_file:
+            return content_digest(pl_file.read())
+    except (OSError, UnicodeDecodeError):
+        return None
+
+def write_playlist(playlist_path, content):
+    """
+    Write the playlist unless the file on disk already has the same content.
+    The new file is written next to the target and renamed over it, so readers never see a partial file.
+    Returns True if the file was (re)written.
+    """
+    if playlist_digest(playlist_path) == content_digest(content):
+        return False
+    tmp_path = f"{playlist_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as pl_file:
+            pl_file.write(content)
+        os.replace(tmp_path, playlist_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return True
+
+def read_manifest(playlists_dir):
+    """File names of the playlists written by earlier runs (empty if there is no manifest yet)."""
+    try:
+        with open(os.path.join(playlists_dir, PLAYLIST_MANIFEST), 'r', encoding='utf-8') as manifest:
+            return set(line.strip() for line in manifest if line.strip())
+    except (OSError, UnicodeDecodeError):
+        return set()
+
+def save_manifest(playlists_dir, names):
+    """Record the playlist names that still exist on disk. Returns the recorded set."""
+    names = set(name for name in names if os.path.isfile(os.path.join(playlists_dir, name)))
+    write_playlist(os.path.join(playlists_dir, PLAYLIST_MANIFEST), ''.join(f"{name}\n" for name in sorted(names)))
+    return names
+
+def remove_stale_playlists(playlists_dir, keep_paths, owned_names):
+    """
+    Delete playlists written by earlier runs (owned_names) that this run did not produce.
+    Hand-made playlists are never listed in the manifest, so they are left alone. Returns the count.
+    """
+    keep = set(os.path.normcase(os.path.basename(p)) for p in keep_paths)
+    removed = 0
+    for name in sorted(owned_names):
+        playlist_path = os.path.join(playlists_dir, name)
+        if os.path.normcase(name) in keep or not os.path.isfile(playlist_path):
+            continue
+        try:
+            os.remove(playlist_path)
+        except OSError as e:
+            print(f"Cannot remove stale playlist {playlist_path}: {e}")
+            continue
+        removed += 1
+        print(f"Removed stale playlist: {playlist_path}")
+    return removed
+
 def create_playlist(group_key, audio_files, playlists_dir):
+    """
+    Write the group's playlist(s), skipping files whose content did not change.
+    Returns a list of (playlist_path, written) pairs.
+    """
     if len(audio_files) < MIN_TRACKS_PER_PLAYLIST:
         if DEBUG:
             print(f"Skipping small playlist: {group_key} ({len(audio_files)} tracks)")
-        return
+        return []
 
-    # Sort by filename
-    audio_files = sorted(list(audio_files), key=lambda x: os.path.basename(x))
+    # Sort by filename; the full path breaks ties, so the order never depends on set iteration
+    audio_files = sorted(audio_files, key=lambda x: (os.path.basename(x), x))
 
     # Split into chunks of 500
     chunk_size = 10000
+    results = []
     for i in range(0, len(audio_files), chunk_size):
         chunk = audio_files[i:i + chunk_size]
         part_num = f"_{i // chunk_size + 1}" if i > 0 else ""
         playlist_name = f"{group_key}{part_num}.m3u8"
         playlist_path = os.path.join(playlists_dir, playlist_name)
 
-        with open(playlist_path, 'w', encoding='utf-8') as pl_file:
-            pl_file.write('#EXTM3U\n')
-            for track in chunk:
-                pl_file.write(track + '\n')
+        content = '#EXTM3U\n' + ''.join(track + '\n' for track in chunk)
+        written = write_playlist(playlist_path, content)
+        if written:
+            print(f"Created playlist: {playlist_path}")
+        elif DEBUG:
+            print(f"Unchanged playlist: {playlist_path}")
+        results.append((playlist_path, written))
+    return results
+
+# Watch mode: quiet period before a burst of changes is applied, polling interval for the fallback watcher
+WATCH_DEBOUNCE_S = 0.5
+WATCH_POLL_INTERVAL_S = 10.0
 
-        print(f"Created playlist: {playlist_path}")
+class InotifyWatcher:
+    """
+    Recursive directory watcher on Linux inotify (via ctypes, no extra packages).
+    poll() returns the set of directories whose audio content may have changed.
+    """
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+                  | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+    EVENT_HEADER = struct.Struct('iIII')
+
+    def __init__(self, root_dir):
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify is only available on Linux")
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | getattr(os, 'O_CLOEXEC', 0))
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.root_dir = root_dir
+        self.wd_to_dir = {}
+        self.overflow = False
+        self.add_tree(root_dir)
+
+    def add_tree(self, top_dir):
+        """Watch top_dir and its non-excluded subdirectories. Returns the directories found."""
+        found = []
+        for dirpath, _ in walk_audio_dirs(top_dir, {'dirs': 0, 'excluded': 0}, yield_empty=True):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), self.WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                if dirpath == top_dir and not os.path.isdir(dirpath):
+                    break  # Removed before we got to it
+                raise OSError(err, f"inotify_add_watch failed for {dirpath} "
+                                   f"(raise fs.inotify.max_user_watches or use --poll)")
+            self.wd_to_dir[wd] = dirpath
+            found.append(dirpath)
+        return found
+
+    def poll(self, timeout):
+        """Wait up to timeout seconds (None = forever) and return the changed directories."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, name_len = self.EVENT_HEADER.unpack_from(data, offset)
+                offset += self.EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + name_len].rstrip(b'\0'))
+                offset += name_len
+                self._handle(wd, mask, name, changed)
+        return changed
+
+    def _handle(self, wd, mask, name, changed):
+        if mask & self.IN_Q_OVERFLOW:
+            # Events were lost: let the caller rescan everything
+            self.overflow = True
+            changed.add(self.root_dir)
+            return
+        dirpath = self.wd_to_dir.get(wd)
+        if mask & self.IN_IGNORED:
+            self.wd_to_dir.pop(wd, None)
+            return
+        if dirpath is None:
+            return
+        changed.add(dirpath)
+        if mask & self.IN_ISDIR and name:
+            child = os.path.join(dirpath, name)
+            if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                if not is_excluded(child):
+                    changed.update(self.add_tree(child))
+            else:
+                changed.add(child)
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """
+    Fallback watcher: rescans the tree every interval and compares directory snapshots
+    (directory mtime plus name/size/mtime of its audio files).
+    """
+
+    def __init__(self, root_dir, interval):
+        self.root_dir = root_dir
+        self.interval = interval
+        self.overflow = False
+        self.snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for dirpath, audio_files in walk_audio_dirs(self.root_dir, {'dirs': 0, 'excluded': 0}, yield_empty=True):
+            files = []
+            for full_path in audio_files:
+                try:
+                    st = os.stat(full_path)
+                except OSError:
+                    continue
+                files.append((full_path, st.st_size, st.st_mtime_ns))
+            try:
+                dir_mtime = os.stat(dirpath).st_mtime_ns
+            except OSError:
+                dir_mtime = None
+            snapshot[dirpath] = (dir_mtime, frozenset(files))
+        return snapshot
+
+    def poll(self, timeout):
+        # A burst still in progress simply shows up again in the next snapshot
+        time.sleep(self.interval)
+        new_snapshot = self._take_snapshot()
+        changed = set(d for d, sig in new_snapshot.items() if self.snapshot.get(d) != sig)
+        changed.update(d for d in self.snapshot if d not in new_snapshot)
+        self.snapshot = new_snapshot
+        return changed
+
+    def close(self):
+        pass
+
+class LibraryIndex:
+    """
+    In-memory directory -> {group_key: tracks} index used by --watch. Re-deriving a directory only touches
+    the groups it contributed to (before or after the change), and only their playlists are rewritten.
+    """
+
+    def __init__(self, mode, playlists_dir, dir_groups, group_playlists, tag_cache, prune, dedup=False):
+        self.mode = mode
+        self.dedup = dedup
+        self.playlists_dir = playlists_dir
+        self.dir_groups = dir_groups
+        self.group_playlists = group_playlists
+        self.tag_cache = tag_cache
+        self.prune = prune
+        self.group_dirs = defaultdict(set)
+        for dirpath, groups in dir_groups.items():
+            for group_key in groups:
+                self.group_dirs[group_key].add(dirpath)
+
+    def scan_dir(self, dirpath):
+        """Current {group_key: tracks} of a single directory (empty if it is gone or excluded)."""
+        if is_excluded(dirpath) or not os.path.isdir(dirpath):
+            return {}
+        audio_files = set()
+        slash_dir = dirpath.replace('\\', '/').rstrip('/') + '/'
+        try:
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    if not entry.is_dir() and os.path.splitext(entry.name)[1].lower() in AUDIO_EXTS_SET:
+                        audio_files.add(slash_dir + entry.name)
+        except OSError:
+            return {}
+        if not audio_files:
+            return {}
+        if self.mode == 'album':
+            return {os.path.basename(dirpath): audio_files}
+        file_tags = {full_path: get_tags(full_path, self.tag_cache) for full_path in audio_files}
+        groups = defaultdict(set)
+        group_directory(os.path.basename(dirpath), audio_files, file_tags, groups)
+        return groups
+
+    def update(self, changed_dirs):
+        """Re-derive changed directories (and indexed subdirectories of removed ones). Returns affected groups."""
+        dirs = set(changed_dirs)
+        for dirpath in changed_dirs:
+            if not os.path.isdir(dirpath):
+                prefix = os.path.join(dirpath, '')
+                dirs.update(d for d in self.dir_groups if d.startswith(prefix))
+
+        affected = set()
+        written_names = set()
+        for dirpath in dirs:
+            old_groups = self.dir_groups.pop(dirpath, {})
+            new_groups = self.scan_dir(dirpath)
+            if new_groups:
+                self.dir_groups[dirpath] = new_groups
+            for group_key in old_groups:
+                self.group_dirs[group_key].discard(dirpath)
+            for group_key in new_groups:
+                self.group_dirs[group_key].add(dirpath)
+            affected.update(group_key for group_key in old_groups if old_groups[group_key] != new_groups.get(group_key))
+            affected.update(group_key for group_key in new_groups if group_key not in old_groups)
+
+        for group_key in sorted(affected):
+            tracks = set()
+            for dirpath in self.group_dirs.get(group_key, ()):
+                tracks.update(self.dir_groups[dirpath][group_key])
+            if not self.group_dirs.get(group_key):
+                self.group_dirs.pop(group_key, None)
+            if self.dedup and len(tracks) > 1:
+                tracks = dedupe_tracks(tracks, find_duplicates(tracks))
+            results = create_playlist(group_key, tracks, self.playlists_dir) if tracks else []
+            new_paths = [path for path, _ in results]
+            written_names.update(os.path.basename(path) for path in new_paths)
+            if self.prune:
+                for old_path in self.group_playlists.get(group_key, ()):
+                    if old_path not in new_paths and os.path.exists(old_path):
+                        os.remove(old_path)
+                        print(f"Removed stale playlist: {old_path}")
+            if new_paths:
+                self.group_playlists[group_key] = new_paths
+            else:
+                self.group_playlists.pop(group_key, None)
+        if affected:
+            save_manifest(self.playlists_dir, read_manifest(self.playlists_dir) | written_names)
+        if self.tag_cache is not None:
+            self.tag_cache.commit()
+        return affected
+
+def watch_library(args, root_dir, index):
+    """Follow filesystem changes under root_dir and keep the playlists in sync until Ctrl+C."""
+    watcher = None
+    if not args.poll:
+        try:
+            watcher = InotifyWatcher(root_dir)
+            print(f"Watching {root_dir} (inotify, {len(watcher.wd_to_dir)} dirs). Press Ctrl+C to stop.")
+        except OSError as e:
+            print(f"inotify unavailable ({e}), falling back to polling")
+    if watcher is None:
+        watcher = PollingWatcher(root_dir, args.poll_interval)
+        print(f"Watching {root_dir} (polling every {args.poll_interval:g}s). Press Ctrl+C to stop.")
+
+    try:
+        while True:
+            changed = watcher.poll(None)
+            if not changed:
+                continue
+            # Debounce: keep collecting until the burst (e.g. an album copy) goes quiet
+            while True:
+                more = watcher.poll(args.debounce)
+                if not more:
+                    break
+                changed |= more
+            if watcher.overflow:
+                watcher.overflow = False
+                changed = set(index.dir_groups)
+                changed.update(d for d, _ in walk_audio_dirs(root_dir, {'dirs': 0, 'excluded': 0}, yield_empty=True))
+            started = time.perf_counter()
+            affected = index.update(changed)
+            print(f"Updated {len(changed)} dirs, {len(affected)} groups in {time.perf_counter() - started:.2f}s")
+    except KeyboardInterrupt:
+        print("Watch stopped.")
+    finally:
+        watcher.close()
+        if index.tag_cache is not None:
+            index.tag_cache.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate M3U8 playlists from a music folder, grouped by artist or album.")
+    parser.add_argument('root_dir', nargs='?', help=f"Root music directory (prompted if omitted, default: {DEFAULT_ROOT_DIR})")
+    parser.add_argument('playlists_dir', nargs='?', help=f"Output directory for playlists (default: {DEFAULT_PLAYLISTS_DIR})")
+    parser.add_argument('mode', nargs='?', help=f"Grouping mode: 'artist' or 'album' (default: {DEFAULT_MODE})")
+    parser.add_argument('--jobs', '-j', type=int, default=1, metavar='N',
+                        help="Parse tags in N worker processes (0 = number of CPUs, default: 1 = sequential)")
+    parser.add_argument('--dedup', action='store_true',
+                        help="Drop byte-identical copies of a track from each playlist (size, then partial, then full hash)")
+    parser.add_argument('--prune', action='store_true',
+                        help="Delete playlists written by earlier runs that this run did not produce (hand-made ones are kept)")
+    parser.add_argument('--watch', action='store_true',
+                        help="After the scan keep running and update playlists when files under root_dir change")
+    parser.add_argument('--poll', action='store_true',
+                        help="Watch by periodic rescans instead of inotify")
+    parser.add_argument('--poll-interval', type=float, default=WATCH_POLL_INTERVAL_S, metavar='SEC',
+                        help=f"Rescan interval for --poll (default: {WATCH_POLL_INTERVAL_S:g})")
+    parser.add_argument('--debounce', type=float, default=WATCH_DEBOUNCE_S, metavar='SEC',
+                        help=f"Quiet period before a burst of changes is applied (default: {WATCH_DEBOUNCE_S:g})")
+    args = parser.parse_args()
+    if args.poll_interval <= 0 or args.debounce < 0:
+        parser.error("--poll-interval must be > 0 and --debounce >= 0")
+    if args.jobs < 0:
+        parser.error("--jobs must be >= 0")
+    if args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
+    return args
 
 def main():
+    args = parse_args()
+
     # Print excluded for debugging
     if DEBUG:
         print("Excluded directories (normalized lower):")
@@ -223,20 +1167,20 @@ def main():
             print(ex)
 
     # Get root_dir, playlists_dir, mode: from args, or interactive, or default
-    if len(sys.argv) > 1:
-        root_dir = sys.argv[1]
+    if args.root_dir:
+        root_dir = args.root_dir
     else:
         root_dir_input = input(f"Enter root directory (default: {DEFAULT_ROOT_DIR}): ").strip()
         root_dir = root_dir_input if root_dir_input else DEFAULT_ROOT_DIR
 
-    if len(sys.argv) > 2:
-        playlists_dir = sys.argv[2]
+    if args.playlists_dir:
+        playlists_dir = args.playlists_dir
     else:
         playlists_dir_input = input(f"Enter playlists directory (default: {DEFAULT_PLAYLISTS_DIR}): ").strip()
         playlists_dir = playlists_dir_input if playlists_dir_input else DEFAULT_PLAYLISTS_DIR
 
-    if len(sys.argv) > 3:
-        mode = sys.argv[3].lower()
+    if args.mode:
+        mode = args.mode.lower()
     else:
         mode_input = input(f"Enter mode ('artist' or 'album', default: {DEFAULT_MODE}): ").strip().lower()
         mode = mode_input if mode_input else DEFAULT_MODE
@@ -249,95 +1193,93 @@ def main():
     # Ensure playlists_dir exists
     os.makedirs(playlists_dir, exist_ok=True)
 
-    processed_dirs = 0
-    skipped_dirs = 0
+    walk_stats = {'dirs': 0, 'excluded': 0}
     created_playlists = 0
+    playlist_files = []  # (playlist_path, written) for every playlist of this run
+    # --watch keeps per-directory groups and per-group playlist files for incremental updates
+    dir_groups = {} if args.watch else None
+    group_playlists = {}
+    dedup_stats = {}
+    dedup_workers = max(args.jobs, DEDUP_WORKERS)
 
+    group_to_tracks = defaultdict(set)  # Use set to avoid duplicates
     if mode == 'album':
-        # Album mode: group by folder name
-        for dirpath, dirnames, filenames in os.walk(root_dir):
-            processed_dirs += 1
-            abs_dirpath = os.path.normpath(os.path.abspath(dirpath)).lower()
-            if DEBUG:
-                print(f"Checking dir: {abs_dirpath}")
-            if abs_dirpath in EXCLUDED_DIRS and abs_dirpath != os.path.normpath(root_dir).lower():
-                if DEBUG:
-                    print(f"Skipping excluded dir: {dirpath}")
-                skipped_dirs += 1
-                dirnames[:] = []
-                continue
-
-            audio_files = set(os.path.abspath(os.path.join(dirpath, f)).replace('\\', '/') 
-                             for f in filenames if os.path.splitext(f)[1].lower() in AUDIO_EXTS)
-            if audio_files:
-                group_key = os.path.basename(dirpath)
-                create_playlist(group_key, audio_files, playlists_dir)
-                created_playlists += 1
+        # Album mode: group by folder name; same-named folders share one playlist, as in --watch
+        for dirpath, audio_files in walk_audio_dirs(root_dir, walk_stats):
+            groups = {os.path.basename(dirpath): audio_files}
+            merge_groups(group_to_tracks, groups)
+            if dir_groups is not None:
+                dir_groups[dirpath] = groups
     else:
         # Artist mode: group by metadata key, with per-folder compilation detection
-        group_to_tracks = defaultdict(set)  # Use set to avoid duplicates
-
-        for dirpath, dirnames, filenames in os.walk(root_dir):
-            processed_dirs += 1
-            abs_dirpath = os.path.normpath(os.path.abspath(dirpath)).lower()
-            if DEBUG:
-                print(f"Checking dir: {abs_dirpath}")
-            if abs_dirpath in EXCLUDED_DIRS and abs_dirpath != os.path.normpath(root_dir).lower():
-                if DEBUG:
-                    print(f"Skipping excluded dir: {dirpath}")
-                skipped_dirs += 1
-                dirnames[:] = []
-                continue
+        tag_cache = open_tag_cache(TAG_CACHE_PATH)
+        pool = ProcessPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else None
+        pending_dirs = []
 
-            dir_name = os.path.basename(dirpath)
+        def add_directory(dirpath, audio_files, file_tags):
+            groups = defaultdict(set)
+            group_directory(os.path.basename(dirpath), audio_files, file_tags, groups)
+            merge_groups(group_to_tracks, groups)
+            if dir_groups is not None:
+                dir_groups[dirpath] = groups
 
-            audio_files = set()
-            for f in filenames:
-                if os.path.splitext(f)[1].lower() in AUDIO_EXTS:
-                    full_path = os.path.abspath(os.path.join(dirpath, f)).replace('\\', '/')
-                    audio_files.add(full_path)
+        for dirpath, audio_files in walk_audio_dirs(root_dir, walk_stats):
+            if pool is None:
+                file_tags = {full_path: get_tags(full_path, tag_cache) for full_path in audio_files}
+                add_directory(dirpath, audio_files, file_tags)
+            else:
+                # Keep walking while workers parse; directories are grouped in walk order below
+                pending_dirs.append((dirpath, audio_files) + submit_directory(pool, audio_files, tag_cache))
 
-            if not audio_files:
-                continue
+        if pool is not None:
+            try:
+                for dirpath, audio_files, file_tags, pending in pending_dirs:
+                    collect_directory(file_tags, pending, tag_cache)
+                    add_directory(dirpath, audio_files, file_tags)
+            finally:
+                pool.shutdown()
 
-            # Detect if this folder is a compilation based on unique artists or compilation flag
-            unique_artists = set()
-            has_compilation_flag = False
-            for full_path in audio_files:
-                aa = get_metadata(full_path, 'albumartist') or get_metadata(full_path, 'artist') or 'Unknown'
-                unique_artists.add(str(aa).lower())  # Case-insensitive unique
-                if get_metadata(full_path, 'compilation'):
-                    has_compilation_flag = True
-
-            is_compilation_folder = len(unique_artists) >= UNIQUE_ARTIST_THRESHOLD or has_compilation_flag
-
-            if is_compilation_folder:
-                # Treat whole folder as one group, use common album if available, else dir_name
-                common_album = None
-                albums = set()
-                for full_path in audio_files:
-                    alb = get_metadata(full_path, 'album')
-                    if alb:
-                        albums.add(str(alb).lower())
-                if len(albums) == 1:
-                    common_album = next(iter(albums)).title()  # Use title case for niceness
-                group_key = common_album or dir_name
-                group_key = f"Various Artists - {group_key}" if group_key else 'Unknown Compilation'
-                for full_path in audio_files:
-                    group_to_tracks[group_key].add(full_path)
-            else:
-                # Normal per-track grouping
-                for full_path in audio_files:
-                    group_key = get_group_key(full_path, dir_name)
-                    group_to_tracks[group_key].add(full_path)
+        if tag_cache is not None:
+            pruned = tag_cache.prune(root_dir)
+            print(f"Tag cache: {tag_cache.hits} hits, {tag_cache.misses} parsed, {pruned} stale entries removed")
+            tag_cache.close()
 
-        # Create playlists
-        for group_key, tracks in group_to_tracks.items():
-            create_playlist(group_key, tracks, playlists_dir)
-            created_playlists += 1
+    if args.dedup:
+        all_tracks = set()
+        for tracks in group_to_tracks.values():
+            all_tracks.update(tracks)
+        canonical = find_duplicates(all_tracks, dedup_workers, dedup_stats)
+        for group_key in group_to_tracks:
+            group_to_tracks[group_key] = dedupe_tracks(group_to_tracks[group_key], canonical)
+
+    # Create playlists
+    for group_key, tracks in group_to_tracks.items():
+        results = create_playlist(group_key, tracks, playlists_dir)
+        playlist_files += results
+        created_playlists += 1
+        group_playlists[group_key] = [path for path, _ in results]
+
+    if args.dedup:
+        total = dedup_stats.get('bytes_total', 0)
+        read_share = 100.0 * dedup_stats.get('bytes_read', 0) / total if total else 0.0
+        print(f"Dedup: {dedup_stats.get('duplicates', 0)} duplicate files among {dedup_stats.get('files', 0)}, "
+              f"read {dedup_stats.get('bytes_read', 0) / 2 ** 20:.1f} MiB of {total / 2 ** 20:.1f} MiB ({read_share:.2f}%)")
+
+    removed_playlists = 0
+    owned_names = read_manifest(playlists_dir)
+    if args.prune:
+        removed_playlists = remove_stale_playlists(playlists_dir, [path for path, _ in playlist_files], owned_names)
+    save_manifest(playlists_dir, owned_names | set(os.path.basename(path) for path, _ in playlist_files))
 
     # Summary
-    print(f"Summary: Processed {processed_dirs} dirs, skipped {skipped_dirs} excluded, created {created_playlists} playlists.")
+    written = sum(1 for _, w in playlist_files if w)
+    print(f"Summary: Processed {walk_stats['dirs']} dirs, skipped {walk_stats['excluded']} excluded, created {created_playlists} playlists.")
+    print(f"Playlist files: {written} written, {len(playlist_files) - written} unchanged, {removed_playlists} removed.")
+
+    if args.watch:
+        tag_cache = open_tag_cache(TAG_CACHE_PATH) if mode != 'album' else None
+        index = LibraryIndex(mode, playlists_dir, dir_groups, group_playlists, tag_cache, args.prune, args.dedup)
+        watch_library(args, os.path.normpath(root_dir), index)
 
 if __name__ == "__main__":
     try: